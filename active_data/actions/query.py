@@ -11,6 +11,9 @@ from __future__ import division
 from __future__ import unicode_literals
 
 from collections import Mapping
+from itertools import islice
+from time import time
+from types import GeneratorType
 
 import flask
 import moz_sql_parser
@@ -21,8 +24,8 @@ from mo_logs.exceptions import Except
 from mo_logs.profiles import CProfiler
 from mo_logs.strings import expand_template
 from active_data import record_request, cors_wrapper
-from active_data.actions import save_query
-from mo_dots import coalesce, join_field, split_field, wrap, listwrap
+from active_data.actions import save_query, query_cache
+from mo_dots import coalesce, join_field, split_field, wrap, listwrap, Data
 from pyLibrary import convert
 from mo_files import File
 from mo_math import Math
@@ -32,9 +35,13 @@ from pyLibrary.queries.meta import TOO_OLD
 from mo_testing.fuzzytestcase import assertAlmostEqual
 from mo_threads import Till
 from mo_times.dates import Date
-from mo_times.durations import MINUTE
+from mo_times.durations import MINUTE, Duration
 from mo_times.timer import Timer
 
+STREAM_FORMATS = ("list", "table")  # FORMATS WITH A data ARRAY OF ROWS
+STREAM_THRESHOLD = 10000  # ROWS; BIGGER RESULTS ARE SENT AS A CHUNKED RESPONSE
+STREAM_BATCH = 1000  # ROWS PER CHUNK
+
 BLANK = convert.unicode2utf8(File("active_data/public/error.html").read())
 QUERY_SIZE_LIMIT = 10*1024*1024
 
@@ -71,10 +78,24 @@ def query(path):
                     if data.sql:
                         data = parse_sql(data.sql)
                     frum = wrap_from(data['from'])
-                    result = jx.run(data, frum=frum)
 
-                    if isinstance(result, Container):  #TODO: REMOVE THIS CHECK, jx SHOULD ALWAYS RETURN Containers
-                        result = result.format(data.format)
+                    cache_key = None
+                    result = None
+                    if query_cache.cache:
+                        cache_key = query_cache.cache.key(data, frum)
+                        result = query_cache.cache.get(cache_key)
+
+                    if result is None:
+                        result = jx.run(data, frum=frum)
+
+                        if isinstance(result, Container):  #TODO: REMOVE THIS CHECK, jx SHOULD ALWAYS RETURN Containers
+                            result = result.format(data.format)
+
+                        if cache_key:
+                            query_cache.cache.add(cache_key, result)
+                            result.meta.timing.cache = "miss"
+                    else:
+                        result.meta.timing.cache = "hit"
 
                 save_timer = Timer("save")
                 with save_timer:
@@ -87,6 +108,16 @@ def query(path):
                 result.meta.timing.preamble = Math.round(preamble_timer.duration.seconds, digits=4)
                 result.meta.timing.translate = Math.round(translate_timer.duration.seconds, digits=4)
                 result.meta.timing.save = Math.round(save_timer.duration.seconds, digits=4)
+
+                if _is_streamable(result):
+                    return Response(
+                        _stream(result, query_timer),
+                        status=200,
+                        headers={
+                            "Content-Type": result.meta.content_type
+                        }
+                    )
+
                 result.meta.timing.total = "{{TOTAL_TIME}}"  # TIMING PLACEHOLDER
 
                 with Timer("jsonification") as json_timer:
@@ -112,6 +143,72 @@ def query(path):
             return _send_error(query_timer, request_body, e)
 
 
+def _is_streamable(result):
+    """
+    :return: True IF result IS A BIG list OR table THAT SHOULD BE SENT IN CHUNKS
+    """
+    if not isinstance(result, Data) or result.meta.format not in STREAM_FORMATS:
+        return False
+    if isinstance(result.data, GeneratorType):
+        return True
+    return len(result.data) > STREAM_THRESHOLD
+
+
+def _stream(result, query_timer):
+    """
+    GENERATE THE JSON FOR result, STREAM_BATCH ROWS AT A TIME
+    meta IS SENT LAST SO THE TIMING CAN INCLUDE THE JSONIFICATION
+
+    THE FIRST CHUNK IS MADE BEFORE RETURNING, SO EARLY PROBLEMS ARE STILL
+    REPORTED AS AN ERROR RESPONSE
+    """
+    start = time()
+    rows = iter(result.data)
+    output = ["{"]
+    for k, v in result.items():
+        if k in ("data", "meta"):
+            continue
+        output.append(convert.value2json(k) + ": " + convert.value2json(v) + ",\n")
+    output.append('"data": [')
+    batch = list(islice(rows, STREAM_BATCH))
+    output.append(",\n".join(convert.value2json(r) for r in batch))
+    first = convert.unicode2utf8("".join(output))
+    return _stream_rest(result, rows, first, bool(batch), query_timer, time() - start)
+
+
+def _stream_rest(result, rows, first, more, query_timer, json_duration):
+    """
+    AN ERROR AFTER THE FIRST CHUNK CAN NOT CHANGE THE STATUS, SO IT IS
+    LOGGED, AND SENT AS meta.error AFTER THE ROWS ALREADY SENT
+    """
+    num_bytes = len(first)
+    yield first
+
+    while more:
+        start = time()
+        try:
+            batch = list(islice(rows, STREAM_BATCH))
+            chunk = convert.unicode2utf8("".join(",\n" + convert.value2json(r) for r in batch))
+        except Exception, e:
+            e = Except.wrap(e)
+            Log.warning("Problem streaming result", cause=e)
+            result.meta.error = e.__data__()
+            break
+        finally:
+            json_duration += time() - start
+        if not batch:
+            break
+        num_bytes += len(chunk)
+        yield chunk
+
+    result.meta.timing.total = Math.round(Duration(time() - query_timer.start).seconds, digits=4)
+    result.meta.timing.jsonification = Math.round(json_duration, digits=4)
+    chunk = convert.unicode2utf8('],\n"meta": ' + convert.value2json(result.meta) + "}")
+    num_bytes += len(chunk)
+    yield chunk
+    Log.note("Streamed {{num}} bytes in {{duration}}", num=num_bytes, duration=Duration(time() - query_timer.start))
+
+
 def _test_mode_wait(query):
     """
     WAIT FOR METADATA TO ARRIVE ON INDEX
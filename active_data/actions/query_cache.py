@@ -0,0 +1,128 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import json
+from copy import deepcopy
+
+from mo_collections.lru import LRU
+from mo_kwargs import override
+
+from mo_dots import Data, unwrap, split_field, join_field
+from mo_logs import Log
+from mo_threads import Lock
+from mo_times.dates import Date
+from pyLibrary.queries import meta
+from pyLibrary.queries.jx_usingES import FromES
+
+DEBUG = False
+
+cache = None  # SET BY app.setup() WHEN config.query_cache EXISTS
+
+
+class QueryCache(object):
+    """
+    REMEMBER RECENT QUERY RESULTS, KEYED ON THE NORMALIZED QUERY
+    ENTRIES ARE EVICTED WHEN TOO OLD, WHEN THERE ARE TOO MANY, OR
+    WHEN FromESMetadata SEES THE TABLE'S last_updated MOVE
+    """
+
+    @override
+    def __init__(
+        self,
+        max_size=1000,  # MAXIMUM NUMBER OF RESULTS TO KEEP
+        max_age=600,  # SECONDS BEFORE A RESULT IS CONSIDERED STALE
+        kwargs=None
+    ):
+        self.settings = kwargs
+        self.max_age = max_age
+        self.locker = Lock("query cache stats")
+        self.data = LRU(max_size, "query cache")  # MAP FROM KEY TO (expires, version, result)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query, frum):
+        """
+        :param query: THE QUERY, AFTER replace_vars()
+        :param frum: THE CONTAINER, AFTER wrap_from()
+        :return: THE KEY TO USE FOR THIS QUERY, OR None IF NOT CACHEABLE
+        """
+        if not isinstance(frum, FromES) or query.meta.testing or query.stream:
+            return None
+        table = join_field(split_field(frum.name)[0:1])
+        try:
+            return table, json.dumps(unwrap(query), sort_keys=True, default=unicode)
+        except Exception, e:
+            Log.warning("Can not make cache key", cause=e)
+            return None
+
+    def get(self, key):
+        """
+        :return: A COPY OF THE RESULT, OR None IF NOT FOUND
+        """
+        if key is None:
+            return None
+
+        now = Date.now().unix
+        version = _get_version(key[0])
+        entry = self.data.get(key)
+        if entry is not None:
+            expires, old_version, result = entry
+            if expires < now or old_version != version:
+                if DEBUG:
+                    Log.note("expire cached result for {{table}}", table=key[0])
+                self.data.pop(key)
+                entry = None
+
+        with self.locker:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _copy_result(result)
+
+    def add(self, key, result):
+        if key is None:
+            return
+
+        self.data.add(key, (Date.now().unix + self.max_age, _get_version(key[0]), _copy_result(result)))
+
+    def clear(self):
+        self.data.clear()
+
+    @property
+    def stats(self):
+        with self.locker:
+            return Data(
+                size=len(self.data),
+                hits=self.hits,
+                misses=self.misses
+            )
+
+
+def _get_version(table_name):
+    """
+    :return: A VALUE THAT CHANGES WHEN THE TABLE IS SEEN TO CHANGE
+    """
+    if not meta.singlton:
+        return None
+    last_updated = meta.singlton.get_table(table_name)[0].last_updated
+    if last_updated == None:
+        return None
+    return Date(last_updated).unix
+
+
+def _copy_result(result):
+    """
+    CALLERS CHANGE THE RESULT (meta.timing, AT LEAST), SO NO ONE MAY SHARE
+    ANY PART OF IT WITH THE CACHE
+    """
+    return deepcopy(result)
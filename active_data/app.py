@@ -25,9 +25,10 @@ import active_data
 from mo_logs import Log
 from mo_logs import constants, startup
 from active_data import record_request, cors_wrapper
-from active_data.actions import save_query
+from active_data.actions import save_query, query_cache
 from active_data.actions.json import get_raw_json
 from active_data.actions.query import query
+from active_data.actions.query_cache import QueryCache
 from active_data.actions.save_query import SaveQueries, find_query
 from active_data.actions.static import download
 from pyLibrary import convert
@@ -113,6 +114,8 @@ def setup(settings=None):
         FromESMetadata(config.elasticsearch)
         if config.saved_queries:
             setattr(save_query, "query_finder", SaveQueries(config.saved_queries))
+        if config.query_cache:
+            setattr(query_cache, "cache", QueryCache(config.query_cache))
         HeaderRewriterFix(app, remove_headers=['Date', 'Server'])
 
         if config.flask.ssl_context:
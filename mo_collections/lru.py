@@ -0,0 +1,56 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+from mo_threads import Lock
+
+
+class LRU(object):
+    """
+    THREAD-SAFE MAP OF AT MOST max_size ENTRIES
+    WHEN FULL, THE LEAST RECENTLY USED ENTRY IS DROPPED
+    None IS NOT A VALUE, get() RETURNS default FOR IT
+    """
+
+    def __init__(self, max_size, name=None):
+        self.max_size = max_size
+        self.locker = Lock(name)
+        self.data = OrderedDict()  # LEAST RECENTLY USED FIRST
+
+    def get(self, key, default=None):
+        with self.locker:
+            value = self.data.pop(key, None)
+            if value is None:
+                return default
+            self.data[key] = value  # MOST RECENTLY USED GOES TO THE END
+            return value
+
+    def add(self, key, value):
+        with self.locker:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.locker:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.locker:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
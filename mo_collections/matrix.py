@@ -11,6 +11,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import itertools
+from array import array
+
 from mo_dots import Null, Data, coalesce, get_module
 from mo_kwargs import override
 from mo_logs import Log
@@ -20,11 +23,20 @@ from mo_logs.exceptions import suppress_exception
 class Matrix(object):
     """
     SIMPLE n-DIMENSIONAL ARRAY OF OBJECTS
+
+    WITH flat=True THE CELLS ARE KEPT IN ONE CONTIGUOUS ROW-MAJOR SEQUENCE:
+    AN array OF NUMBERS (WITH A NULL MASK) WHEN zeros IS A NUMBER, A SINGLE
+    list OTHERWISE.  THE NESTED LISTS ARE ONLY BUILT IF SOMEONE ASKS FOR
+    .cube, AFTER WHICH THE MATRIX STAYS NESTED
     """
     ZERO = None
 
     @override
-    def __init__(self, dims=[], list=None, value=None, zeros=None, kwargs=None):
+    def __init__(self, dims=[], list=None, value=None, zeros=None, flat=False, kwargs=None):
+        self._flat = None  # ROW-MAJOR CELLS, WHEN IN FLAT MODE
+        self._nulls = None  # bytearray MASK OF NULL CELLS, ONLY FOR array STORAGE
+        self._cube = None
+
         if list:
             self.num = 1
             self.dims = (len(list), )
@@ -39,6 +51,11 @@ class Matrix(object):
 
         self.num = len(dims)
         self.dims = tuple(dims)
+        if flat and self.num and all(d > 0 for d in dims):
+            self._strides = _strides(self.dims)
+            self._flat = _flat_zeros(_product(self.dims), zeros)
+            return
+
         if zeros != None:
             if self.num == 0 or any(d == 0 for d in dims):  #NO DIMS, OR HAS A ZERO DIM, THEN IT IS A NULL CUBE
                 if hasattr(zeros, "__call__"):
@@ -60,7 +77,60 @@ class Matrix(object):
         output.cube = array
         return output
 
+    @property
+    def cube(self):
+        if self._flat is not None:
+            # NESTED LISTS REQUESTED, CONVERT FOR GOOD SO CHANGES TO THEM ARE SEEN
+            self._cube = _nest(self._values(), self.dims)
+            self._flat = None
+            self._nulls = None
+        return self._cube
+
+    @cube.setter
+    def cube(self, value):
+        self._flat = None
+        self._nulls = None
+        self._cube = value
+
+    def _offset(self, coord):
+        """
+        :return: INDEX INTO self._flat FOR THE GIVEN coord, OR None IF coord IS NOT A SIMPLE CELL
+        """
+        if len(coord) != self.num:
+            return None
+        offset = 0
+        for c, d, s in zip(coord, self.dims, self._strides):
+            if c.__class__ not in (int, long) or not 0 <= c < d:
+                return None
+            offset += c * s
+        return offset
+
+    def _values(self):
+        """
+        :return: LIST OF ALL CELL VALUES, IN ROW-MAJOR ORDER
+        """
+        flat = self._flat
+        if isinstance(flat, array):
+            nulls = self._nulls
+            if nulls is None:
+                return flat.tolist()
+            return [None if n else v for v, n in itertools.izip(flat, nulls)]
+        return flat
+
+    def _to_list(self):
+        self._flat = self._values()
+        self._nulls = None
+
     def __getitem__(self, index):
+        if self._flat is not None:
+            if not isinstance(index, (list, tuple)):
+                index = (index,)
+            offset = self._offset(index)
+            if offset is not None:
+                if self._nulls is not None and self._nulls[offset]:
+                    return None
+                return self._flat[offset]
+
         if not isinstance(index, (list, tuple)):
             if isinstance(index, slice):
                 sub = self.cube[index]
@@ -87,6 +157,34 @@ class Matrix(object):
         return output
 
     def __setitem__(self, key, value):
+        if self._flat is not None:
+            if not isinstance(key, (list, tuple)):
+                key = (key,)
+            offset = self._offset(key)
+            if offset is None:
+                Log.error("Expecting coordinates to match the number of dimensions")
+            flat = self._flat
+            if not isinstance(flat, array):
+                flat[offset] = value
+                return
+            if value.__class__ in _TYPECODES[flat.typecode]:
+                try:
+                    flat[offset] = value
+                    if self._nulls is not None:
+                        self._nulls[offset] = 0
+                    return
+                except OverflowError:
+                    pass
+            elif value == None:
+                if self._nulls is None:
+                    self._nulls = bytearray(len(flat))
+                self._nulls[offset] = 1
+                return
+            # NOT A NUMBER THE array CAN HOLD, FALL BACK TO A list
+            self._to_list()
+            self._flat[offset] = value
+            return
+
         try:
             if self.num == 1:
                 if isinstance(key, int):
@@ -109,10 +207,10 @@ class Matrix(object):
             Log.error("can not set item", e)
 
     def __bool__(self):
-        return self.cube != None
+        return self._flat is not None or self._cube != None
 
     def __nonzero__(self):
-        return self.cube != None
+        return self._flat is not None or self._cube != None
 
     def __len__(self):
         if self.num == 0:
@@ -167,8 +265,7 @@ class Matrix(object):
         return other / self.value
 
     def __iter__(self):
-        # TODO: MAKE THIS FASTER BY NOT CALLING __getitem__ (MAKES CUBE OBJECTS)
-        return ((c, self[c]) for c in self._all_combos())
+        return self.items()
 
     def __float__(self):
         return self.value
@@ -184,29 +281,44 @@ class Matrix(object):
         offsets = []
         new_dim = []
         acc = 1
-        for i, d in reversed(enumerate(self.dims)):
+        for i, d in reversed(list(enumerate(self.dims))):
             if not io_select[i]:
                 new_dim.insert(0, d)
-            offsets.insert(0, acc * io_select[i])
-            acc *= d
+                offsets.insert(0, 0)
+            else:
+                offsets.insert(0, acc)
+                acc *= d
 
         if not new_dim:
             # WHEN groupby ALL DIMENSIONS, ONLY THE VALUES REMAIN
             # RETURN AN ITERATOR OF PAIRS (c, v), WHERE
             # c - COORDINATES INTO THE CUBE
             # v - VALUE AT GIVEN COORDINATES
-            return ((c, self[c]) for c in self._all_combos())
-        else:
-            output = [[None, Matrix(dims=new_dim)] for i in range(acc)]
-            _groupby(self.cube, 0, offsets, 0, output, tuple(), [])
-
+            return self.items()
+
+        output = [[None, Matrix(dims=new_dim, flat=True)] for i in range(acc)]
+        for c, v in self.items():
+            offset = 0
+            group = []
+            new_coord = []
+            for cc, o, s in zip(c, offsets, io_select):
+                if s:
+                    offset += cc * o
+                    group.append(cc)
+                else:
+                    group.append(-1)
+                    new_coord.append(cc)
+            output[offset][0] = tuple(group)
+            output[offset][1][new_coord] = v
         return output
 
     def aggregate(self, type):
         func = aggregates[type]
-        if not type:
+        if not func:
             Log.error("Aggregate of type {{type}} is not supported yet",  type= type)
 
+        if self._flat is not None:
+            return func(1, self._values())
         return func(self.num, self.cube)
 
 
@@ -215,15 +327,20 @@ class Matrix(object):
         IT IS EXPECTED THE method ACCEPTS (value, coord, cube), WHERE
         value - VALUE FOUND AT ELEMENT
         coord - THE COORDINATES OF THE ELEMENT (PLEASE, READ ONLY)
-        cube - THE WHOLE CUBE, FOR USE IN WINDOW FUNCTIONS
+        cube - THE WHOLE MATRIX, FOR USE IN WINDOW FUNCTIONS
         """
-        for c in self._all_combos():
-            method(self[c], c, self.cube)
+        for c, v in self.items():
+            method(v, c, self)
 
     def items(self):
         """
         ITERATE THROUGH ALL coord, value PAIRS
         """
+        if self._flat is not None:
+            return itertools.izip(itertools.product(*[xrange(d) for d in self.dims]), self._values())
+        return self._nested_items()
+
+    def _nested_items(self):
         for c in self._all_combos():
             _, value = _getitem(self.cube, c)
             yield c, value
@@ -302,20 +419,47 @@ def _zeros(dims, zero):
         return [_zeros(dims[1::], zero) for _ in range(d0)]
 
 
-def _groupby(cube, depth, intervals, offset, output, group, new_coord):
-    if depth == len(intervals):
-        output[offset][0] = group
-        output[offset][1][new_coord] = cube
-        return
+# PYTHON TYPES EACH array TYPECODE CAN HOLD WITHOUT CHANGING THE VALUE
+_TYPECODES = {
+    "l": (int, long),
+    "d": (float,)
+}
 
-    interval = intervals[depth]
 
-    if interval:
-        for i, c in enumerate(cube):
-            _groupby(c, depth + 1, intervals, offset + i * interval, output, group + (i, ), new_coord)
-    else:
-        for i, c in enumerate(cube):
-            _groupby(c, depth + 1, intervals, offset, output, group + (-1, ), new_coord + [i])
+def _flat_zeros(size, zero):
+    """
+    :return: ROW-MAJOR STORAGE FOR size CELLS, ALL SET TO zero
+    """
+    if hasattr(zero, "__call__"):
+        return [zero() for _ in xrange(size)]
+    if zero is None:
+        return [Null] * size
+    for typecode, types in _TYPECODES.items():
+        if zero.__class__ in types:
+            try:
+                return array(str(typecode), [zero]) * size
+            except OverflowError:
+                break
+    return [zero] * size
+
+
+def _strides(dims):
+    output = []
+    acc = 1
+    for d in reversed(dims):
+        output.insert(0, acc)
+        acc *= d
+    return tuple(output)
+
+
+def _nest(values, dims):
+    """
+    CONVERT ROW-MAJOR values TO NESTED LISTS
+    """
+    if len(dims) == 1:
+        return list(values)
+    step = _product(dims[1:])
+    return [_nest(values[i:i + step], dims[1:]) for i in xrange(0, len(values), step)]
 
 
 
@@ -0,0 +1,231 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import struct
+
+from mo_json import value2json
+
+# BOUNDED-MEMORY, MERGEABLE SUMMARIES OF A STREAM OF VALUES
+
+DEFAULT_COMPRESSION = 100  # t-digest CENTROID BUDGET
+BUFFER_FACTOR = 5  # NUMBER OF UNMERGED VALUES (PER compression) TO COLLECT BEFORE COMPRESSING
+DEFAULT_PRECISION = 12  # HyperLogLog USES 2**precision REGISTERS
+
+_MASK64 = (1 << 64) - 1
+
+
+class TDigest(object):
+    """
+    MERGING t-digest (Dunning & Ertl, 2019) FOR APPROXIMATE QUANTILES
+
+    MEMORY IS O(compression) CENTROIDS, NO MATTER HOW MANY VALUES ARE ADDED.
+    THE ERROR IS IN RANK, AND SHRINKS TOWARD THE TAILS: WITH THE DEFAULT
+    compression=100 (~60 CENTROIDS) THE RANK ERROR IS WELL UNDER 0.5%, AND
+    UNDER q*(1-q)/2 NEAR THE TAILS (ABOUT 0.05% AT THE 99.9th PERCENTILE).
+    WHILE FEWER THAN ~compression/2 VALUES ARE SEEN THE RESULT IS EXACT.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = []  # CENTROID MEANS, ASCENDING
+        self.counts = []  # CENTROID WEIGHTS
+        self.buffer = []  # (value, count) PAIRS NOT YET MERGED INTO THE CENTROIDS
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buffer.append((value, count))
+        self.total += count
+        if len(self.buffer) >= BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        if not other.total:
+            return
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.buffer.extend(zip(other.means, other.counts))
+        self.buffer.extend(other.buffer)
+        self.total += other.total
+        self._compress()
+
+    def quantile(self, q):
+        """
+        :param q: QUANTILE, BETWEEN 0 AND 1
+        :return: ESTIMATE OF THE VALUE AT q, INTERPOLATED LIKE mo_math.stats.percentile()
+        """
+        self._compress()
+        if not self.total:
+            return None
+
+        means, counts = self.means, self.counts
+        if len(means) == 1:
+            return means[0]
+
+        # CENTROID i IS CENTERED AT RANK cumulative + counts[i]/2; VALUE RANK r IS AT r+0.5
+        target = q * (self.total - 1) + 0.5
+        cumulative = 0
+        previous_center = None
+        for i, (m, c) in enumerate(zip(means, counts)):
+            center = cumulative + c / 2
+            if target <= center:
+                if previous_center is None:
+                    # BETWEEN min AND THE FIRST CENTROID
+                    if center <= 0.5:
+                        return m
+                    return _interpolate(self.min, m, (target - 0.5) / (center - 0.5))
+                return _interpolate(means[i - 1], m, (target - previous_center) / (center - previous_center))
+            previous_center = center
+            cumulative += c
+
+        # BETWEEN THE LAST CENTROID AND max
+        end = self.total - 0.5
+        if end <= previous_center:
+            return means[-1]
+        return _interpolate(means[-1], self.max, (target - previous_center) / (end - previous_center))
+
+    def _compress(self):
+        if not self.buffer:
+            return
+        points = sorted(zip(self.means, self.counts) + self.buffer)
+        self.buffer = []
+
+        total = self.total
+        means = []
+        counts = []
+        so_far = 0  # WEIGHT OF THE CENTROIDS ALREADY EMITTED
+        q_limit = self._q_limit(0)
+        mean, count = points[0]
+        for m, c in points[1:]:
+            if (so_far + count + c) / total <= q_limit:
+                count += c
+                mean += (m - mean) * c / count
+            else:
+                means.append(mean)
+                counts.append(count)
+                so_far += count
+                q_limit = self._q_limit(so_far / total)
+                mean, count = m, c
+        means.append(mean)
+        counts.append(count)
+        self.means = means
+        self.counts = counts
+
+    def _q_limit(self, q):
+        """
+        :return: LARGEST QUANTILE A CENTROID STARTING AT q MAY REACH (k1 SCALE FUNCTION)
+        """
+        k = self.compression / (2 * math.pi) * math.asin(2 * min(q, 1) - 1)
+        return (math.sin(min(k + 1, self.compression / 4) * 2 * math.pi / self.compression) + 1) / 2
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog (Flajolet et al, 2007) FOR APPROXIMATE DISTINCT COUNTS
+
+    MEMORY IS AT MOST 2**precision BYTES; THE REGISTERS ARE KEPT IN A dict
+    UNTIL THAT IS LARGER.  THE STANDARD ERROR IS 1.04/sqrt(2**precision),
+    ABOUT 1.6% FOR THE DEFAULT precision=12.  SMALL CARDINALITIES USE
+    LINEAR COUNTING, AND ARE NEARLY EXACT.
+
+    VALUES ARE HASHED BY THEIR JSON, SO THEY MUST BE JSON-ABLE, AND SKETCHES
+    BUILT BY DIFFERENT PROCESSES CAN BE MERGED
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = {}  # SPARSE UNTIL IT IS BIGGER THAN A bytearray
+
+    def add(self, value):
+        h = _mix(_hash(value))
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self._get(index):
+            self.registers[index] = rank
+            if isinstance(self.registers, dict) and len(self.registers) > self.size // 8:
+                self._densify()
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can not merge HyperLogLog of different precision")
+        if isinstance(other.registers, dict):
+            pairs = other.registers.items()
+        else:
+            pairs = ((i, r) for i, r in enumerate(other.registers) if r)
+        for i, r in pairs:
+            if r > self._get(i):
+                self.registers[i] = r
+        if isinstance(self.registers, dict) and len(self.registers) > self.size // 8:
+            self._densify()
+
+    def cardinality(self):
+        m = self.size
+        registers = self.registers
+        if isinstance(registers, dict):
+            zeros = m - len(registers)
+            harmonic = zeros + sum(2.0 ** -r for r in registers.values())
+        else:
+            zeros = registers.count(b"\x00")
+            harmonic = sum(2.0 ** -r for r in registers)
+
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / harmonic
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # LINEAR COUNTING
+        return int(round(estimate))
+
+    def _get(self, index):
+        if isinstance(self.registers, dict):
+            return self.registers.get(index, 0)
+        return self.registers[index]
+
+    def _densify(self):
+        dense = bytearray(self.size)
+        for i, r in self.registers.items():
+            dense[i] = r
+        self.registers = dense
+
+
+def _interpolate(a, b, fraction):
+    return a + (b - a) * fraction
+
+
+def _hash(value):
+    """
+    FIRST 64 BITS OF THE md5 OF THE JSON; UNLIKE hash() IT IS THE SAME IN EVERY PROCESS, AND hash(-1)==hash(-2)
+    """
+    return struct.unpack(b"<Q", hashlib.md5(value2json(value).encode("utf8")).digest()[:8])[0]
+
+
+def _mix(h):
+    """
+    murmur3 64-BIT FINALIZER, SO SMALL INTEGERS (WHICH HASH TO THEMSELVES) SPREAD OVER ALL BITS
+    """
+    h &= _MASK64
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _MASK64
+    h ^= h >> 33
+    return h
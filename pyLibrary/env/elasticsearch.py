@@ -14,10 +14,11 @@ from __future__ import unicode_literals
 import re
 from collections import Mapping
 from copy import deepcopy
+from numbers import Number
 
 import mo_json
 from mo_logs import Log, strings
-from mo_logs.exceptions import Except
+from mo_logs.exceptions import Except, ERROR
 from mo_logs.strings import utf82unicode
 from mo_threads import Lock
 from mo_dots import coalesce, Null, Data, set_default, join_field, split_field, listwrap, literal_field, \
@@ -27,13 +28,14 @@ from mo_dots.lists import FlatList
 from pyLibrary import convert
 from pyLibrary.env import http
 from mo_json.typed_encoder import json2typed
-from mo_math import Math
+from mo_math import Math, MAX
 from mo_math.randoms import Random
 from mo_kwargs import override
 from pyLibrary.queries import jx
-from mo_threads import ThreadedQueue
+from mo_threads import ThreadedQueue, Thread, Queue, Signal, THREAD_STOP
 from mo_threads import Till
 from mo_times.dates import Date
+from mo_times.durations import Duration
 from mo_times.timer import Timer
 
 ES_STRUCT = ["object", "nested"]
@@ -419,6 +421,13 @@ class Index(Features):
                 else:
                     show_query = query
                 Log.note("Query:\n{{query|indent}}", query=show_query)
+            if self.cluster.multi_search:
+                return self.cluster.multi_search.search(
+                    self.path,
+                    query,
+                    timeout=coalesce(timeout, self.settings.timeout),
+                    retry=retry
+                )
             return self.cluster.post(
                 self.path + "/_search",
                 data=query,
@@ -433,6 +442,12 @@ class Index(Features):
                 cause=e
             )
 
+    def scroll(self, query, keep_alive="5m", timeout=None):
+        """
+        GENERATE PAGES OF HITS, query.size AT A TIME, UNTIL ALL HITS ARE SENT
+        """
+        return _scroll(self, query, keep_alive, coalesce(timeout, self.settings.timeout))
+
     def threaded_queue(self, batch_size=None, max_size=None, period=None, silent=False):
         def errors(e, _buffer):  # HANDLE ERRORS FROM extend()
             if e.cause.cause:
@@ -495,23 +510,45 @@ class Cluster(object):
         return cluster
 
     @override
-    def __init__(self, host, port=9200, explore_metadata=True, kwargs=None):
+    def __init__(self, host, port=9200, explore_metadata=True, http_pool=None, multi_search=None, kwargs=None):
         """
         settings.explore_metadata == True - IF PROBING THE CLUSTER FOR METADATA IS ALLOWED
         settings.timeout == NUMBER OF SECONDS TO WAIT FOR RESPONSE, OR SECONDS TO WAIT FOR DOWNLOAD (PASSED TO requests)
+        settings.http_pool == {"size": n, "idle_timeout": seconds} FOR A CLUSTER-SPECIFIC CONNECTION POOL
+        settings.multi_search == {"window": seconds, "max_size": n} TO BATCH CONCURRENT SEARCHES INTO ONE _msearch
         """
         if hasattr(self, "settings"):
             return
 
         self.settings = kwargs
+        if http_pool:
+            self.http_pool = http.SessionPool(kwargs=http_pool)
+        else:
+            self.http_pool = http.default_pool
         self.cluster_state = None
         self._metadata = None
         self.metadata_locker = Lock()
         self.debug = kwargs.debug
         self.version = None
         self.path = kwargs.host + ":" + unicode(kwargs.port)
+        if multi_search:
+            self.multi_search = MultiSearch(self, kwargs=multi_search)
+        else:
+            self.multi_search = None
+        self.background_search = None
         self.get_metadata()
 
+    def get_multi_search(self):
+        """
+        :return: A MultiSearch FOR WORK THAT CAN WAIT FOR A BATCH (LIKE METADATA SCANS), EVEN IF settings.multi_search IS NOT SET
+        """
+        if self.multi_search:
+            return self.multi_search
+        with self.metadata_locker:
+            if not self.background_search:
+                self.background_search = MultiSearch(self)
+            return self.background_search
+
     @override
     def get_or_create_index(
         self,
@@ -686,7 +723,7 @@ class Cluster(object):
 
         url = self.settings.host + ":" + unicode(self.settings.port) + "/" + index_name
         try:
-            response = http.delete(url)
+            response = http.delete(url, pool=self.http_pool)
             if response.status_code != 200:
                 Log.error("Expecting a 200, got {{code}}", code=response.status_code)
             details = mo_json.json2value(utf82unicode(response.content))
@@ -752,6 +789,7 @@ class Cluster(object):
 
             if self.debug:
                 Log.note("POST {{url}}", url=url)
+            kwargs.setdefault(b"pool", self.http_pool)
             response = http.post(url, **kwargs)
             if response.status_code not in [200, 201]:
                 Log.error(response.reason.decode("latin1") + ": " + strings.limit(response.content.decode("latin1"), 100 if self.debug else 10000))
@@ -784,6 +822,7 @@ class Cluster(object):
     def delete(self, path, **kwargs):
         url = self.settings.host + ":" + unicode(self.settings.port) + path
         try:
+            kwargs.setdefault(b"pool", self.http_pool)
             response = http.delete(url, **kwargs)
             if response.status_code not in [200]:
                 Log.error(response.reason+": "+response.all_content)
@@ -801,6 +840,7 @@ class Cluster(object):
         try:
             if self.debug:
                 Log.note("GET {{url}}", url=url)
+            kwargs.setdefault(b"pool", self.http_pool)
             response = http.get(url, **kwargs)
             if response.status_code not in [200]:
                 Log.error(response.reason + ": " + response.all_content)
@@ -816,6 +856,7 @@ class Cluster(object):
     def head(self, path, **kwargs):
         url = self.settings.host + ":" + unicode(self.settings.port) + path
         try:
+            kwargs.setdefault(b"pool", self.http_pool)
             response = http.head(url, **kwargs)
             if response.status_code not in [200]:
                 Log.error(response.reason+": "+response.all_content)
@@ -838,6 +879,7 @@ class Cluster(object):
             sample = kwargs["data"][:300]
             Log.note("PUT {{url}}:\n{{data|indent}}", url=url, data=sample)
         try:
+            kwargs.setdefault(b"pool", self.http_pool)
             response = http.put(url, **kwargs)
             if response.status_code not in [200]:
                 Log.error(response.reason+": "+response.all_content)
@@ -848,6 +890,127 @@ class Cluster(object):
             Log.error("Problem with call to {{url}}",  url= url, cause=e)
 
 
+class MultiSearch(object):
+    """
+    GATHER THE SEARCHES ARRIVING, FROM ANY THREAD, WITHIN window SECONDS
+    INTO ONE _msearch REQUEST, AND HAND EACH CALLER ITS OWN RESPONSE
+    """
+
+    @override
+    def __init__(
+        self,
+        cluster,
+        window=0.01,  # SECONDS TO WAIT FOR MORE SEARCHES AFTER THE FIRST ARRIVES
+        max_size=100,  # MAXIMUM NUMBER OF SEARCHES IN ONE _msearch
+        kwargs=None
+    ):
+        self.cluster = cluster
+        self.window = window
+        self.max_size = max_size
+        self.queue = Queue("multi search for " + cluster.path, silent=True)
+        self.worker = Thread.run("multi search for " + cluster.path, self._worker)
+
+    def search(self, path, query, timeout=None, retry=None):
+        """
+        :param path: THE INDEX (AND TYPE) PATH TO SEARCH
+        :param query: THE ES QUERY
+        :param retry: {"times": x, "sleep": y} STRUCTURE, SAME AS http.request()
+        :return: THE SAME RESPONSE _search WOULD GIVE
+        """
+        if retry == None:
+            retry = Data(times=1, sleep=0)
+        elif isinstance(retry, Number):
+            retry = Data(times=retry, sleep=1)
+        else:
+            retry = wrap(retry)
+            if isinstance(retry.sleep, Duration):
+                retry.sleep = retry.sleep.seconds
+            set_default(retry, {"times": 1, "sleep": 0})
+
+        errors = []
+        for r in range(retry.times):
+            if r:
+                Till(seconds=retry.sleep).wait()
+            if not self.worker.is_alive():
+                Log.error("multi search has been stopped")
+            request = _Search(path, query, timeout)
+            self.queue.add(request)
+            request.done.wait()
+            if not request.error:
+                return request.response
+            errors.append(request.error)
+        Log.error("Tried {{times}} times: Problem with search in _msearch", times=retry.times, cause=errors[0])
+
+    def stop(self):
+        self.worker.stop()
+        self.worker.join()
+
+    def _worker(self, please_stop):
+        while not please_stop:
+            first = self.queue.pop(till=please_stop)
+            if first is THREAD_STOP or first is None:
+                break
+            Till(seconds=self.window).wait()
+            pending = [first] + self.queue.pop_all()
+            for i in range(0, len(pending), self.max_size):
+                self._send(pending[i:i + self.max_size:])
+
+        # RELEASE ANY CALLERS STILL WAITING
+        for r in self.queue.pop_all():
+            if isinstance(r, _Search):
+                r.error = Except(type=ERROR, template="Shutdown before search was sent")
+                r.done.go()
+
+    def _send(self, batch):
+        try:
+            lines = []
+            for r in batch:
+                index_type = r.path.strip("/").split("/")
+                header = {"index": index_type[0]}
+                if len(index_type) > 1 and index_type[1]:
+                    header["type"] = index_type[1]
+                lines.append(convert.value2json(header))
+                lines.append(convert.value2json(r.query))
+
+            if self.cluster.debug:
+                Log.note("_msearch with {{num}} searches", num=len(batch))
+            result = self.cluster.post(
+                "/_msearch",
+                data=convert.unicode2utf8("\n".join(lines) + "\n"),
+                timeout=MAX([r.timeout for r in batch])
+            )
+            for r, response in zip(batch, result.responses):
+                if response.error:
+                    r.error = Except(type=ERROR, template=convert.quote2string(response.error))
+                elif response._shards.failed > 0:
+                    r.error = Except(
+                        type=ERROR,
+                        template="Shard failures {{failures|indent}}",
+                        params={"failures": "---\n".join(f.replace(";", ";\n") for f in response._shards.failures.reason)}
+                    )
+                else:
+                    r.response = response
+        except Exception, e:
+            e = Except.wrap(e)
+            for r in batch:
+                r.error = e
+        finally:
+            for r in batch:
+                r.done.go()
+
+
+class _Search(object):
+    __slots__ = ["path", "query", "timeout", "response", "error", "done"]
+
+    def __init__(self, path, query, timeout):
+        self.path = path
+        self.query = query
+        self.timeout = timeout
+        self.response = None
+        self.error = None
+        self.done = Signal("search done")
+
+
 def proto_name(prefix, timestamp=None):
     if not timestamp:
         timestamp = Date.now()
@@ -1051,7 +1214,7 @@ class Alias(Features):
                             message=status._shards.failures[0].reason
                         )
 
-    def search(self, query, timeout=None):
+    def search(self, query, timeout=None, retry=None):
         query = wrap(query)
         try:
             if self.debug:
@@ -1061,10 +1224,18 @@ class Alias(Features):
                 else:
                     show_query = query
                 Log.note("Query {{path}}\n{{query|indent}}", path=self.path + "/_search", query=show_query)
+            if self.cluster.multi_search:
+                return self.cluster.multi_search.search(
+                    self.path,
+                    query,
+                    timeout=coalesce(timeout, self.settings.timeout),
+                    retry=retry
+                )
             return self.cluster.post(
                 self.path + "/_search",
                 data=query,
-                timeout=coalesce(timeout, self.settings.timeout)
+                timeout=coalesce(timeout, self.settings.timeout),
+                retry=retry
             )
         except Exception, e:
             Log.error(
@@ -1074,6 +1245,54 @@ class Alias(Features):
                 cause=e
             )
 
+    def scroll(self, query, keep_alive="5m", timeout=None):
+        """
+        GENERATE PAGES OF HITS, query.size AT A TIME, UNTIL ALL HITS ARE SENT
+        """
+        return _scroll(self, query, keep_alive, coalesce(timeout, self.settings.timeout))
+
+
+def _scroll(es, query, keep_alive, timeout):
+    """
+    :param es: Index OR Alias TO SEARCH
+    :param query: THE ES QUERY, size IS THE NUMBER OF HITS PER PAGE
+    :param keep_alive: HOW LONG ES SHOULD KEEP THE SCROLL CONTEXT BETWEEN PAGES
+    :return: GENERATOR OF hits.hits PAGES
+    """
+    query = wrap(query)
+    scroll_id = None
+    try:
+        if es.debug:
+            Log.note("Scroll {{path}}\n{{query|indent}}", path=es.path + "/_search", query=query)
+        result = es.cluster.post(
+            es.path + "/_search?scroll=" + keep_alive,
+            data=query,
+            timeout=timeout
+        )
+        while True:
+            scroll_id = result._scroll_id
+            if not result.hits.hits:
+                return
+            yield result.hits.hits
+            result = es.cluster.post(
+                "/_search/scroll?scroll=" + keep_alive,
+                data=convert.unicode2utf8(scroll_id),
+                timeout=timeout
+            )
+    except Exception, e:
+        Log.error(
+            "Problem with scroll (path={{path}}):\n{{query|indent}}",
+            path=es.path + "/_search",
+            query=query,
+            cause=e
+        )
+    finally:
+        if scroll_id:
+            try:
+                es.cluster.delete("/_search/scroll", data=convert.unicode2utf8(scroll_id))
+            except Exception, e:
+                Log.warning("Could not clear scroll", cause=e)
+
 
 def parse_properties(parent_index_name, parent_name, esProperties):
     """
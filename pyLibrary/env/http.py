@@ -24,9 +24,13 @@ from copy import copy
 from mmap import mmap
 from numbers import Number
 from tempfile import TemporaryFile
+from time import time
+from urlparse import urlparse
 
 from requests import sessions, Response
 
+from mo_kwargs import override
+
 import mo_json
 from pyLibrary import convert
 from mo_logs.exceptions import Except
@@ -91,13 +95,33 @@ def request(method, url, zip=None, retry=None, **kwargs):
                 failures.append(e)
         Log.error("Tried {{num}} urls", num=len(url), cause=failures)
 
+    pool = kwargs.pop(b"pool", None)
     if b"session" in kwargs:
         session = kwargs[b"session"]
         del kwargs[b"session"]
+        pool = None
+    elif pool:
+        session = pool.checkout(url)
     else:
         session = sessions.Session()
     session.headers.update(default_headers)
+    stream = kwargs.get(b"stream")
+    try:
+        response = _request(session, method, url, zip, retry, kwargs)
+    except Exception:
+        if pool:
+            pool.checkin(url, session)
+        raise
+    if pool:
+        if stream:
+            # THE SESSION IS IN USE UNTIL THE RESPONSE IS READ, OR CLOSED (SEE HttpResponse)
+            response._checkin = _Checkin(pool, url, session)
+        else:
+            pool.checkin(url, session)
+    return response
 
+
+def _request(session, method, url, zip, retry, kwargs):
     if zip is None:
         zip = ZIP_REQUEST
 
@@ -242,6 +266,111 @@ def delete(url, **kwargs):
     return HttpResponse(request(b'delete', url, **kwargs))
 
 
+class SessionPool(object):
+    """
+    KEEP-ALIVE SESSIONS, SHARED ACROSS THREADS, AND KEYED BY HOST
+    USE pool=SessionPool() AS A request() PARAMETER
+    """
+
+    @override
+    def __init__(
+        self,
+        size=10,  # MAXIMUM NUMBER OF IDLE SESSIONS KEPT PER HOST
+        idle_timeout=60,  # SECONDS A SESSION CAN BE IDLE BEFORE IT IS CLOSED
+        kwargs=None
+    ):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.locker = Lock("session pool")
+        self.idle = {}  # MAP FROM HOST TO LIST OF (session, last_used) PAIRS, MOST RECENT LAST
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+
+    def checkout(self, url):
+        host = _host(url)
+        now = time()
+        with self.locker:
+            self.in_use += 1
+            idle = self._remove_stale(host, now)
+            if idle:
+                self.reused += 1
+                session, _ = idle.pop()
+                return session
+            self.created += 1
+        return sessions.Session()
+
+    def checkin(self, url, session):
+        host = _host(url)
+        now = time()
+        with self.locker:
+            self.in_use -= 1
+            idle = self._remove_stale(host, now)
+            if len(idle) < self.size:
+                idle.append((session, now))
+                return
+        # TOO MANY IDLE SESSIONS, LET THIS ONE GO
+        # (DO NOT close() IT, A STREAMED RESPONSE MAY STILL BE USING ITS CONNECTION)
+
+    def _remove_stale(self, host, now):
+        # ASSUME self.locker IS HAD
+        idle = self.idle.setdefault(host, [])
+        stale = [s for s, last_used in idle if now - last_used > self.idle_timeout]
+        if stale:
+            idle[:] = [(s, last_used) for s, last_used in idle if now - last_used <= self.idle_timeout]
+            for s in stale:
+                _close(s)
+        return idle
+
+    def close(self):
+        with self.locker:
+            idle, self.idle = self.idle, {}
+        for sessions_ in idle.values():
+            for s, _ in sessions_:
+                _close(s)
+
+    @property
+    def stats(self):
+        with self.locker:
+            return Data(
+                in_use=self.in_use,
+                idle=sum(len(v) for v in self.idle.values()),
+                created=self.created,
+                reused=self.reused
+            )
+
+
+class _Checkin(object):
+    """
+    RETURN A SESSION TO ITS POOL, ONCE
+    """
+
+    def __init__(self, pool, url, session):
+        self.pool = pool
+        self.url = url
+        self.session = session
+
+    def __call__(self):
+        session, self.session = self.session, None
+        if session is not None:
+            self.pool.checkin(self.url, session)
+
+
+def _host(url):
+    scheme, netloc = urlparse(url)[0:2]
+    return scheme + "://" + netloc
+
+
+def _close(session):
+    try:
+        session.close()
+    except Exception, e:
+        Log.warning("Problem closing session", cause=e)
+
+
+default_pool = SessionPool()  # USED BY elasticsearch.Cluster, UNLESS IT IS GIVEN ITS OWN
+
+
 class HttpResponse(Response):
     def __new__(cls, resp):
         resp.__class__ = HttpResponse
@@ -251,6 +380,24 @@ class HttpResponse(Response):
         pass
         self._cached_content = None
 
+    def _release(self):
+        checkin = getattr(self, "_checkin", None)
+        if checkin:
+            checkin()
+
+    def close(self):
+        try:
+            Response.close(self)
+        finally:
+            self._release()
+
+    @property
+    def content(self):
+        try:
+            return Response.content.fget(self)
+        finally:
+            self._release()
+
     @property
     def all_content(self):
         # response.content WILL LEAK MEMORY (?BECAUSE OF PYPY"S POOR HANDLING OF GENERATORS?)
@@ -266,6 +413,7 @@ class HttpResponse(Response):
                     return None
 
             self._cached_content = safe_size(Data(read=read))
+            self._release()
 
         if hasattr(self._cached_content, "read"):
             self._cached_content.seek(0)
@@ -0,0 +1,583 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import itertools
+from array import array
+from collections import Mapping
+
+import mo_json
+from mo_collections.matrix import Matrix
+from mo_dots import Data, wrap, listwrap, unwrap, unwraplist, Null, split_field, coalesce
+from mo_logs import Log
+from pyLibrary import convert
+from pyLibrary.queries import windows
+from pyLibrary.queries.containers import Container
+from pyLibrary.queries.containers.list_usingPythonList import ListContainer, get_schema_from_list
+from pyLibrary.queries.domains import SimpleSetDomain, DefaultDomain
+from pyLibrary.queries.expressions import TRUE_FILTER, Expression, TrueOp, FalseOp, Variable, Literal, EqOp, InOp, InequalityOp, AndOp, OrOp, NotOp, MissingOp, ExistsOp, jx_expression
+from pyLibrary.queries.jx import _sort_keys, _decorated_sort
+from pyLibrary.queries.lists.aggs import is_aggs, list_aggs
+
+NUMBER_TYPES = {
+    "integer": b"l",
+    "long": b"l",
+    "double": b"d"
+}
+NULL_CODE = -1
+JSON_CODE = object()  # MARKS A STRUCTURED VALUE, ENCODED AS JSON, IN _ObjectColumn.codes()
+
+
+class ColumnarContainer(Container):
+    """
+    A ListContainer THAT KEEPS ONE ARRAY PER LEAF COLUMN
+    NUMBERS ARE KEPT IN TYPED array()s, STRINGS ARE DICTIONARY-ENCODED
+    INTO array() OF INTEGER CODES, ANYTHING ELSE IS A PLAIN LIST OF VALUES
+    where, sort, select, groupby AND SIMPLE AGGREGATES WORK COLUMN-AT-A-TIME
+    """
+
+    def __init__(self, name, data, schema=None):
+        data = list(unwrap(data))
+        if schema == None:
+            schema = get_schema_from_list(name, data)
+        Container.__init__(self, None, schema)
+        self.name = name
+        self._schema = schema
+        self.columns = _decompose(data, schema)
+        self.num_rows = len(data)
+
+    @property
+    def query_path(self):
+        return None
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._schema = get_schema_from_list(self.name, self._rows())
+        return self._schema
+
+    def query(self, q, limit=None):
+        """
+        :param q: THE NORMALIZED QUERY
+        :param limit: NUMBER OF ROWS TO RETURN, None FOR ALL (SEE jx.requested_limit)
+        """
+        q = wrap(q)
+        frum = self
+        if is_aggs(q):
+            return frum._aggs(q)
+
+        if q.where is not TRUE_FILTER and not isinstance(q.where, TrueOp):
+            frum = frum.where(q.where)
+
+        if q.sort:
+            frum = frum.sort(q.sort, limit=limit)
+        elif limit is not None:
+            frum = frum._take(range(min(limit, frum.num_rows)))
+
+        if q.select:
+            frum = frum.select(q.select)
+
+        for param in q.window:
+            frum = frum.window(param)
+
+        return frum
+
+    def filter(self, where):
+        return self.where(where)
+
+    def where(self, where):
+        if isinstance(where, Expression):
+            mask = self._mask(where)
+        elif isinstance(where, Mapping):
+            mask = self._mask(jx_expression(where))
+        else:
+            mask = (where(r) for r in self)
+        return self._take([i for i, m in enumerate(mask) if m])
+
+    def sort(self, sort, limit=None):
+        sort = listwrap(sort)
+        keys = []
+        for s in sort:
+            column = self._column_of(s.value)
+            if column is None:
+                # NOT A SIMPLE COLUMN, SORT THE ROWS
+                return ListContainer("from " + self.name, self._rows(), self.schema).sort(sort, limit=limit)
+            keys.append(_sort_keys(column.decode(), s.sort))
+        order = _decorated_sort(range(self.num_rows), keys, limit)
+        return self._take(order)
+
+    def select(self, select):
+        selects = listwrap(select)
+        if len(selects) == 1 and isinstance(selects[0].value, Variable) and selects[0].value.var == ".":
+            if selects[0].name == ".":
+                return self
+            return ListContainer("from " + self.name, self._rows(), self.schema).select(select)
+
+        if isinstance(select, list):
+            if any(isinstance(s.value, Variable) and s.value.var == "." for s in selects):
+                return ListContainer("from " + self.name, self._rows(), self.schema).select(select)
+            columns = {}
+            for s in selects:
+                column = self._column_of(s.value)
+                if column is None:
+                    column = _ObjectColumn(s.value.to_vector(self))
+                columns[s.name] = column
+            return _Columnar("from " + self.name, None, columns, self.num_rows)
+        else:
+            column = self._column_of(select.value)
+            if column is None:
+                return ListContainer("from " + self.name, select.value.to_vector(self))
+            return ListContainer("from " + self.name, column.decode())
+
+    def groupby(self, keys, contiguous=False):
+        try:
+            keys = listwrap(keys)
+            columns = [self._column_of(k if isinstance(k, Expression) else jx_expression(k)) for k in keys]
+            if contiguous or any(c is None for c in columns):
+                return ListContainer("from " + self.name, self._rows(), self.schema).groupby(keys, contiguous=contiguous)
+
+            # GROUP ON THE STORED (ENCODED) VALUES, DECODE ONLY ONCE PER GROUP
+            groups = {}
+            order = []
+            for i, key in enumerate(itertools.izip(*[c.codes() for c in columns])):
+                rows = groups.get(key)
+                if rows is None:
+                    groups[key] = rows = []
+                    order.append(key)
+                rows.append(i)
+
+            def _output():
+                for key in order:
+                    group = Data()
+                    for k, c, code in zip(keys, columns, key):
+                        group[k] = c.decode_code(code)
+                    yield group, wrap(self._take(groups[key])._rows())
+
+            return _output()
+        except Exception, e:
+            Log.error("Problem grouping", e)
+
+    def window(self, window):
+        # WINDOW FUNCTIONS MUTATE ROWS, SO THEY WORK ON THE ROW FORM
+        return ListContainer("from " + self.name, self._rows(), self.schema).window(window)
+
+    def having(self, having):
+        _ = having
+        Log.error("not implemented")
+
+    def format(self, format):
+        if format == "table":
+            frum = convert.list2table(self._rows(), self.schema.keys())
+        elif format == "cube":
+            frum = convert.list2cube(self._rows(), self.schema.keys())
+        else:
+            frum = self.__data__()
+        return frum
+
+    def get_columns(self, table_name=None):
+        return self.schema.values()
+
+    def insert(self, documents):
+        self.extend(documents)
+
+    def extend(self, documents):
+        documents = list(unwrap(documents))
+        for name, column in self.columns.items():
+            path = split_field(name)
+            for d in documents:
+                column.append(_get_path(d, path))
+        self.num_rows += len(documents)
+
+    def add(self, value):
+        self.extend([value])
+
+    def __data__(self):
+        return wrap({
+            "meta": {"format": "list"},
+            "data": [{k: unwraplist(v) for k, v in row.items()} for row in self._rows()]
+        })
+
+    def __getitem__(self, item):
+        if item < 0 or self.num_rows <= item:
+            return Null
+        return wrap(self._row(item))
+
+    def __iter__(self):
+        return (wrap(self._row(i)) for i in xrange(self.num_rows))
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, name):
+        """
+        :return: LIST OF VALUES FOR THE GIVEN COLUMN, OR None IF NOT A STORED COLUMN (SEE Expression.to_vector())
+        """
+        column = self.columns.get(name)
+        if column is None:
+            return None
+        return column.decode()
+
+    def _column_of(self, expr):
+        """
+        :return: THE STORED COLUMN FOR A SIMPLE VARIABLE, OR None
+        """
+        if isinstance(expr, Variable):
+            return self.columns.get(expr.var)
+        return None
+
+    def _take(self, indices):
+        """
+        :return: NEW CONTAINER WITH ONLY THE GIVEN ROWS, IN THE GIVEN ORDER
+        """
+        return _Columnar(self.name, self._schema, {n: c.take(indices) for n, c in self.columns.items()}, len(indices))
+
+    def _row(self, i):
+        output = Data()
+        for name, column in self.columns.items():
+            output[name] = column.get(i)
+        return unwrap(output)
+
+    def _rows(self):
+        return [self._row(i) for i in xrange(self.num_rows)]
+
+    def _mask(self, expr):
+        """
+        :return: LIST OF BOOLEANS, ONE PER ROW
+        """
+        n = self.num_rows
+        if isinstance(expr, TrueOp):
+            return [True] * n
+        elif isinstance(expr, FalseOp):
+            return [False] * n
+        elif isinstance(expr, AndOp):
+            output = [True] * n
+            for t in expr.terms:
+                output = [a and b for a, b in itertools.izip(output, self._mask(t))]
+            return output
+        elif isinstance(expr, OrOp):
+            output = [False] * n
+            for t in expr.terms:
+                output = [a or b for a, b in itertools.izip(output, self._mask(t))]
+            return output
+        elif isinstance(expr, NotOp):
+            return [not m for m in self._mask(expr.term)]
+        elif isinstance(expr, MissingOp) and self._column_of(expr.expr):
+            return self._column_of(expr.expr).missing()
+        elif isinstance(expr, ExistsOp) and self._column_of(expr.field):
+            return [not m for m in self._column_of(expr.field).missing()]
+        elif isinstance(expr, EqOp) and self._column_of(expr.lhs) and isinstance(expr.rhs, Literal):
+            return self._column_of(expr.lhs).equals([mo_json.json2value(expr.rhs.json)])
+        elif isinstance(expr, InOp) and self._column_of(expr.field) and isinstance(expr.values, Literal):
+            return self._column_of(expr.field).equals(listwrap(mo_json.json2value(expr.values.json)))
+        elif isinstance(expr, InequalityOp) and self._column_of(expr.lhs) and isinstance(expr.rhs, Literal):
+            return self._column_of(expr.lhs).compare(expr.op, mo_json.json2value(expr.rhs.json))
+
+        # NOT A SIMPLE FILTER, EVALUATE THE WHOLE EXPRESSION OVER THE COLUMNS
+        return [bool(v) for v in expr.to_vector(self)]
+
+    def _aggs(self, query):
+        """
+        AGGREGATE DIRECTLY FROM THE COLUMNS, WHEN THE EDGES AND SELECTS ARE PLAIN VARIABLES
+        """
+        select = listwrap(query.select)
+        simple = (
+            not query.groupby and
+            all(isinstance(e.value, Variable) and self._column_of(e.value) and not e.range for e in query.edges) and
+            all(s.value.var == "." or self._column_of(s.value) for s in select if isinstance(s.value, Variable)) and
+            all(isinstance(s.value, Variable) for s in select)
+        )
+        if not simple:
+            return list_aggs(self._rows(), query)
+
+        frum = self
+        if query.where is not TRUE_FILTER and not isinstance(query.where, TrueOp):
+            frum = frum.where(query.where)
+
+        # ONE COORDINATE LIST PER EDGE, COMPUTED FROM THE DISTINCT VALUES ONLY
+        coords = []
+        for e in query.edges:
+            column = frum._column_of(e.value)
+            if isinstance(e.domain, DefaultDomain):
+                unique_values = set(column.decode_code(c) for c in set(column.codes()))
+                if None in unique_values:
+                    e.allowNulls = coalesce(e.allowNulls, True)
+                    unique_values -= {None}
+                e.domain = SimpleSetDomain(partitions=list(sorted(unique_values)))
+            num_parts = len(e.domain.partitions)
+            code2index = {}
+            for code in set(column.codes()):
+                index = e.domain.getIndexByKey(column.decode_code(code))
+                if index == num_parts and not e.allowNulls:
+                    index = None
+                code2index[code] = index
+            coords.append([code2index[c] for c in column.codes()])
+
+        result = {}
+        for s in select:
+            mat = result[s.name] = Matrix(
+                dims=[len(e.domain.partitions) + (1 if e.allowNulls else 0) for e in query.edges],
+                zeros=lambda: windows.get_accumulator(s)(**s),
+                flat=True
+            )
+            if s.value.var == ".":
+                values = iter(frum)
+            else:
+                values = frum._column_of(s.value).decode()
+
+            if not query.edges:
+                acc = mat.cube
+                for v in values:
+                    acc.add(v)
+            else:
+                for c, v in itertools.izip(itertools.izip(*coords), values):
+                    if None in c:
+                        continue
+                    mat[c].add(v)
+
+        for s in select:
+            m = result[s.name]
+            if not query.edges:
+                result[s.name] = Matrix(value=m.cube.end())
+                continue
+            for c, var in m.items():
+                if var != None:
+                    m[c] = var.end()
+
+        from pyLibrary.queries.containers.cube import Cube
+
+        return Cube(select, query.edges, result)
+
+
+def _Columnar(name, schema, columns, num_rows):
+    """
+    BUILD A ColumnarContainer FROM EXISTING COLUMNS, WITHOUT DECOMPOSING ROWS
+    """
+    output = object.__new__(ColumnarContainer)
+    Container.__init__(output, None, schema)
+    output.name = name
+    output._schema = schema
+    output.columns = columns
+    output.num_rows = num_rows
+    return output
+
+
+def _decompose(data, schema):
+    """
+    :return: MAP FROM COLUMN NAME TO COLUMN OF VALUES
+    """
+    # NESTED DOCUMENTS ARE NOT DECOMPOSED; THE WHOLE TOP-LEVEL PROPERTY IS KEPT AS ONE VALUE
+    nested = set(
+        split_field(c.es_column)[0]
+        for c in schema.columns
+        if c.type == "nested" or listwrap(c.nested_path)[0] != "."
+    )
+
+    columns = {n: _ObjectColumn() for n in nested}
+    for c in schema.columns:
+        name = c.es_column
+        if c.type in ("object", "nested") or split_field(name)[0] in nested:
+            continue
+        columns[name] = _new_column(c.type)
+
+    for name, column in columns.items():
+        path = split_field(name)
+        try:
+            for d in data:
+                column.append(_get_path(d, path))
+        except (OverflowError, TypeError):
+            # NOT AS WELL-TYPED AS THE SCHEMA SAYS
+            column = columns[name] = _ObjectColumn()
+            for d in data:
+                column.append(_get_path(d, path))
+    return columns
+
+
+def _get_path(doc, path):
+    doc = unwrap(doc)
+    for p in path:
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(p)
+    return doc
+
+
+def _new_column(type):
+    if type in NUMBER_TYPES:
+        return _NumberColumn(NUMBER_TYPES[type])
+    elif type == "string":
+        return _StringColumn()
+    else:
+        return _ObjectColumn()
+
+
+class _NumberColumn(object):
+    """
+    TYPED ARRAY OF NUMBERS, WITH A SEPARATE BYTE PER ROW MARKING NULLS
+    """
+    __slots__ = ["typecode", "values", "nulls"]
+
+    def __init__(self, typecode, values=None, nulls=None):
+        self.typecode = typecode
+        self.values = values if values is not None else array(typecode)
+        self.nulls = nulls if nulls is not None else bytearray()
+
+    def append(self, value):
+        if value == None:
+            self.values.append(0)
+            self.nulls.append(1)
+        else:
+            self.values.append(value)
+            self.nulls.append(0)
+
+    def get(self, i):
+        if self.nulls[i]:
+            return None
+        return self.values[i]
+
+    def take(self, indices):
+        values, nulls = self.values, self.nulls
+        return _NumberColumn(self.typecode, array(self.typecode, [values[i] for i in indices]), bytearray(nulls[i] for i in indices))
+
+    def decode(self):
+        if not any(self.nulls):
+            return self.values.tolist()
+        return [None if n else v for v, n in itertools.izip(self.values, self.nulls)]
+
+    def codes(self):
+        return self.decode()
+
+    def decode_code(self, code):
+        return code
+
+    def missing(self):
+        return [bool(n) for n in self.nulls]
+
+    def equals(self, values):
+        values = set(v for v in values if v != None)
+        return [not n and v in values for v, n in itertools.izip(self.values, self.nulls)]
+
+    def compare(self, op, value):
+        if value == None:
+            return [False] * len(self.nulls)
+        return [not n and c for c, n in itertools.izip(_compare(self.values, op, value), self.nulls)]
+
+
+class _StringColumn(object):
+    """
+    DICTIONARY-ENCODED STRINGS: EACH ROW IS AN INTEGER CODE INTO self.dictionary
+    """
+    __slots__ = ["values", "dictionary", "lookup"]
+
+    def __init__(self, values=None, dictionary=None, lookup=None):
+        self.values = values if values is not None else array(b"l")
+        self.dictionary = dictionary if dictionary is not None else []
+        self.lookup = lookup if lookup is not None else {}
+
+    def append(self, value):
+        if value == None:
+            self.values.append(NULL_CODE)
+            return
+        if not isinstance(value, basestring):
+            raise TypeError("expecting string")
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self.values.append(code)
+
+    def get(self, i):
+        return self.decode_code(self.values[i])
+
+    def take(self, indices):
+        values = self.values
+        return _StringColumn(array(b"l", [values[i] for i in indices]), self.dictionary, self.lookup)
+
+    def decode(self):
+        dictionary = self.dictionary
+        return [None if c == NULL_CODE else dictionary[c] for c in self.values]
+
+    def codes(self):
+        return self.values
+
+    def decode_code(self, code):
+        if code == NULL_CODE:
+            return None
+        return self.dictionary[code]
+
+    def missing(self):
+        return [c == NULL_CODE for c in self.values]
+
+    def equals(self, values):
+        codes = set(self.lookup[v] for v in values if v in self.lookup)
+        return [c in codes for c in self.values]
+
+    def compare(self, op, value):
+        if value == None:
+            return [False] * len(self.values)
+        # COMPARE EACH DISTINCT STRING ONCE, THEN LOOK UP BY CODE
+        matches = _compare(self.dictionary, op, value)
+        return [c != NULL_CODE and matches[c] for c in self.values]
+
+
+class _ObjectColumn(object):
+    """
+    ANYTHING ELSE: A PLAIN LIST OF VALUES
+    """
+    __slots__ = ["values"]
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else []
+
+    def append(self, value):
+        self.values.append(value)
+
+    def get(self, i):
+        return self.values[i]
+
+    def take(self, indices):
+        values = self.values
+        return _ObjectColumn([values[i] for i in indices])
+
+    def decode(self):
+        return self.values
+
+    def codes(self):
+        # SOME VALUES ARE NOT HASHABLE, SO GROUP ON THEIR JSON
+        return [(JSON_CODE, convert.value2json(v)) if isinstance(v, (list, Mapping)) else v for v in self.values]
+
+    def decode_code(self, code):
+        if isinstance(code, tuple) and code[0] is JSON_CODE:
+            return convert.json2value(code[1])
+        return code
+
+    def missing(self):
+        return [v == None for v in self.values]
+
+    def equals(self, values):
+        return [v != None and v in values for v in self.values]
+
+    def compare(self, op, value):
+        if value == None:
+            return [False] * len(self.values)
+        return [v != None and c for v, c in itertools.izip(self.values, _compare(self.values, op, value))]
+
+
+def _compare(values, op, value):
+    if op == "gt":
+        return [v > value for v in values]
+    elif op == "gte":
+        return [v >= value for v in values]
+    elif op == "lt":
+        return [v < value for v in values]
+    elif op == "lte":
+        return [v <= value for v in values]
+    Log.error("Unknown operator {{op}}", op=op)
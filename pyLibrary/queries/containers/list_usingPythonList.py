@@ -25,8 +25,8 @@ from mo_times.dates import Date
 from pyLibrary import convert
 from pyLibrary.queries import jx, Schema
 from pyLibrary.queries.containers import Container
-from pyLibrary.queries.expression_compiler import compile_expression
-from pyLibrary.queries.expressions import TRUE_FILTER, jx_expression, Expression, TrueOp, jx_expression_to_function, Variable
+from pyLibrary.queries.group_by import hash_groups
+from pyLibrary.queries.expressions import jx_expression, Expression, jx_expression_to_function, Variable
 from pyLibrary.queries.lists.aggs import is_aggs, list_aggs
 from pyLibrary.queries.meta import Column, ROOT_PATH
 
@@ -63,7 +63,11 @@ class ListContainer(Container):
         else:
             return Null
 
-    def query(self, q):
+    def query(self, q, limit=None):
+        """
+        :param q: THE NORMALIZED QUERY
+        :param limit: NUMBER OF ROWS TO RETURN, None FOR ALL (SEE jx.requested_limit)
+        """
         q = wrap(q)
         frum = self
         if is_aggs(q):
@@ -75,14 +79,12 @@ class ListContainer(Container):
             except AttributeError, e:
                 pass
 
-            if q.where is not TRUE_FILTER and not isinstance(q.where, TrueOp):
-                frum = frum.filter(q.where)
-
-            if q.sort:
-                frum = frum.sort(q.sort)
-
-            if q.select:
-                frum = frum.select(q.select)
+            if jx.select_function(q.select) is None:
+                new_schema = self.schema
+            else:
+                new_schema = None
+            # filter, sort, limit AND select IN ONE PASS, ONLY THE RESULT IS MATERIALIZED
+            frum = ListContainer("from " + self.name, jx.iter_setop(self.data, q, limit), new_schema)
         #TODO: ADD EXTRA COLUMN DESCRIPTIONS TO RESULTING SCHEMA
         for param in q.window:
             frum.window(param)
@@ -111,18 +113,15 @@ class ListContainer(Container):
         return self.where(where)
 
     def where(self, where):
-        temp = None
-        if isinstance(where, Mapping):
-            exec("def temp(row):\n    return "+jx_expression(where).to_python())
-        elif isinstance(where, Expression):
-            temp = compile_expression(where.to_python())
+        if isinstance(where, (Mapping, Expression)):
+            temp = jx_expression_to_function(where)
         else:
             temp = where
 
         return ListContainer("from "+self.name, filter(temp, self.data), self.schema)
 
-    def sort(self, sort):
-        return ListContainer("from "+self.name, jx.sort(self.data, sort, already_normalized=True), self.schema)
+    def sort(self, sort, limit=None):
+        return ListContainer("from "+self.name, jx.sort(self.data, sort, already_normalized=True, limit=limit), self.schema)
 
     def get(self, select):
         """
@@ -137,8 +136,6 @@ class ListContainer(Container):
     def select(self, select):
         selects = listwrap(select)
 
-        if not all(isinstance(s.value, Variable) for s in selects):
-            Log.error("selecting on structure, or expressions, not supported yet")
         if len(selects) == 1 and isinstance(selects[0].value, Variable) and selects[0].value.var == ".":
             new_schema = self.schema
             if selects[0].name == ".":
@@ -146,18 +143,11 @@ class ListContainer(Container):
         else:
             new_schema = None
 
-        if isinstance(select, list):
-            push_and_pull = [(s.name, jx_expression_to_function(s.value)) for s in selects]
-            def selector(d):
-                output = Data()
-                for n, p in push_and_pull:
-                    output[n] = p(wrap(d))
-                return unwrap(output)
-
-            new_data = map(selector, self.data)
+        selector = jx.select_function(select)
+        if selector is None:
+            new_data = self.data
         else:
-            select_value = jx_expression_to_function(select.value)
-            new_data = map(select_value, self.data)
+            new_data = map(selector, self.data)
 
         return ListContainer("from "+self.name, data=new_data, schema=new_schema)
 
@@ -185,7 +175,19 @@ class ListContainer(Container):
             keys = listwrap(keys)
             get_key = jx_expression_to_function(keys)
             if not contiguous:
-                data = sorted(self.data, key=get_key)
+                groups = hash_groups(self.data, get_key)
+                if groups is not None:
+                    def _output():
+                        for g, v in groups.items():
+                            group = Data()
+                            for k, gg in zip(keys, g):
+                                group[k] = gg
+                            yield (group, wrap(v))
+
+                    return _output()
+                data = sorted(self.data, key=get_key)  # SOME KEY IS NOT HASHABLE
+            else:
+                data = self.data
 
             def _output():
                 for g, v in itertools.groupby(data, get_key):
@@ -13,11 +13,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import json
 import re
 from collections import Mapping, OrderedDict
 from copy import copy
 
 import mo_json
+from mo_collections.lru import LRU
 from mo_collections.matrix import Matrix, index_to_coordinate
 from mo_dots import listwrap, coalesce, Data, wrap, Null, unwraplist, split_field, join_field, startswith_field, literal_field, unwrap, \
     relative_field, concat_field, unliteral_field
@@ -25,6 +27,7 @@ from mo_logs import Log
 from mo_math import Math
 from mo_math import UNION, MAX
 from mo_math.randoms import Random
+from mo_threads import Lock
 from mo_times import Date, Duration
 from pyLibrary import convert
 from mo_kwargs import override
@@ -34,7 +37,7 @@ from pyLibrary.queries.domains import SimpleSetDomain, DefaultDomain, TimeDomain
 from pyLibrary.queries.expressions import jx_expression, Variable, sql_type_to_json_type, TupleOp, LeavesOp
 from pyLibrary.queries.meta import Column
 from pyLibrary.queries.query import QueryOp
-from pyLibrary.sql.sqlite import Sqlite
+from pyLibrary.sql.sqlite import Sqlite, parameterize
 
 _containers = None
 
@@ -45,6 +48,11 @@ PARENT = "__parent__"
 COLUMN = "__column"
 
 ALL_TYPES = "bns"
+DEBUG_INSERT = False
+DEBUG_INDEX = False
+INDEX_THRESHOLD = 3  # NUMBER OF QUERIES THAT FILTER, GROUP OR SORT ON A COLUMN BEFORE IT IS INDEXED
+SQL_CACHE_SIZE = 100  # NUMBER OF GENERATED SQL STATEMENTS TO REMEMBER
+META_COLUMNS = {UID, PARENT, ORDER}
 
 
 def late_import():
@@ -88,6 +96,10 @@ class Table_usingSQLite(Container):
         self.nested_tables = OrderedDict()  # MAP FROM NESTED PATH TO Table OBJECT, PARENTS PROCEED CHILDREN
         self.nested_tables["."] = self
         self.columns = Index(keys=[join_field(["names", self.name])])  # MAP FROM DOCUMENT ABS PROPERTY NAME TO THE SET OF SQL COLUMNS IT REPRESENTS (ONE FOR EACH REALIZED DATATYPE)
+        self.indexes = OrderedDict()  # MAP FROM INDEX NAME TO Data(table, columns, reason) FOR EVERY INDEX THIS CONTAINER MADE
+        self.column_usage = {}  # MAP FROM (table, es_column) TO NUMBER OF QUERIES THAT FILTERED, GROUPED OR SORTED ON IT
+        self.index_locker = Lock("indexes for " + name)  # query() IS CALLED FROM MANY THREADS
+        self.sql_cache = LRU(SQL_CACHE_SIZE, "sql cache for " + name)  # MAP FROM _sql_key() TO (query, command, params, index_to_columns, doc_details)
 
         if not exists:
             for u in self.uid:
@@ -197,8 +209,11 @@ class Table_usingSQLite(Container):
         return unwrap(columns)
 
     def insert(self, docs):
+        """
+        :return: Data WITH NUMBER OF rows INSERTED (INCLUDING NESTED) AND THE rate (ROWS PER SECOND)
+        """
         doc_collection = self.flatten_many(docs)
-        self._insert(doc_collection)
+        return self._insert(doc_collection)
 
     def add_column(self, column):
         """
@@ -460,49 +475,61 @@ class Table_usingSQLite(Container):
         """
         if not startswith_field(query['from'], self.name):
             Log.error("Expecting table, or some nested table")
-        frum, query['from'] = query['from'], self
-        query = QueryOp.wrap(query, self.columns)
-
-        # TYPE CONFLICTS MUST NOW BE RESOLVED DURING
-        # TYPE-SPECIFIC QUERY NORMALIZATION
-        # vars_ = query.vars(exclude_select=True)
-        # type_map = {
-        #     v: c.es_column
-        #     for v in vars_
-        #     if v in self.columns and len([c for c in self.columns[v] if c.type != "nested"]) == 1
-        #     for c in self.columns[v]
-        #     if c.type != "nested"
-        # }
-        #
-        # sql_query = query.map(type_map)
-        query = query
-
-        new_table = "temp_" + unique_name()
-
-        if query.format == "container":
-            create_table = "CREATE TABLE " + quote_table(new_table) + " AS "
-        else:
-            create_table = ""
-
-        if query.groupby:
-            op, index_to_columns = self._groupby_op(query, frum)
-            command = create_table + op
-        elif query.edges or any(a != "none" for a in listwrap(query.select).aggregate):
-            op, index_to_columns = self._edges_op(query, frum)
-            command = create_table + op
+        key = self._sql_key(query)
+        plan = self._get_sql(key)
+        if plan:
+            query, command, params, index_to_columns, doc_details = plan
         else:
-            op = self._set_op(query, frum)
-            return op
+            frum, query['from'] = query['from'], self
+            query = QueryOp.wrap(query, self.columns)
+
+            # TYPE CONFLICTS MUST NOW BE RESOLVED DURING
+            # TYPE-SPECIFIC QUERY NORMALIZATION
+            # vars_ = query.vars(exclude_select=True)
+            # type_map = {
+            #     v: c.es_column
+            #     for v in vars_
+            #     if v in self.columns and len([c for c in self.columns[v] if c.type != "nested"]) == 1
+            #     for c in self.columns[v]
+            #     if c.type != "nested"
+            # }
+            #
+            # sql_query = query.map(type_map)
+            query = query
+
+            new_table = "temp_" + unique_name()
+
+            if query.format == "container":
+                create_table = "CREATE TABLE " + quote_table(new_table) + " AS "
+            else:
+                create_table = ""
+
+            doc_details = None
+            if query.groupby:
+                op, index_to_columns = self._groupby_op(query, frum)
+                command = create_table + op
+            elif query.edges or any(a != "none" for a in listwrap(query.select).aggregate):
+                op, index_to_columns = self._edges_op(query, frum)
+                command = create_table + op
+            else:
+                command, index_to_columns, doc_details = self._set_op(query, frum)
+
+            if query.sort and doc_details is None:
+                command += "\nORDER BY " + ",\n".join(
+                    "(" + sql[t] + ") IS NULL" + (" DESC" if s.sort == -1 else "") + ",\n" +
+                    sql[t] + (" DESC" if s.sort == -1 else "")
+                    for s, sql in [(s, s.value.to_sql(self)[0].sql) for s in query.sort]
+                    for t in "bns" if sql[t]
+                )
 
-        if query.sort:
-            command += "\nORDER BY " + ",\n".join(
-                "(" + sql[t] + ") IS NULL" + (" DESC" if s.sort == -1 else "") + ",\n" +
-                sql[t] + (" DESC" if s.sort == -1 else "")
-                for s, sql in [(s, s.value.to_sql(self)[0].sql) for s in query.sort]
-                for t in "bns" if sql[t]
-            )
+            command, params = parameterize(command)
+            self._add_sql(key, (query, command, params, index_to_columns, doc_details))
+        self._advise_indexes(query)
+
+        if doc_details is not None:
+            return self._format_set_op(query, command, params, index_to_columns, doc_details)
 
-        result = self.db.query(command)
+        result = self.db.query(command, params)
 
         column_names = query.edges.name + query.groupby.name + listwrap(query.select).name
         if query.format == "container":
@@ -700,6 +727,77 @@ class Table_usingSQLite(Container):
 
         return output
 
+    def _sql_key(self, query):
+        """
+        :param query: THE QUERY, AS GIVEN TO query()
+        :return: KEY FOR THE GENERATED SQL, OR None IF NOT CACHEABLE
+        """
+        if wrap(query).format == "container":
+            return None  # EVERY CONTAINER IS A NEW TABLE
+        try:
+            shape = json.dumps(unwrap(query), sort_keys=True)
+        except Exception:
+            return None
+        # THE SQL DEPENDS ON THE SCHEMA, WHICH ONLY GROWS
+        return len(self.nested_tables), sum(len(cs) for _, cs in self.columns.items()), shape
+
+    def _get_sql(self, key):
+        if key is None:
+            return None
+        return self.sql_cache.get(key)
+
+    def _add_sql(self, key, plan):
+        if key is None:
+            return
+        self.sql_cache.add(key, plan)
+
+    def _advise_indexes(self, query):
+        """
+        COUNT THE COLUMNS USED TO FILTER, GROUP AND SORT, AND INDEX
+        THE ONES USED IN INDEX_THRESHOLD QUERIES
+        """
+        used = set(query.where.vars())
+        for e in listwrap(query.edges) + listwrap(query.groupby):
+            if e.value:
+                used |= e.value.vars()
+        for s in listwrap(query.sort):
+            used |= s.value.vars()
+
+        needed = []
+        with self.index_locker:
+            for cname, cols in self.columns.items():
+                if cname not in used:
+                    continue
+                for c in cols:
+                    if c.type in STRUCT:
+                        continue
+                    table = join_field([self.name] + split_field(c.nested_path[0]))
+                    key = (table, c.es_column)
+                    count = self.column_usage[key] = self.column_usage.get(key, 0) + 1
+                    if count == INDEX_THRESHOLD:
+                        needed.append((table, c.es_column))
+
+        for table, es_column in needed:
+            self._add_index(table, [es_column], "usage")
+
+    def _add_index(self, table, columns, reason):
+        """
+        :param table: NAME OF THE SQL TABLE
+        :param columns: LIST OF SQL COLUMN NAMES
+        :param reason: "join" OR "usage", KEPT FOR INSPECTION
+        """
+        name = concat_field(table, "__index__." + ".".join(columns))
+        with self.index_locker:
+            if name in self.indexes:
+                return
+            self.indexes[name] = Data(table=table, columns=columns, reason=reason)
+        if DEBUG_INDEX:
+            Log.note("Index {{columns}} of {{table}} for {{reason}}", table=table, columns=columns, reason=reason)
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS " + quote_table(name) + " ON " + quote_table(table) +
+            "(" + ",".join(quote_table(c) for c in columns) + ")"
+        )
+
     def _edges_op(self, query, frum):
         index_to_column = {}  # MAP FROM INDEX TO COLUMN (OR SELECT CLAUSE)
         outer_selects = []  # EVERY SELECT CLAUSE (NOT TO BE USED ON ALL TABLES, OF COURSE)
@@ -984,11 +1082,24 @@ class Table_usingSQLite(Container):
                     sql=sql,
                     type=sql_type_to_json_type["n"]
                 )
-            elif s.aggregate == "percentile":
-                if not isinstance(s.percentile, (int, float)):
+            elif s.aggregate in ("percentile", "median"):
+                percent = 0.5 if s.aggregate == "median" else s.percentile
+                if not isinstance(percent, (int, float)):
                     Log.error("Expecting percentile to be a float between 0 and 1")
+                func = "APPROX_PERCENTILE" if s.approximate else "PERCENTILE"
 
-                Log.error("not implemented")
+                for details in s.value.to_sql(self):
+                    sql = func + "(" + details.sql["n"] + ", " + quote_value(percent) + ")"
+                    column_number = len(outer_selects)
+                    outer_selects.append(sql + " AS " + _make_column_name(column_number))
+                    index_to_column[column_number] = Data(
+                        push_name=s.name,
+                        push_column=si,
+                        push_child=".",
+                        pull=get_column(column_number),
+                        sql=sql,
+                        type="number"
+                    )
             elif s.aggregate == "cardinality":
                 for details in s.value.to_sql(self):
                     for json_type, sql in details.sql.items():
@@ -1379,11 +1490,20 @@ class Table_usingSQLite(Container):
             "\nORDER BY\n" + ",\n".join(sorts) +
             "\nLIMIT " + quote_value(query.limit)
         )
-        result = self.db.query(ordered_sql)
+        return ordered_sql, index_to_column, primary_doc_details
 
+    def _format_set_op(self, query, command, params, index_to_column, primary_doc_details):
+        result = self.db.query_stream(command, params)
+        try:
+            return self._format_rows(query, result, index_to_column, primary_doc_details)
+        finally:
+            # RELEASE THE worker, EVEN IF THE ROWS WERE NOT ALL READ
+            result.close()
+
+    def _format_rows(self, query, result, index_to_column, primary_doc_details):
         def _accumulate_nested(rows, row, nested_doc_details, parent_doc_id, parent_id_coord):
             """
-            :param rows: REVERSED STACK OF ROWS (WITH push() AND pop())
+            :param rows: _PushBack OF ROWS (WITH append() AND pop())
             :param row: CURRENT ROW BEING EXTRACTED
             :param nested_doc_details: {
                     "nested_path": wrap_nested_path(nested_path),
@@ -1455,11 +1575,14 @@ class Table_usingSQLite(Container):
         cols = tuple(index_to_column.values())
 
         if query.format == "cube":
-            num_rows = len(result.data)
+            num_rows = 0
             num_cols = MAX([c.push_column for c in cols]) + 1 if len(cols) else 0
             map_index_to_name = {c.push_column: c.push_name for c in cols}
-            temp_data = [[None]*num_rows for _ in range(num_cols)]
-            for rownum, d in enumerate(result.data):
+            temp_data = [[] for _ in range(num_cols)]
+            for rownum, d in enumerate(result):
+                num_rows += 1
+                for t in temp_data:
+                    t.append(None)
                 for c in cols:
                     if c.push_child == ".":
                         temp_data[c.push_column][rownum] = c.pull(d)
@@ -1486,24 +1609,27 @@ class Table_usingSQLite(Container):
         elif query.format == "table":
             num_column = MAX([c.push_column for c in cols])+1
             header = [None]*num_column
+            push_children = []  # cols ARE CACHED WITH THE SQL, SO DO NOT CHANGE THEIR push_child
             for c in cols:
                 # header[c.push_column] = c.push_name
                 sf = split_field(c.push_name)
                 if len(sf) == 0:
                     header[c.push_column] = "."
+                    push_children.append(c.push_child)
                 elif len(sf) == 1:
                     header[c.push_column] = sf[0]
+                    push_children.append(c.push_child)
                 else:
                     # TABLES ONLY USE THE FIRST-LEVEL PROPERTY NAMES
                     # PUSH ALL DEEPER NAMES TO CHILD
                     header[c.push_column] = sf[0]
-                    c.push_child = join_field(sf[1:] + split_field(c.push_child))
+                    push_children.append(join_field(sf[1:] + split_field(c.push_child)))
 
             output_data = []
-            for d in result.data:
+            for d in result:
                 row = [None] * num_column
-                for c in cols:
-                    set_column(row, c.push_column, c.push_child, c.pull(d))
+                for c, push_child in zip(cols, push_children):
+                    set_column(row, c.push_column, push_child, c.pull(d))
                 output_data.append(row)
             return Data(
                 meta={"format": "table"},
@@ -1511,7 +1637,7 @@ class Table_usingSQLite(Container):
                 data=output_data
             )
         else:
-            rows = list(reversed(unwrap(result.data)))
+            rows = _PushBack(result)
             row = rows.pop()
             output = Data(
                 meta={"format": "list"},
@@ -1704,6 +1830,8 @@ class Table_usingSQLite(Container):
         self.db.execute(
             "ALTER TABLE " + quote_table(sub_table.name) + " ADD COLUMN " + quote_table(ORDER) + " INTEGER"
         )
+        # NESTED ROWS ARE FOUND BY THEIR PARENT (AND ORDER) IN EVERY JOIN
+        self._add_index(sub_table.name, [PARENT, ORDER], "join")
         for cname, cols in new_columns.items():
             for c in cols:
                 sub_table.add_column(c)
@@ -1918,9 +2046,11 @@ class Table_usingSQLite(Container):
         return doc_collection
 
     def _insert(self, collection):
+        """
+        ONE PARAMETERIZED INSERT PER NESTED TABLE AND SET OF COLUMNS, ALL IN ONE TRANSACTION
+        """
+        commands = []
         for nested_path, details in collection.items():
-            active_columns = wrap(list(details.active_columns))
-            rows = details.rows
             table_name = concat_field(self.name, nested_path)
 
             if table_name == self.name:
@@ -1929,18 +2059,27 @@ class Table_usingSQLite(Container):
             else:
                 meta_columns = [UID, PARENT, ORDER]
 
-            all_columns = meta_columns + active_columns.es_column
+            # THE ROWS CARRY THE COLUMNS THEY FILL, SO GROUP ON THAT
+            column_sets = OrderedDict()
+            for row in unwrap(details.rows):
+                key = tuple(sorted(k for k in row.keys() if k not in META_COLUMNS))
+                column_sets.setdefault(key, []).append(row)
 
-            prefix = "INSERT INTO " + quote_table(table_name) + \
-                     "(" + ",".join(map(quote_table, all_columns)) + ")"
+            for columns, rows in column_sets.items():
+                all_columns = meta_columns + list(columns)
+                command = "INSERT INTO " + quote_table(table_name) + \
+                          "(" + ",".join(map(quote_table, all_columns)) + ")" + \
+                          " VALUES (" + ",".join("?" * len(all_columns)) + ")"
+                commands.append((command, _records(rows, all_columns)))
 
-            # BUILD THE RECORDS
-            records = " UNION ALL ".join(
-                "\nSELECT " + ",".join(quote_value(row.get(c)) for c in all_columns)
-                for row in unwrap(rows)
-            )
+        if not commands:
+            return Data(rows=0, rate=None)
 
-            self.db.execute(prefix + records)
+        result = self.db.execute_many(commands)
+        rate = result.rows / result.duration if result.duration else None
+        if DEBUG_INSERT:
+            Log.note("{{num}} rows inserted into {{table}} ({{rate|round(places=3)}} rows/sec)", num=result.rows, table=self.name, rate=rate)
+        return Data(rows=result.rows, rate=rate)
 
     def add_column_to_schema(self, nest_to_schema, column):
         abs_table = literal_field(self.name)
@@ -1956,6 +2095,28 @@ class Table_usingSQLite(Container):
 _do_not_quote = re.compile(r"^\w+$", re.UNICODE)
 
 
+class _PushBack(object):
+    """
+    STACK (append() AND pop()) OVER AN ITERATOR OF ROWS, SO ROWS ARE ONLY
+    PULLED FROM THE DATABASE AS THEY ARE NEEDED
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pushed = []
+
+    def append(self, row):
+        self.pushed.append(row)
+
+    def pop(self):
+        if self.pushed:
+            return self.pushed.pop()
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise IndexError("no more rows")
+
+
 def quote_table(column):
     if _do_not_quote.match(column):
         return column
@@ -1966,6 +2127,31 @@ def _quote_column(column):
     return convert.string2quote(column.es_column)
 
 
+def _records(rows, columns):
+    for row in rows:
+        yield [sql_value(row.get(c)) for c in columns]
+
+
+def sql_value(value):
+    """
+    :return: value AS A PARAMETER FOR A PREPARED STATEMENT (SAME MEANING AS quote_value())
+    """
+    if isinstance(value, (Mapping, list)):
+        return "."
+    elif isinstance(value, Date):
+        return value.unix
+    elif isinstance(value, Duration):
+        return value.seconds
+    elif value == None:
+        return None
+    elif value is True:
+        return 1
+    elif value is False:
+        return 0
+    else:
+        return value
+
+
 def quote_value(value):
     if isinstance(value, (Mapping, list)):
         return "."
@@ -46,7 +46,8 @@ def cube_aggs(frum, query):
     result = {
         s.name: Matrix(
             dims=[len(e.domain.partitions) + (1 if e.allowNulls else 0) for e in query.edges],
-            zeros=s.default
+            zeros=s.default,
+            flat=True
         )
         for s in select
     }
@@ -11,18 +11,25 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+from collections import Mapping
+
 from mo_dots import listwrap, Data, wrap, literal_field, set_default, coalesce, Null, split_field, FlatList, unwrap, \
     unwraplist
 from mo_logs import Log
+from mo_threads import Lock, Thread
 from mo_math import Math, MAX
 from mo_times.timer import Timer
 from pyLibrary.queries import es09
-from pyLibrary.queries.es14.decoders import DefaultDecoder, AggsDecoder
+from pyLibrary.queries.es14.decoders import DefaultDecoder, AggsDecoder, PARTITION_SCRIPT
 from pyLibrary.queries.es14.decoders import DimFieldListDecoder
 from pyLibrary.queries.es14.util import aggregates1_4, NON_STATISTICAL_AGGS
 from pyLibrary.queries.expressions import simplify_esfilter, split_expression_by_depth, AndOp, Variable, NullOp
 from pyLibrary.queries.query import MAX_LIMIT
 
+PARTITION_SIZE = 1000  # EDGES WITH MORE PARTS THAN THIS ARE SPLIT OVER MANY QUERIES
+MAX_PARTITIONS = 20
+MAX_CONCURRENT_PARTITIONS = 4  # PARTITION QUERIES SENT TO ES AT THE SAME TIME, FOR ONE jx QUERY
+
 
 def is_aggsop(es, query):
     es.cluster.get_metadata()
@@ -255,9 +262,64 @@ def es_aggsop(es, frum, query):
             es_query.aggs[canonical_name].extended_stats.script = abs_value.to_ruby()
 
     decoders = get_decoders_by_depth(query)
-    start = 0
+    partitioned, num_partitions = _partition_plan(decoders, frum)
+
+    if partitioned:
+        # SPLIT THE HIGH-CARDINALITY EDGE INTO DISJOINT SUB-QUERIES, AND MERGE THE BUCKETS
+        es_queries = []
+        for p in range(num_partitions):
+            partitioned.partition = (p, num_partitions)
+            es_query_p, start = _build_es_query(es_query, decoders, frum, query, es_column_map)
+            es_queries.append(es_query_p)
+        partitioned.partition = None
+
+        with Timer("ES query time") as es_duration:
+            results = _post_all(es, es_queries, query.limit)
+
+        result = results[0]
+        aggregations = {}
+        for r, q in zip(results, es_queries):
+            _merge_aggs(aggregations, unwrap(r.aggregations), unwrap(q))
+        result.aggregations = aggregations
+        es_query = wrap({"partitions": es_queries})
+    else:
+        es_query, start = _build_es_query(es_query, decoders, frum, query, es_column_map)
+
+        with Timer("ES query time") as es_duration:
+            result = es09.util.post(es, es_query, query.limit)
 
-    vars_ = query.where.vars()
+    try:
+        format_time = Timer("formatting")
+        with format_time:
+            decoders = [d for ds in decoders for d in ds]
+            result.aggregations.doc_count = coalesce(result.aggregations.doc_count, result.hits.total)  # IT APPEARS THE OLD doc_count IS GONE
+
+            formatter, groupby_formatter, aggop_formatter, mime_type = format_dispatch[query.format]
+            if query.edges:
+                output = formatter(decoders, result.aggregations, start, query, select)
+            elif query.groupby:
+                output = groupby_formatter(decoders, result.aggregations, start, query, select)
+            else:
+                output = aggop_formatter(decoders, result.aggregations, start, query, select)
+
+        output.meta.timing.formatting = format_time.duration
+        output.meta.timing.es_search = es_duration.duration
+        output.meta.content_type = mime_type
+        output.meta.es_query = es_query
+        return output
+    except Exception, e:
+        if query.format not in format_dispatch:
+            Log.error("Format {{format|quote}} not supported yet", format=query.format, cause=e)
+        Log.error("Some problem", e)
+
+
+
+def _build_es_query(es_query, decoders, frum, query, es_column_map):
+    """
+    WRAP THE es_query (OF SELECT AGGREGATES) WITH THE EDGE AGGREGATES, AND THE where CLAUSE
+    :return: (es_query, number of columns used by the decoders)
+    """
+    start = 0
 
     #<TERRIBLE SECTION> THIS IS WHERE WE WEAVE THE where CLAUSE WITH nested
     split_where = split_expression_by_depth(query.where, schema=frum.schema, map_=es_column_map)
@@ -307,34 +369,105 @@ def es_aggsop(es, frum, query):
         es_query = wrap({"query": {"match_all": {}}})
 
     es_query.size = 0
+    return es_query, start
 
-    with Timer("ES query time") as es_duration:
-        result = es09.util.post(es, es_query, query.limit)
 
-    try:
-        format_time = Timer("formatting")
-        with format_time:
-            decoders = [d for ds in decoders for d in ds]
-            result.aggregations.doc_count = coalesce(result.aggregations.doc_count, result.hits.total)  # IT APPEARS THE OLD doc_count IS GONE
+def _partition_plan(decoders, frum):
+    """
+    USE THE COLUMN CARDINALITY TO DECIDE IF AN EDGE HAS TOO MANY PARTS FOR ONE QUERY
+    :return: (decoder, num_partitions) FOR THE EDGE TO SPLIT, OR (None, 1)
+    """
+    best, best_cardinality = None, PARTITION_SIZE
+    for d in listwrap(decoders[0]) if decoders else []:
+        if not isinstance(d, DefaultDecoder) or not isinstance(d.edge.value, Variable):
+            continue
+        cardinality = MAX(c.cardinality for c in frum.schema.columns if c.es_column == d.edge.value.var)
+        # ONLY SPLIT WHEN ALL PARTS ARE EXPECTED, OTHERWISE THE TOP-N BY COUNT CAN NOT BE FOUND
+        if cardinality == None or cardinality <= best_cardinality or cardinality > d.domain.limit:
+            continue
+        best, best_cardinality = d, cardinality
+
+    if not best:
+        return None, 1
+    return best, Math.min(MAX_PARTITIONS, (best_cardinality + PARTITION_SIZE - 1) // PARTITION_SIZE)
+
+
+def _post_all(es, es_queries, limit):
+    """
+    SEND es_queries, AT MOST MAX_CONCURRENT_PARTITIONS AT A TIME
+    :return: THE RESPONSES, IN THE SAME ORDER
+    """
+    results = [None] * len(es_queries)
+    todo = iter(enumerate(es_queries))
+    locker = Lock("aggs partitions")
+
+    def worker(please_stop):
+        while not please_stop:
+            with locker:
+                p, es_query = next(todo, (None, None))
+            if es_query is None:
+                return
+            results[p] = es09.util.post(es, es_query, limit)
+
+    threads = [
+        Thread.run("aggs partition worker " + unicode(i), worker)
+        for i in range(min(MAX_CONCURRENT_PARTITIONS, len(es_queries)))
+    ]
+    failures = []
+    for t in threads:
+        try:
+            t.join()
+        except Exception, e:
+            failures.append(e)
+    if failures:
+        Log.error("Problem with partitioned query", cause=failures)
+    return results
 
-            formatter, groupby_formatter, aggop_formatter, mime_type = format_dispatch[query.format]
-            if query.edges:
-                output = formatter(decoders, result.aggregations, start, query, select)
-            elif query.groupby:
-                output = groupby_formatter(decoders, result.aggregations, start, query, select)
+
+def _merge_aggs(acc, more, es_query, summing=False):
+    """
+    ADD THE ES aggregations RESULT more TO acc
+    es_query IS THE PARTITION QUERY THAT GAVE more, IT IS WALKED WITH THE RESULT TO FIND THE PARTITIONED EDGE
+    EVERY PARTITION SEES ALL THE DOCUMENTS, SO ABOVE THE PARTITIONED EDGE THE COUNTS OF THE FIRST PARTITION ARE
+    KEPT. AT, AND BELOW, THE BUCKETS OF THE PARTITIONED EDGE THE BUCKETS WITH THE SAME key ARE MERGED, AND THE
+    doc_count ARE SUMMED
+    """
+    summing = summing or _is_partitioned(es_query)
+    for k, v in more.items():
+        a = acc.get(k)
+        if a is None:
+            acc[k] = v
+        elif k in ("doc_count", "sum_other_doc_count"):
+            if summing:
+                acc[k] = a + v
+        elif k == "buckets":
+            # THE BUCKET CONTENT IS THE RESULT OF THE SUB-AGGREGATES OF es_query
+            if isinstance(v, Mapping):
+                for key, b in v.items():
+                    existing = a.get(key)
+                    if existing is None:
+                        a[key] = b
+                    else:
+                        _merge_aggs(existing, b, es_query, summing)
             else:
-                output = aggop_formatter(decoders, result.aggregations, start, query, select)
+                lookup = {b.get("key", i): b for i, b in enumerate(a)}
+                for i, b in enumerate(v):
+                    existing = lookup.get(b.get("key", i))
+                    if existing is None:
+                        a.append(b)
+                    else:
+                        _merge_aggs(existing, b, es_query, summing)
+        elif isinstance(v, Mapping):
+            _merge_aggs(a, v, _get(_get(es_query, "aggs"), k), summing)
+    return acc
+
+
+def _is_partitioned(es_query):
+    return _get(_get(es_query, "terms"), "script") == PARTITION_SCRIPT
 
-        output.meta.timing.formatting = format_time.duration
-        output.meta.timing.es_search = es_duration.duration
-        output.meta.content_type = mime_type
-        output.meta.es_query = es_query
-        return output
-    except Exception, e:
-        if query.format not in format_dispatch:
-            Log.error("Format {{format|quote}} not supported yet", format=query.format, cause=e)
-        Log.error("Some problem", e)
 
+def _get(es_query, name):
+    return unwrap(unwrap(es_query or EMPTY).get(name))
 
 
 EMPTY = {}
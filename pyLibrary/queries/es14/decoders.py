@@ -25,6 +25,7 @@ from pyLibrary.queries.expressions import simplify_esfilter, Variable, NotOp, In
     InequalityOp, TupleOp
 from pyLibrary.queries.query import MAX_LIMIT, DEFAULT_LIMIT
 
+PARTITION_SCRIPT = "doc[field].values.findAll{(it.hashCode() & 0x7fffffff) % n == p}"  # THE VALUES IN PARTITION p OF n
 
 class AggsDecoder(object):
     def __new__(cls, e=None, query=None, *args, **kwargs):
@@ -439,6 +440,7 @@ class DefaultDecoder(SetDecoder):
         self.parts = list()
         self.key2index = {}
         self.computed_domain = False
+        self.partition = None  # (p, n) WHEN ONLY THE p-th OF n HASH PARTITIONS OF THE VALUES ARE REQUESTED
 
         # WE ASSUME IF THE VARIABLES MATCH, THEN THE SORT TERM AND EDGE TERM MATCH, AND WE SORT BY TERM
         self.sorted = None
@@ -467,6 +469,23 @@ class DefaultDecoder(SetDecoder):
             }})
             return output
 
+        if self.partition:
+            # EACH VALUE IS IN EXACTLY ONE PARTITION, SO THE BUCKETS OF ALL PARTITIONS ARE DISJOINT
+            p, n = self.partition
+            output = wrap({"aggs": {
+                "_match": set_default(
+                    {"terms": {
+                        "script": PARTITION_SCRIPT,
+                        "params": {"field": self.edge.value.var, "n": n, "p": p},
+                        "size": self.domain.limit,
+                        "order": {"_term": self.sorted} if self.sorted else None
+                    }},
+                    es_query
+                ),
+                "_missing": set_default({"missing": {"field": self.edge.value}}, es_query) if p == 0 else None
+            }})
+            return output
+
         output = wrap({"aggs": {
             "_match": set_default(
                 {"terms": {
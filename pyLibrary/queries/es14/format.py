@@ -37,7 +37,7 @@ def format_cube(decoders, aggs, start, query, select):
         dims.append(len(e.domain.partitions)+extra)
 
     dims = tuple(dims)
-    matricies = [(s, Matrix(dims=dims, zeros=s.default)) for s in select]
+    matricies = [(s, Matrix(dims=dims, zeros=s.default, flat=True)) for s in select]
     for row, coord, agg in aggs_iterator(aggs, decoders):
         for s, m in matricies:
             try:
@@ -74,7 +74,7 @@ def format_table(decoders, aggs, start, query, select):
 
     def data():
         dims = tuple(len(e.domain.partitions) + (0 if e.allowNulls is False else 1) for e in new_edges)
-        is_sent = Matrix(dims=dims, zeros=0)
+        is_sent = Matrix(dims=dims, zeros=0, flat=True)
         for row, coord, agg in aggs_iterator(aggs, decoders):
             is_sent[coord] = 1
 
@@ -178,7 +178,7 @@ def format_list(decoders, aggs, start, query, select):
 
     def data():
         dims = tuple(len(e.domain.partitions) + (0 if e.allowNulls is False else 1) for e in new_edges)
-        is_sent = Matrix(dims=dims, zeros=0)
+        is_sent = Matrix(dims=dims, zeros=0, flat=True)
         for row, coord, agg in aggs_iterator(aggs, decoders):
             is_sent[coord] = 1
 
@@ -18,6 +18,7 @@ from mo_dots.lists import FlatList
 from mo_logs import Log
 from mo_math import AND
 from mo_math import MAX
+from mo_math import Math
 from mo_times.timer import Timer
 from pyLibrary import queries
 from pyLibrary.queries import es14, es09
@@ -29,6 +30,7 @@ from pyLibrary.queries.expressions import simplify_esfilter, Variable, LeavesOp
 from pyLibrary.queries.query import DEFAULT_LIMIT
 
 format_dispatch = {}
+SCROLL_SIZE = 1000  # HITS PER PAGE WHEN STREAMING
 
 
 def is_setop(es, query):
@@ -55,7 +57,10 @@ def is_setop(es, query):
 def es_setop(es, query):
     es_query, filters = es14.util.es_query_template(query.frum.name)
     set_default(filters[0], simplify_esfilter(query.where.to_esfilter()))
-    es_query.size = coalesce(query.limit, queries.query.DEFAULT_LIMIT)
+    if query.stream:
+        es_query.size = Math.min(SCROLL_SIZE, query.limit)
+    else:
+        es_query.size = coalesce(query.limit, queries.query.DEFAULT_LIMIT)
     es_query.sort = jx_sort_to_es_sort(query.sort)
     es_query.fields = FlatList()
 
@@ -177,6 +182,9 @@ def extract_rows(es, es_query, query):
         else:
             Log.error("Do not know what to do")
 
+    if query.stream:
+        return stream_rows(es, es_query, new_select, query)
+
     with Timer("call to ES") as call_timer:
         data = es09.util.post(es, es_query, query.limit)
 
@@ -194,36 +202,92 @@ def extract_rows(es, es_query, query):
         Log.error("problem formatting", e)
 
 
+def stream_rows(es, es_query, select, query):
+    """
+    RETURN A RESULT WITH A GENERATOR FOR data, FILLED BY SCROLLING THROUGH THE INDEX
+    ONLY ONE PAGE OF HITS IS HELD IN MEMORY AT A TIME
+    """
+    formatter = stream_dispatch.get(query.format)
+    if not formatter:
+        Log.error("Can not stream {{format|quote}} format", format=query.format)
+
+    def hits():
+        num = 0
+        pages = es.scroll(es_query)
+        try:
+            for page in pages:
+                for h in page:
+                    if num >= query.limit:
+                        return
+                    num += 1
+                    yield h
+        finally:
+            # CLEAR THE SCROLL, EVEN IF NOT ALL PAGES WERE READ
+            pages.close()
+
+    output = formatter(hits(), select, query)
+    output.meta.content_type = "application/json"
+    output.meta.es_query = es_query
+    return output
+
+
 def format_list(T, select, query=None):
-    data = []
-    if isinstance(query.select, list):
-        for row in T:
-            r = Data()
-            for s in select:
-                r[s.put.name][s.put.child] = unwraplist(row[s.pull])
-            data.append(r if r else None)
-    elif isinstance(query.select.value, LeavesOp):
+    return Data(
+        meta={"format": "list"},
+        data=list(_list_rows(T, select, query))
+    )
+
+
+def stream_list(T, select, query=None):
+    return Data(
+        meta={"format": "list"},
+        data=_list_rows(T, select, query)
+    )
+
+
+def _list_rows(T, select, query):
+    if isinstance(query.select, list) or isinstance(query.select.value, LeavesOp):
         for row in T:
             r = Data()
             for s in select:
                 r[s.put.name][s.put.child] = unwraplist(row[s.pull])
-            data.append(r if r else None)
+            yield r if r else None
     else:
         for row in T:
             r = Data()
             for s in select:
                 r[s.put.child] = unwraplist(row[s.pull])
-            data.append(r if r else None)
+            yield r if r else None
 
+
+def format_table(T, select, query=None):
+    num_columns = (MAX(select.put.index) + 1)
     return Data(
-        meta={"format": "list"},
-        data=data
+        meta={"format": "table"},
+        header=_table_header(select, num_columns),
+        data=list(_table_rows(T, select, num_columns))
     )
 
 
-def format_table(T, select, query=None):
-    data = []
+def stream_table(T, select, query=None):
     num_columns = (MAX(select.put.index) + 1)
+    return Data(
+        meta={"format": "table"},
+        header=_table_header(select, num_columns),
+        data=_table_rows(T, select, num_columns)
+    )
+
+
+def _table_header(select, num_columns):
+    header = [None] * num_columns
+    for s in select:
+        if header[s.put.index]:
+            continue
+        header[s.put.index] = s.name
+    return header
+
+
+def _table_rows(T, select, num_columns):
     for row in T:
         r = [None] * num_columns
         for s in select:
@@ -240,19 +304,7 @@ def format_table(T, select, query=None):
                     r[index] = Data()
                 r[index][child] = value
 
-        data.append(r)
-
-    header = [None] * num_columns
-    for s in select:
-        if header[s.put.index]:
-            continue
-        header[s.put.index] = s.name
-
-    return Data(
-        meta={"format": "table"},
-        header=header,
-        data=data
-    )
+        yield r
 
 
 def format_cube(T, select, query=None):
@@ -273,6 +325,11 @@ def format_cube(T, select, query=None):
     )
 
 
+stream_dispatch = {
+    "table": stream_table,
+    "list": stream_list
+}
+
 set_default(format_dispatch, {
     None: (format_cube, None, "application/json"),
     "cube": (format_cube, None, "application/json"),
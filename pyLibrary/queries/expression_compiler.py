@@ -11,20 +11,92 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import json
 import re
 
+from mo_collections.lru import LRU
 from pyLibrary import convert
 from mo_logs import Log
-from mo_dots import coalesce, Data
+from mo_dots import coalesce, Data, unwrap
+from mo_threads import Lock
 from mo_times.dates import Date
 
 true = True
 false = False
 null = None
 EMPTY_DICT = {}
+MAX_COMPILED = 1000  # NUMBER OF COMPILED FUNCTIONS TO KEEP
+
+
+class FunctionCache(object):
+    """
+    PROCESS-WIDE LRU CACHE OF COMPILED FUNCTIONS
+    """
+
+    def __init__(self, max_size=MAX_COMPILED):
+        self.locker = Lock("compiled functions stats")
+        self.data = LRU(max_size, "compiled functions")  # MAP FROM KEY TO FUNCTION
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, source):
+        """
+        :param key: CANONICAL KEY FOR THE FUNCTION
+        :param source: FUNCTION THAT RETURNS THE PYTHON SOURCE, CALLED ONLY ON A MISS
+        :return: THE COMPILED FUNCTION
+        """
+        func = self.data.get(key)
+        with self.locker:
+            if func is not None:
+                self.hits += 1
+                return func
+            self.misses += 1
+
+        func = _compile(source())
+        self.data.add(key, func)
+        return func
+
+    def clear(self):
+        self.data.clear()
+
+    @property
+    def stats(self):
+        with self.locker:
+            total = self.hits + self.misses
+            return Data(
+                size=len(self.data),
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / total if total else None
+            )
+
+
+compiled = FunctionCache()
+
+
+def canonical_key(expr):
+    """
+    :param expr: AN Expression, OR ITS JSON
+    :return: CANONICAL JSON OF THE EXPRESSION, OR None IF IT CAN NOT BE SERIALIZED
+    WHEN None, THE CALLER MUST CONVERT THE EXPRESSION TO PYTHON, AND CACHE ON THE SOURCE TEXT
+    """
+    try:
+        if hasattr(expr, "__data__"):
+            expr = expr.__data__()
+        return json.dumps(unwrap(expr), sort_keys=True)
+    except Exception:
+        return None
 
 
 def compile_expression(source):
+    """
+    :param source:  PYTHON SOURCE CODE
+    :return:  PYTHON FUNCTION (CACHED)
+    """
+    return compiled.get(("python", source), lambda: source)
+
+
+def _compile(source):
     """
     THIS FUNCTION IS ON ITS OWN FOR MINIMAL GLOBAL NAMESPACE
 
@@ -12,12 +12,13 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import itertools
+import operator
 from collections import Mapping
 from decimal import Decimal
 
 import mo_json
 from mo_dots import coalesce, wrap, set_default, literal_field, Null, split_field, startswith_field, Data, join_field, unwraplist, \
-    ROOT_PATH, relative_field
+    ROOT_PATH, relative_field, listwrap, unwrap
 from mo_logs import Log
 from mo_logs.exceptions import suppress_exception
 from mo_math import Math
@@ -26,7 +27,7 @@ from mo_times.dates import Date
 from pyLibrary import convert
 from pyLibrary.queries.containers import STRUCT, OBJECT
 from pyLibrary.queries.domains import is_keyword
-from pyLibrary.queries.expression_compiler import compile_expression
+from pyLibrary.queries.expression_compiler import compile_expression, compiled, canonical_key
 
 ALLOW_SCRIPTING = False
 TRUE_FILTER = True
@@ -120,11 +121,16 @@ def jx_expression_to_function(expr):
     if isinstance(expr, Expression):
         if isinstance(expr, ScriptOp) and not isinstance(expr.script, unicode):
             return expr.script
-        else:
+        key = canonical_key(expr)
+        if key is None:
             return compile_expression(expr.to_python())
+        return compiled.get(("jx", key), expr.to_python)
     if expr != None and not isinstance(expr, (Mapping, list)) and hasattr(expr, "__call__"):
         return expr
-    return compile_expression(jx_expression(expr).to_python())
+    key = canonical_key(expr)
+    if key is None:
+        return compile_expression(jx_expression(expr).to_python())
+    return compiled.get(("jx", key), lambda: jx_expression(expr).to_python())
 
 
 class Expression(object):
@@ -167,6 +173,18 @@ class Expression(object):
         """
         raise Log.error("{{type}} has no `to_python` method", type=self.__class__.__name__)
 
+
+    def to_vector(self, table):
+        """
+        EVALUATE THIS EXPRESSION OVER ALL ROWS AT ONCE
+        :param table: ITERABLE OF ROWS, WITH column(name) RETURNING THE LIST OF
+                      VALUES FOR A STORED COLUMN (OR None IF NOT STORED AS A COLUMN)
+        :return: LIST OF VALUES, ONE PER ROW (None FOR null)
+        """
+        # NO VECTOR FORM, SO RUN THE to_python() FORM ON EACH ROW
+        func = jx_expression_to_function(self)
+        return [None if v == None else v for v in (func(r) for r in table)]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         """
         :param not_null:  IF YOU KNOW THIS WILL NOT RETURN NULL (DO NOT INCLUDE NULL CHECKS)
@@ -267,6 +285,13 @@ class Variable(Expression):
                 agg = agg+".get("+convert.value2quote(p)+", EMPTY_DICT)"
         return agg+".get("+convert.value2quote(path[-1])+")"
 
+
+    def to_vector(self, table):
+        values = table.column(self.var)
+        if values is None:
+            return Expression.to_vector(self, table)
+        return values
+
     def to_sql(self, schema, not_null=False, boolean=False):
         cols = [c for c in schema.columns if startswith_field(schema.get_column_name(c), self.var)]
         if not cols:
@@ -403,7 +428,7 @@ class RowsOp(Expression):
 
     def __data__(self):
         if isinstance(self.var, Literal) and isinstance(self.offset, Literal):
-            return {"rows": {self.var.json, mo_json.json2value(self.offset.json)}}
+            return {"rows": {mo_json.json2value(self.var.json): mo_json.json2value(self.offset.json)}}
         else:
             return {"rows": [self.var.__data__(), self.offset.__data__()]}
 
@@ -431,7 +456,7 @@ class GetOp(Expression):
 
     def __data__(self):
         if isinstance(self.var, Literal) and isinstance(self.offset, Literal):
-            return {"get": {self.var.json, mo_json.json2value(self.offset.json)}}
+            return {"get": {mo_json.json2value(self.var.json): mo_json.json2value(self.offset.json)}}
         else:
             return {"get": [self.var.__data__(), self.offset.__data__()]}
 
@@ -541,6 +566,10 @@ class Literal(Expression):
     def to_python(self, not_null=False, boolean=False):
         return self.json
 
+
+    def to_vector(self, table):
+        return [mo_json.json2value(self.json)] * len(table)
+
     def to_sql(self, schema, not_null=False, boolean=False):
         value = mo_json.json2value(self.json)
         v = sql_quote(value)
@@ -559,7 +588,7 @@ class Literal(Expression):
         return mo_json.json2value(self.json)
 
     def __data__(self):
-        return {"literal": mo_json.json2value(self.json)}
+        return {"literal": unwrap(mo_json.json2value(self.json))}
 
     def vars(self):
         return set()
@@ -911,6 +940,14 @@ class BinaryOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "(" + self.lhs.to_python() + ") " + BinaryOp.operators[self.op] + " (" + self.rhs.to_python()+")"
 
+
+    def to_vector(self, table):
+        op = _vector_operators[BinaryOp.operators[self.op]]
+        return [
+            d if l is None or r is None else op(l, r)
+            for l, r, d in itertools.izip(self.lhs.to_vector(table), self.rhs.to_vector(table), self.default.to_vector(table))
+        ]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         lhs = self.lhs.to_sql(schema)[0].sql.n
         rhs = self.rhs.to_sql(schema)[0].sql.n
@@ -932,9 +969,9 @@ class BinaryOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {self.op: {self.lhs.var, mo_json.json2value(self.rhs.json)}, "default": self.default}
+            return {self.op: {self.lhs.var: mo_json.json2value(self.rhs.json)}, "default": self.default.__data__()}
         else:
-            return {self.op: [self.lhs.__data__(), self.rhs.__data__()], "default": self.default}
+            return {self.op: [self.lhs.__data__(), self.rhs.__data__()], "default": self.default.__data__()}
 
     def vars(self):
         return self.lhs.vars() | self.rhs.vars() | self.default.vars()
@@ -991,6 +1028,14 @@ class InequalityOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "(" + self.lhs.to_python() + ") " + InequalityOp.operators[self.op] + " (" + self.rhs.to_python()+")"
 
+
+    def to_vector(self, table):
+        op = _vector_operators[InequalityOp.operators[self.op]]
+        return [
+            d if l is None or r is None else op(l, r)
+            for l, r, d in itertools.izip(self.lhs.to_vector(table), self.rhs.to_vector(table), self.default.to_vector(table))
+        ]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         lhs = self.lhs.to_sql(schema, not_null=True)[0].sql
         rhs = self.rhs.to_sql(schema, not_null=True)[0].sql
@@ -1032,9 +1077,9 @@ class InequalityOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {self.op: {self.lhs.var, mo_json.json2value(self.rhs.json)}, "default": self.default}
+            return {self.op: {self.lhs.var: mo_json.json2value(self.rhs.json)}, "default": self.default.__data__()}
         else:
-            return {self.op: [self.lhs.__data__(), self.rhs.__data__()], "default": self.default}
+            return {self.op: [self.lhs.__data__(), self.rhs.__data__()], "default": self.default.__data__()}
 
     def vars(self):
         return self.lhs.vars() | self.rhs.vars() | self.default.vars()
@@ -1076,6 +1121,13 @@ class DivOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "None if ("+self.missing().to_python()+") else (" + self.lhs.to_python(not_null=True) + ") / (" + self.rhs.to_python(not_null=True)+")"
 
+
+    def to_vector(self, table):
+        return [
+            None if l is None or r is None or r == 0 else l / r
+            for l, r in itertools.izip(self.lhs.to_vector(table), self.rhs.to_vector(table))
+        ]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         lhs = self.lhs.to_sql(schema)[0].sql.n
         rhs = self.rhs.to_sql(schema)[0].sql.n
@@ -1103,9 +1155,9 @@ class DivOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {"div": {self.lhs.var, mo_json.json2value(self.rhs.json)}, "default": self.default}
+            return {"div": {self.lhs.var: mo_json.json2value(self.rhs.json)}, "default": self.default.__data__()}
         else:
-            return {"div": [self.lhs.__data__(), self.rhs.__data__()], "default": self.default}
+            return {"div": [self.lhs.__data__(), self.rhs.__data__()], "default": self.default.__data__()}
 
     def vars(self):
         return self.lhs.vars() | self.rhs.vars() | self.default.vars()
@@ -1152,9 +1204,9 @@ class FloorOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {"floor": {self.lhs.var, mo_json.json2value(self.rhs.json)}, "default": self.default}
+            return {"floor": {self.lhs.var: mo_json.json2value(self.rhs.json)}, "default": self.default.__data__()}
         else:
-            return {"floor": [self.lhs.__data__(), self.rhs.__data__()], "default": self.default}
+            return {"floor": [self.lhs.__data__(), self.rhs.__data__()], "default": self.default.__data__()}
 
     def vars(self):
         return self.lhs.vars() | self.rhs.vars() | self.default.vars()
@@ -1202,6 +1254,10 @@ class EqOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "(" + self.lhs.to_python() + ") == (" + self.rhs.to_python()+")"
 
+
+    def to_vector(self, table):
+        return [l == r for l, r in itertools.izip(self.lhs.to_vector(table), self.rhs.to_vector(table))]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         lhs = self.lhs.to_sql(schema)
         rhs = self.rhs.to_sql(schema)
@@ -1240,7 +1296,7 @@ class EqOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {"eq": {self.lhs.var, mo_json.json2value(self.rhs.json)}}
+            return {"eq": {self.lhs.var: mo_json.json2value(self.rhs.json)}}
         else:
             return {"eq": [self.lhs.__data__(), self.rhs.__data__()]}
 
@@ -1279,6 +1335,13 @@ class NeOp(Expression):
         rhs = self.rhs.to_python()
         return "((" + lhs + ") != None and (" + rhs + ") != None and (" + lhs + ") != (" + rhs + "))"
 
+
+    def to_vector(self, table):
+        return [
+            l is not None and r is not None and l != r
+            for l, r in itertools.izip(self.lhs.to_vector(table), self.rhs.to_vector(table))
+        ]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         lhs = self.lhs.to_sql(schema)[0].sql
         rhs = self.rhs.to_sql(schema)[0].sql
@@ -1302,7 +1365,7 @@ class NeOp(Expression):
 
     def __data__(self):
         if isinstance(self.lhs, Variable) and isinstance(self.rhs, Literal):
-            return {"ne": {self.lhs.var, mo_json.json2value(self.rhs.json)}}
+            return {"ne": {self.lhs.var: mo_json.json2value(self.rhs.json)}}
         else:
             return {"ne": [self.lhs.__data__(), self.rhs.__data__()]}
 
@@ -1328,6 +1391,10 @@ class NotOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "not (" + self.term.to_python() + ")"
 
+
+    def to_vector(self, table):
+        return [not v for v in self.term.to_vector(table)]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         return wrap([{"name": ".", "sql": {"b": "NOT (" + self.term.to_sql(schema).b + ")"}}])
 
@@ -1373,6 +1440,13 @@ class AndOp(Expression):
         else:
             return " and ".join("(" + t.to_python() + ")" for t in self.terms)
 
+
+    def to_vector(self, table):
+        output = [True] * len(table)
+        for t in self.terms:
+            output = [a and bool(b) for a, b in itertools.izip(output, t.to_vector(table))]
+        return output
+
     def to_sql(self, schema, not_null=False, boolean=False):
         if not self.terms:
             return wrap([{"name":".", "sql": {"b": "1"}}])
@@ -1414,6 +1488,13 @@ class OrOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return " or ".join("(" + t.to_python() + ")" for t in self.terms)
 
+
+    def to_vector(self, table):
+        output = [False] * len(table)
+        for t in self.terms:
+            output = [a or bool(b) for a, b in itertools.izip(output, t.to_vector(table))]
+        return output
+
     def to_sql(self, schema, not_null=False, boolean=False):
         return wrap([{"name":".", "sql":{"b": " OR ".join("(" + t.to_sql(schema, boolean=True)[0].sql.b + ")" for t in self.terms)}}])
 
@@ -1653,6 +1734,22 @@ class MultiOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return MultiOp.operators[self.op][0].join("(" + t.to_python() + ")" for t in self.terms)
 
+
+    def to_vector(self, table):
+        op = _vector_operators[MultiOp.operators[self.op][0].strip()]
+        output = []
+        for values, d in itertools.izip(itertools.izip(*[t.to_vector(table) for t in self.terms]), self.default.to_vector(table)):
+            if self.nulls:
+                values = [v for v in values if v is not None]
+                if not values:
+                    output.append(d)
+                    continue
+            elif None in values:
+                output.append(d)
+                continue
+            output.append(reduce(op, values))
+        return output
+
     def to_sql(self, schema, not_null=False, boolean=False):
         terms = [t.to_sql(schema) for t in self.terms]
         default = coalesce(self.default.to_sql(schema)[0].sql.n, "NULL")
@@ -1687,7 +1784,7 @@ class MultiOp(Expression):
             return wrap([{"name": ".", "sql": {"n": sql}}])
 
     def __data__(self):
-        return {self.op: [t.__data__() for t in self.terms], "default": self.default, "nulls": self.nulls}
+        return {self.op: [t.__data__() for t in self.terms], "default": self.default.__data__(), "nulls": self.nulls.__data__()}
 
     def vars(self):
         output = set()
@@ -1738,7 +1835,7 @@ class RegExpOp(Expression):
         return {"regexp": {self.var.var: mo_json.json2value(self.pattern.json)}}
 
     def __data__(self):
-        return {"regexp": {self.var.var: self.pattern}}
+        return {"regexp": {self.var.var: mo_json.json2value(self.pattern.json)}}
 
     def vars(self):
         return {self.var.var}
@@ -1771,6 +1868,13 @@ class CoalesceOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "coalesce(" + (",".join(t.to_python() for t in self.terms)) + ")"
 
+
+    def to_vector(self, table):
+        output = [None] * len(table)
+        for t in self.terms:
+            output = [v if v is not None else n for v, n in itertools.izip(output, t.to_vector(table))]
+        return output
+
     def to_sql(self, schema, not_null=False, boolean=False):
         acc = {
             "b": [],
@@ -1831,6 +1935,10 @@ class MissingOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return self.expr.to_python() + " == None"
 
+
+    def to_vector(self, table):
+        return [v == None for v in self.expr.to_vector(table)]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         field = self.expr.to_sql(schema)
 
@@ -1890,6 +1998,10 @@ class ExistsOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return self.field.to_python() + " != None"
 
+
+    def to_vector(self, table):
+        return [v != None for v in self.field.to_vector(table)]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         field = self.field.to_sql(schema)[0].sql
         acc = []
@@ -1940,6 +2052,12 @@ class PrefixOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "(" + self.field.to_python() + ").startswith(" + self.prefix.to_python() + ")"
 
+
+    def to_vector(self, table):
+        return [
+            v is not None and p is not None and v.startswith(p)
+            for v, p in itertools.izip(self.field.to_vector(table), self.prefix.to_vector(table))
+        ]
     def to_sql(self, schema, not_null=False, boolean=False):
         return {"b": "INSTR(" + self.field.to_sql(schema).s + ", " + self.prefix.to_sql().s + ")==1"}
 
@@ -2033,12 +2151,9 @@ class ConcatOp(Expression):
             }])
 
     def __data__(self):
-        if isinstance(self.value, Variable) and isinstance(self.length, Literal):
-            output = {"concat": {self.terms[0].var: mo_json.json2value(self.terms[2].json)}}
-        else:
-            output = {"concat": [t.__data__() for t in self.terms]}
+        output = {"concat": [t.__data__() for t in self.terms], "default": self.default.__data__()}
         if self.separator.json != '""':
-            output["separator"] = mo_json.json2value(self.terms[2].json)
+            output["separator"] = mo_json.json2value(self.separator.json)
         return output
 
     def vars(self):
@@ -2442,6 +2557,13 @@ class BetweenOp(Expression):
             "start": clauses["start"]
         }
 
+    def __data__(self):
+        return {
+            "between": [self.value.__data__(), self.prefix.__data__(), self.suffix.__data__()],
+            "default": self.default.__data__(),
+            "start": self.start.__data__()
+        }
+
     def to_ruby(self, not_null=False, boolean=False):
         if isinstance(self.prefix, Literal) and isinstance(mo_json.json2value(self.prefix.json), int):
             value_is_missing = self.value.missing().to_ruby()
@@ -2591,6 +2713,13 @@ class InOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return self.field.to_python() + " in " + self.values.to_python()
 
+
+    def to_vector(self, table):
+        if not isinstance(self.values, Literal):
+            return Expression.to_vector(self, table)
+        values = listwrap(mo_json.json2value(self.values.json))
+        return [v in values for v in self.field.to_vector(table)]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         if not isinstance(self.values, Literal):
             Log.error("Not supported")
@@ -2642,6 +2771,13 @@ class WhenOp(Expression):
     def to_python(self, not_null=False, boolean=False):
         return "(" + self.when.to_python(boolean=True) + ") ? (" + self.then.to_python(not_null=not_null) + ") : (" + self.els_.to_python(not_null=not_null) + ")"
 
+
+    def to_vector(self, table):
+        return [
+            t if w else e
+            for w, t, e in itertools.izip(self.when.to_vector(table), self.then.to_vector(table), self.els_.to_vector(table))
+        ]
+
     def to_sql(self, schema, not_null=False, boolean=False):
         when = self.when.to_sql(schema, boolean=True)[0].sql
         then = self.then.to_sql(schema, not_null=not_null)[0].sql
@@ -2717,6 +2853,13 @@ class CaseOp(Expression):
             acc = "(" + w.when.to_python(boolean=True) + ") ? (" + w.then.to_python() + ") : (" + acc + ")"
         return acc
 
+
+    def to_vector(self, table):
+        output = self.whens[-1].to_vector(table)
+        for w in reversed(self.whens[0:-1]):
+            output = [t if c else a for c, t, a in itertools.izip(w.when.to_vector(table), w.then.to_vector(table), output)]
+        return output
+
     def to_sql(self, schema, not_null=False, boolean=False):
         output = {}
         for t in "bsn":  # EXPENSIVE LOOP to_sql() RUN 3 TIMES
@@ -2957,6 +3100,19 @@ def split_expression_by_depth(where, schema, map_, output=None, var_to_depth=Non
     return output
 
 
+_vector_operators = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "**": operator.pow,
+    "%": operator.mod,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le
+}
+
 operators = {
     "add": MultiOp,
     "and": AndOp,
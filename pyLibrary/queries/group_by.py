@@ -14,6 +14,7 @@ from __future__ import unicode_literals
 
 import math
 import sys
+from collections import OrderedDict
 
 from mo_collections.multiset import Multiset
 from mo_logs.exceptions import Except
@@ -24,7 +25,7 @@ from pyLibrary.queries.containers import Container
 from pyLibrary.queries.expressions import jx_expression_to_function, jx_expression
 
 
-def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous=False):
+def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous=False, ordered=False):
     """
     :param data:
     :param keys:
@@ -32,6 +33,7 @@ def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous
     :param min_size:
     :param max_size:
     :param contiguous: MAINTAIN THE ORDER OF THE DATA, STARTING THE NEW GROUP WHEN THE SELECTOR CHANGES
+    :param ordered: EMIT GROUPS IN SORTED KEY ORDER (OTHERWISE ORDER OF FIRST APPEARANCE)
     :return: return list of (keys, values) PAIRS, WHERE
                  keys IS IN LEAF FORM (FOR USE WITH {"eq": terms} OPERATOR
                  values IS GENERATOR OF ALL VALUE THAT MATCH keys
@@ -47,6 +49,18 @@ def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous
 
     try:
         keys = listwrap(keys)
+        accessor = jx_expression_to_function(jx_expression({"tuple": keys}))  # CAN RETURN Null, WHICH DOES NOT PLAY WELL WITH __cmp__
+
+        if not contiguous and not ordered:
+            if not isinstance(data, list):
+                data = list(data)  # MAY NEED A SECOND PASS
+            groups = hash_groups(data, accessor)
+            if groups is not None:
+                if not groups:
+                    return Null
+                return _hash_output(keys, groups)
+            # SOME KEY IS NOT HASHABLE, SO FALL BACK TO SORTING
+
         if not contiguous:
             from pyLibrary.queries import jx
             data = jx.sort(data, keys)
@@ -54,8 +68,6 @@ def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous
         if not data:
             return Null
 
-
-        accessor = jx_expression_to_function(jx_expression({"tuple": keys}))  # CAN RETURN Null, WHICH DOES NOT PLAY WELL WITH __cmp__
         def _output():
             start = 0
             prev = accessor(data[0])
@@ -78,6 +90,32 @@ def groupby(data, keys=None, size=None, min_size=None, max_size=None, contiguous
         Log.error("Problem grouping", cause=e)
 
 
+def hash_groups(data, accessor):
+    """
+    ONE PASS OVER data, BUCKETING EACH RECORD BY ITS KEY TUPLE
+    :return: OrderedDict FROM KEY TUPLE TO FlatList OF RECORDS, OR None IF A KEY IS NOT HASHABLE
+    """
+    groups = OrderedDict()
+    try:
+        for d in data:
+            key = accessor(d)
+            bucket = groups.get(key)
+            if bucket is None:
+                groups[key] = bucket = FlatList()
+            bucket.append(d)
+    except TypeError:
+        return None
+    return groups
+
+
+def _hash_output(keys, groups):
+    for key, values in groups.items():
+        group = {}
+        for k, gg in zip(keys, key):
+            group[k] = gg
+        yield Data(group), values
+
+
 def groupby_size(data, size):
     if hasattr(data, "next"):
         iterator = data
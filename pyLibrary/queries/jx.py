@@ -13,6 +13,8 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import __builtin__
+import heapq
+import itertools
 from collections import Mapping
 from types import GeneratorType
 
@@ -26,12 +28,13 @@ from mo_math import UNION, MIN
 from pyLibrary import convert
 from mo_collections.index import Index
 from mo_collections.unique_index import UniqueIndex
-from pyLibrary.queries import flat_list, query, group_by
+from pyLibrary.queries import flat_list, query, group_by, windows
 from pyLibrary.queries.containers import Container
 from pyLibrary.queries.containers.cube import Cube
 from pyLibrary.queries.cubes.aggs import cube_aggs
 from pyLibrary.queries.expression_compiler import compile_expression
-from pyLibrary.queries.expressions import TRUE_FILTER, FALSE_FILTER, jx_expression_to_function
+from pyLibrary.queries.expressions import TRUE_FILTER, FALSE_FILTER, jx_expression_to_function, Literal, TrueOp, Variable, \
+    LeavesOp
 from pyLibrary.queries.flat_list import PartFlatList
 from pyLibrary.queries.query import QueryOp, _normalize_selects
 
@@ -41,6 +44,7 @@ from pyLibrary.queries.query import QueryOp, _normalize_selects
 # TODO: USE http://docs.sqlalchemy.org/en/latest/core/tutorial.html AS DOCUMENTATION FRAMEWORK
 
 builtin_tuple = tuple
+TOP_K_RATIO = 0.1  # USE HEAP SELECTION WHEN limit IS LESS THAN THIS FRACTION OF THE ROWS
 _Column = None
 _merge_type = None
 
@@ -63,10 +67,19 @@ def run(query, frum=Null):
     else:
         query_op = QueryOp.wrap(query, frum.schema)
 
+    limit = requested_limit(query, query_op)
+
     if isinstance(frum, Container):
+        from pyLibrary.queries.containers.list_usingPythonList import ListContainer
+        from pyLibrary.queries.containers.list_usingColumns import ColumnarContainer
+        if isinstance(frum, (ListContainer, ColumnarContainer)):
+            return frum.query(query_op, limit=limit)
         return frum.query(query_op)
-    elif isinstance(frum, (list, set, GeneratorType)):
+    elif isinstance(frum, (list, set)):
         frum = wrap(list(frum))
+    elif isinstance(frum, GeneratorType):
+        if is_aggs(query_op):
+            frum = wrap(list(frum))
     elif isinstance(frum, Cube):
         if is_aggs(query_op):
             return cube_aggs(frum, query_op)
@@ -78,6 +91,9 @@ def run(query, frum=Null):
 
     if is_aggs(query_op):
         frum = list_aggs(frum, query_op)
+    elif isinstance(frum, (list, GeneratorType)):
+        # ONLY THE RESULT IS MATERIALIZED
+        frum = wrap(list(iter_setop(frum, query_op, limit)))
     else:  # SETOP
         # try:
         #     if query.filter != None or query.esfilter != None:
@@ -89,7 +105,9 @@ def run(query, frum=Null):
             frum = filter(frum, query_op.where)
 
         if query_op.sort:
-            frum = sort(frum, query_op.sort, already_normalized=True)
+            frum = sort(frum, query_op.sort, already_normalized=True, limit=limit)
+        elif limit is not None:
+            frum = frum[:limit:]
 
         if query_op.select:
             frum = select(frum, query_op.select)
@@ -116,6 +134,103 @@ def run(query, frum=Null):
     return frum
 
 
+def iter_setop(rows, query_op, limit=None):
+    """
+    LAZY filter -> sort -> limit -> select OVER rows
+    ONLY sort PULLS THE (FILTERED) ROWS INTO MEMORY, THE OTHER STEPS
+    HANDLE ONE ROW AT A TIME
+    :param rows: ITERABLE OF RECORDS
+    :param query_op: THE NORMALIZED QUERY
+    :param limit: NUMBER OF ROWS TO RETURN, None FOR ALL (SEE requested_limit)
+    :return: GENERATOR OF RESULT RECORDS
+    """
+    where = query_op.where
+    if where is not TRUE_FILTER and not isinstance(where, TrueOp):
+        accept = jx_expression_to_function(where)
+        rows = (r for r in rows if accept(wrap(r)))
+
+    if query_op.sort:
+        rows = sort(rows, query_op.sort, already_normalized=True, limit=limit)
+    elif limit is not None:
+        rows = itertools.islice(rows, limit)
+
+    selector = select_function(query_op.select)
+    if selector is None:
+        return (unwrap(r) for r in rows)
+    return itertools.imap(selector, rows)
+
+
+def select_function(select):
+    """
+    :param select: THE NORMALIZED select CLAUSE
+    :return: FUNCTION THAT PROJECTS ONE RECORD, OR None IF THE RECORD IS RETURNED AS-IS
+    """
+    if select == None:
+        return None
+
+    if isinstance(select, list):
+        if any(isinstance(s.value, LeavesOp) for s in select):
+            return _leaves_function(select)
+
+        push_and_pull = [(s.name, jx_expression_to_function(s.value)) for s in select]
+
+        def selector(d):
+            output = Data()
+            d = wrap(d)
+            for n, p in push_and_pull:
+                output[n] = p(d)
+            return unwrap(output)
+
+        return selector
+
+    if isinstance(select.value, Variable) and select.value.var == ".":
+        return None
+    if isinstance(select.value, LeavesOp):
+        return _leaves_function([select])
+
+    value = jx_expression_to_function(select.value)
+    return lambda d: unwrap(value(wrap(d)))
+
+
+def _leaves_function(select):
+    """
+    SELECT WITH "*" (LeavesOp) PUTS EVERY LEAF OF THE TERM UNDER THE SELECT NAME
+    """
+    push_and_pull = []
+    for s in select:
+        if isinstance(s.value, LeavesOp):
+            prefix = "" if s.name == "." else s.name + "."
+            push_and_pull.append((prefix, True, jx_expression_to_function(s.value.term)))
+        else:
+            push_and_pull.append((s.name, False, jx_expression_to_function(s.value)))
+
+    def selector(d):
+        output = Data()
+        d = wrap(d)
+        for n, is_leaves, p in push_and_pull:
+            if is_leaves:
+                for k, v in wrap(p(d)).leaves():
+                    output[n + k] = v
+            else:
+                output[n] = p(d)
+        return unwrap(output)
+
+    return selector
+
+
+def requested_limit(query, query_op):
+    """
+    IN-MEMORY QUERIES HAVE ALWAYS RETURNED ALL ROWS, SO ONLY A limit THE
+    CALLER EXPLICITLY ASKED FOR IS APPLIED
+    :param query: THE QUERY, AS GIVEN BY THE CALLER
+    :param query_op: THE NORMALIZED QUERY
+    :return: NUMBER OF ROWS TO RETURN, OR None FOR ALL
+    """
+    if isinstance(query, Mapping) and query.get("limit") != None:
+        return query_op.limit
+    return None
+
+
 groupby = group_by.groupby
 
 
@@ -510,16 +625,18 @@ def _deeper_iterator(columns, nested_path, path, data):
             yield output
 """
 
-def sort(data, fieldnames=None, already_normalized=False):
+def sort(data, fieldnames=None, already_normalized=False, limit=None):
     """
     PASS A FIELD NAME, OR LIST OF FIELD NAMES, OR LIST OF STRUCTS WITH {"field":field_name, "sort":direction}
+    :param limit: RETURN ONLY THE FIRST limit RECORDS (None FOR ALL)
     """
     try:
         if data == None:
             return Null
 
         if not fieldnames:
-            return wrap(sorted(data, value_compare))
+            data = list(data)
+            return wrap(_decorated_sort(data, [_sort_keys(data)], limit))
 
         if already_normalized:
             formal = fieldnames
@@ -528,29 +645,111 @@ def sort(data, fieldnames=None, already_normalized=False):
 
         funcs = [(jx_expression_to_function(f.value), f.sort) for f in formal]
 
-        def comparer(left, right):
-            for func, sort_ in funcs:
-                try:
-                    result = value_compare(func(left), func(right), sort_)
-                    if result != 0:
-                        return result
-                except Exception, e:
-                    Log.error("problem with compare", e)
-            return 0
-
         if isinstance(data, list):
-            output = FlatList([unwrap(d) for d in sorted(data, cmp=comparer)])
+            pass
         elif hasattr(data, "__iter__"):
-            output = FlatList([unwrap(d) for d in sorted(list(data), cmp=comparer)])
+            data = list(data)
         else:
             Log.error("Do not know how to handle")
-            output = None
+
+        try:
+            columns = [_sort_keys([func(d) for d in data], sort_) for func, sort_ in funcs]
+        except Exception, e:
+            Log.error("problem with compare", e)
+        output = FlatList([unwrap(d) for d in _decorated_sort(data, columns, limit)])
 
         return output
     except Exception, e:
         Log.error("Problem sorting\n{{data}}",  data=data, cause=e)
 
 
+def _decorated_sort(data, columns, limit=None):
+    """
+    DECORATE-SORT-UNDECORATE
+    :param data: LIST OF RECORDS
+    :param columns: LIST OF KEY COLUMNS, AS RETURNED BY _sort_keys()
+    :param limit: NUMBER OF RECORDS TO RETURN, None FOR ALL
+    :return: data, IN (STABLE) SORTED ORDER
+    """
+    num = len(data)
+    if limit is None or limit > num:
+        limit = num
+
+    if not columns:
+        return list(data[:limit])
+    if len(columns) == 1:
+        keys = columns[0]
+    else:
+        keys = zip(*columns)
+
+    if limit < num * TOP_K_RATIO:
+        # O(n log k) HEAP SELECTION; nsmallest() BREAKS TIES BY POSITION, SO IT IS STABLE TOO
+        order = heapq.nsmallest(limit, xrange(num), key=keys.__getitem__)
+    else:
+        order = sorted(xrange(num), key=keys.__getitem__)[:limit]
+    return [data[i] for i in order]
+
+
+def _sort_keys(values, ordering=1):
+    """
+    COMPUTE ONE KEY PER VALUE, SO PYTHON'S NATIVE COMPARE GIVES THE SAME
+    ORDER AS value_compare(l, r, ordering) (NULL IS ORDERED AFTER ALL
+    VALUES, BEFORE THEM WHEN DESCENDING)
+    """
+    kinds = set(_sort_kind(v) for v in values)
+    kinds.discard(None)
+
+    if ordering >= 0:
+        if "structure" in kinds:
+            return [_Compare(v, ordering) for v in values]
+        return [NULL_LAST if v == None else (0, v) for v in values]
+
+    if not kinds - {"number"}:
+        return [NULL_FIRST if v == None else (1, -v) for v in values]
+    if not kinds - {"string"}:
+        return [NULL_FIRST if v == None else (1, _invert_string(v)) for v in values]
+    return [_Compare(v, ordering) for v in values]
+
+
+NULL_LAST = (1,)
+NULL_FIRST = (0,)
+
+
+def _sort_kind(value):
+    if value == None:
+        return None
+    elif isinstance(value, (list, builtin_tuple, Mapping)):
+        return "structure"
+    elif isinstance(value, (int, long, float)):
+        return "number"
+    elif isinstance(value, basestring):
+        return "string"
+    else:
+        return "other"
+
+
+def _invert_string(value):
+    """
+    A TUPLE THAT SORTS IN REVERSE ORDER OF value
+    THE TRAILING 1 PUTS A PREFIX AFTER THE LONGER STRINGS IT STARTS
+    """
+    return builtin_tuple(-ord(c) for c in value) + (1,)
+
+
+class _Compare(object):
+    """
+    FALLBACK KEY FOR VALUES THAT NEED THE FULL value_compare() SEMANTICS
+    """
+    __slots__ = ["value", "ordering"]
+
+    def __init__(self, value, ordering):
+        self.value = value
+        self.ordering = ordering
+
+    def __cmp__(self, other):
+        return value_compare(self.value, other.value, self.ordering)
+
+
 def value_compare(l, r, ordering=1):
     """
     SORT VALUES, NULL IS THE LEAST VALUE
@@ -941,7 +1140,7 @@ def wrap_function(func):
 
 def window(data, param):
     """
-    MAYBE WE CAN DO THIS WITH NUMPY (no, the edges of windows are not graceful with numpy)
+    SORT ONCE BY (edges, sort), THEN WALK EACH PARTITION IN A SINGLE PASS
     data - list of records
     """
     name = param.name            # column to assign window function result
@@ -952,60 +1151,79 @@ def window(data, param):
     aggregate = param.aggregate  # WindowFunction to apply
     _range = param.range         # of form {"min":-10, "max":0} to specify the size and relative position of window
 
-    data = filter(data, where)
-
-    if not aggregate and not edges:
-        if sortColumns:
-            data = sort(data, sortColumns, already_normalized=True)
-        # SIMPLE CALCULATED VALUE
-        for rownum, r in enumerate(data):
-            r[name] = calc_value(r, rownum, data)
+    data = [unwrap(d) for d in filter(data, where)]
+    if not data:
         return
 
-    if not aggregate or aggregate == "none":
-        for _, values in groupby(data, edges.value):
-            if not values:
-                continue     # CAN DO NOTHING WITH THIS ZERO-SAMPLE
-
-            if sortColumns:
-                sequence = sort(values, sortColumns, already_normalized=True)
+    # ONE SORT FOR BOTH PARTITIONING AND ORDERING
+    edge_values = [[jx_expression_to_function(e.value)(d) for d in data] for e in listwrap(edges)]
+    columns = [_sort_keys(v) for v in edge_values]
+    columns.extend(_sort_keys([jx_expression_to_function(s.value)(d) for d in data], s.sort) for s in listwrap(sortColumns))
+    order = _decorated_sort(range(len(data)), columns)
+
+    if edge_values:
+        partition_keys = zip(*edge_values)
+        partitions = [[order[0]]]
+        for prev, curr in zip(order, order[1:]):
+            if partition_keys[curr] == partition_keys[prev]:
+                partitions[-1].append(curr)
             else:
-                sequence = values
+                partitions.append([curr])
+    else:
+        partitions = [order]
 
+    if not aggregate or aggregate == "none":
+        for partition in partitions:
+            sequence = FlatList([data[i] for i in partition])
             for rownum, r in enumerate(sequence):
                 r[name] = calc_value(r, rownum, sequence)
         return
 
-    for keys, values in groupby(data, edges.value):
-        if not values:
-            continue     # CAN DO NOTHING WITH THIS ZERO-SAMPLE
+    new_function = _window_function(param)
+    for partition in partitions:
+        sequence = FlatList([data[i] for i in partition])
+        num = len(sequence)
+        values = [calc_value(r, rownum, sequence) for rownum, r in enumerate(sequence)]
 
-        sequence = sort(values, sortColumns)
+        # ROW i SEES values[i + tail : i + head]
+        tail = max(_range_bound(_range.min, -num), -num)
+        head = min(_range_bound(_range.max, num), num)
 
-        for rownum, r in enumerate(sequence):
-            r["__temp__"] = calc_value(r, rownum, sequence)
+        total = new_function()
+        for i in range(max(tail, 0), max(head, 0)):
+            total.add(values[i])
 
-        head = coalesce(_range.max, _range.stop)
-        tail = coalesce(_range.min, _range.start)
-
-        # PRELOAD total
-        total = aggregate()
-        for i in range(tail, head):
-            total.add(sequence[i].__temp__)
-
-        # WINDOW FUNCTION APPLICATION
         for i, r in enumerate(sequence):
             r[name] = total.end()
-            total.add(sequence[i + head].__temp__)
-            total.sub(sequence[i + tail].__temp__)
-
-    for r in data:
-        r["__temp__"] = None  # CLEANUP
-
-
-
+            if 0 <= i + head < num:
+                total.add(values[i + head])
+            if 0 <= i + tail < num:
+                total.sub(values[i + tail])
 
 
+def _window_function(param):
+    """
+    :return: FACTORY FOR THE (SLIDING) AGGREGATE OF A WINDOW
+    """
+    aggregate = param.aggregate
+    if not isinstance(aggregate, basestring):
+        return aggregate  # ALREADY A WindowFunction
+    factory = coalesce(windows.name2window.get(aggregate), windows.name2accumulator.get(aggregate))
+    if factory == None:
+        Log.error("Do not know window aggregate {{name|quote}}", name=aggregate)
+    if param.percentile != None:
+        return lambda: factory(percentile=param.percentile)
+    return lambda: factory()
+
+
+def _range_bound(bound, default):
+    if bound == None:
+        return default
+    if isinstance(bound, Literal):
+        bound = bound()
+    if not Math.is_integer(bound):
+        Log.error("Expecting window range to be an integer, not {{bound|json}}", bound=bound)
+    return int(bound)
 
 
 def intervals(_min, _max=None, size=1):
@@ -151,6 +151,9 @@ class FromES(Container):
                 q2.frum = result
                 return jx.run(q2)
 
+            if query.stream and (is_deepop(self._es, query) or is_aggsop(self._es, query) or not is_setop(self._es, query)):
+                Log.error("Only simple set operations (no edges, groupby or aggregates) can be streamed")
+
             if is_deepop(self._es, query):
                 return es_deepop(self._es, query)
             if is_aggsop(self._es, query):
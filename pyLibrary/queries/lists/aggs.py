@@ -12,12 +12,15 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import itertools
+import multiprocessing
+import os
 
 from mo_logs import Log
 from mo_math import UNION
 from mo_times.dates import Date
 from mo_dots import listwrap, wrap, coalesce
 from mo_collections.matrix import Matrix
+from mo_threads import Lock
 from pyLibrary.queries import windows
 from pyLibrary.queries.domains import SimpleSetDomain, DefaultDomain
 from pyLibrary.queries.expression_compiler import compile_expression
@@ -25,13 +28,25 @@ from pyLibrary.queries.expressions import jx_expression_to_function
 
 _ = Date
 
+PROCESSES = 1  # NUMBER OF PROCESSES list_aggs MAY USE, OFFLINE JOBS CAN SET THIS HIGHER
+MIN_ROWS_PER_PROCESS = 10000  # SMALLER CHUNKS ARE NOT WORTH THE FORK AND PICKLING
+
+_job = None  # (frum, query, select) INHERITED BY THE FORKED WORKERS
+_job_locker = Lock("list_aggs job")
+
 def is_aggs(query):
     if query.edges or query.groupby or any(a != None and a != "none" for a in listwrap(query.select).aggregate):
         return True
     return False
 
 
-def list_aggs(frum, query):
+def list_aggs(frum, query, processes=None):
+    """
+    :param frum: LIST OF RECORDS
+    :param query: THE NORMALIZED QUERY
+    :param processes: NUMBER OF PROCESSES TO SPLIT THE WORK OVER (DEFAULT PROCESSES)
+    :return: Cube
+    """
     frum = wrap(frum)
     select = listwrap(query.select)
 
@@ -46,15 +61,92 @@ def list_aggs(frum, query):
         else:
             pass
 
-    s_accessors = [(ss.name, compile_expression(ss.value.to_python())) for ss in select]
+    processes = min(coalesce(processes, PROCESSES), len(frum) // MIN_ROWS_PER_PROCESS)
+    if processes > 1 and hasattr(os, "fork"):
+        result = _parallel_aggs(frum, query, select, processes)
+    else:
+        result = _aggs(frum, query, select)
+
+    for s in select:
+        # if s.aggregate == "count":
+        #     continue
+        m = result[s.name]
+        for c, var in m.items():
+            if var != None:
+                m[c] = var.end()
+
+    from pyLibrary.queries.containers.cube import Cube
+
+    output = Cube(select, query.edges, result)
+    return output
+
 
-    result = {
+def _new_accumulators(query, select):
+    return {
         s.name: Matrix(
             dims=[len(e.domain.partitions) + (1 if e.allowNulls else 0) for e in query.edges],
-            zeros=lambda: windows.name2accumulator.get(s.aggregate)(**s)
+            zeros=lambda: windows.get_accumulator(s)(**s),
+            flat=True
         )
         for s in select
     }
+
+
+def _cells(query, m):
+    """
+    :return: LIST OF ALL ACCUMULATORS IN m, IN COORDINATE ORDER
+    """
+    if not query.edges:
+        return [m.cube]
+    return [v for _, v in m.items()]
+
+
+def _parallel_aggs(frum, query, select, processes):
+    """
+    SPLIT frum INTO ONE CHUNK PER PROCESS, AGGREGATE EACH CHUNK IN A FORKED
+    WORKER, AND merge() THE PARTIAL ACCUMULATORS
+    """
+    global _job
+
+    num = len(frum)
+    size = (num + processes - 1) // processes
+    chunks = [(start, min(start + size, num)) for start in xrange(0, num, size)]
+
+    with _job_locker:
+        # THE WORKERS INHERIT _job WHEN FORKED, SO ONLY THE CHUNK BOUNDS, AND
+        # THE ACCUMULATORS, ARE PICKLED
+        _job = frum, query, select
+        pool = multiprocessing.Pool(processes)
+        try:
+            partials = pool.map(_aggs_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            _job = None
+
+    result = _new_accumulators(query, select)
+    for s in select:
+        total = _cells(query, result[s.name])
+        for partial in partials:
+            for acc, other in itertools.izip(total, partial[s.name]):
+                acc.merge(other)
+    return result
+
+
+def _aggs_chunk(bounds):
+    frum, query, select = _job
+    start, end = bounds
+    result = _aggs(frum[start:end:], query, select)
+    return {s.name: _cells(query, result[s.name]) for s in select}
+
+
+def _aggs(frum, query, select):
+    """
+    :return: MAP FROM SELECT NAME TO Matrix OF ACCUMULATORS
+    """
+    s_accessors = [(ss.name, compile_expression(ss.value.to_python())) for ss in select]
+
+    result = _new_accumulators(query, select)
     where = jx_expression_to_function(query.where)
     coord = [None]*len(query.edges)
     edge_accessor = [(i, make_accessor(e)) for i, e in enumerate(query.edges)]
@@ -87,19 +179,7 @@ def list_aggs(frum, query):
                     acc = mat[c]
                     val = s_accessor(d, c, frum)
                     acc.add(val)
-
-    for s in select:
-        # if s.aggregate == "count":
-        #     continue
-        m = result[s.name]
-        for c, var in m.items():
-            if var != None:
-                m[c] = var.end()
-
-    from pyLibrary.queries.containers.cube import Cube
-
-    output = Cube(select, query.edges, result)
-    return output
+    return result
 
 
 def make_accessor(e):
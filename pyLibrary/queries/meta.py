@@ -11,13 +11,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import heapq
 import itertools
+import os
 from copy import copy
-from itertools import product
 
 from mo_logs import Log
+from mo_logs.exceptions import Except
 from mo_threads import Lock, THREAD_STOP
-from mo_threads import Queue
+from mo_threads import Signal
 from mo_threads import Thread
 from mo_threads import Till
 from mo_times.dates import Date
@@ -25,8 +27,10 @@ from mo_times.durations import HOUR, MINUTE
 from mo_times.timer import Timer
 from mo_dots import Data
 from mo_dots import coalesce, set_default, Null, literal_field, split_field, join_field, ROOT_PATH
-from mo_dots import wrap
+from mo_dots import wrap, unwrap
+from mo_files import File
 from mo_kwargs import override
+from pyLibrary import convert
 from pyLibrary.meta import DataClass
 from pyLibrary.queries import jx, Schema
 from pyLibrary.queries.containers import STRUCT, Container
@@ -39,6 +43,9 @@ ENABLE_META_SCAN = False
 DEBUG = False
 TOO_OLD = 2*HOUR
 OLD_METADATA = MINUTE
+SCAN_WAIT = MINUTE  # HOW LONG TO WAIT BEFORE LOOKING FOR OLD COLUMNS AGAIN
+MAX_SCAN_BATCH = 100  # MAXIMUM NUMBER OF COLUMNS TO SCAN IN ONE REQUEST
+SNAPSHOT_PERIOD = 10 * MINUTE  # HOW OFTEN THE METADATA IS WRITTEN TO snapshot_file
 singlton = None
 TEST_TABLE_PREFIX = "testing"  # USED TO TURN OFF COMPLAINING ABOUT TEST INDEXES
 
@@ -57,7 +64,11 @@ class FromESMetadata(Schema):
             return singlton
 
     @override
-    def __init__(self, host, index, alias=None, name=None, port=9200, kwargs=None):
+    def __init__(self, host, index, alias=None, name=None, port=9200, scan_workers=4, snapshot_file=None, kwargs=None):
+        """
+        :param scan_workers: NUMBER OF THREADS SCANNING FOR COLUMN CARDINALITY
+        :param snapshot_file: JSON LINES FILE TO REMEMBER THE METADATA BETWEEN RESTARTS
+        """
         global _elasticsearch
         if hasattr(self, "settings"):
             return
@@ -68,7 +79,8 @@ class FromESMetadata(Schema):
         self.settings = kwargs
         self.default_name = coalesce(name, alias, index)
         self.default_es = _elasticsearch.Cluster(kwargs=kwargs)
-        self.todo = Queue("refresh metadata", max=100000, unique=True)
+        self.scan_workers = scan_workers
+        self.todo = ColumnQueue("refresh metadata")
 
         self.es_metadata = Null
         self.last_es_metadata = Date.now()-OLD_METADATA
@@ -80,6 +92,13 @@ class FromESMetadata(Schema):
         self.meta.columns = ColumnList()
         self.meta.columns.insert(column_columns)
         self.meta.columns.insert(table_columns)
+
+        self.snapshot = File(snapshot_file) if snapshot_file else None
+        if self.snapshot is not None:
+            if self.snapshot.exists:
+                self._load_snapshot()
+            Thread.run("snapshot metadata", self._snapshot_worker)
+
         # TODO: fix monitor so it does not bring down ES
         if ENABLE_META_SCAN:
             self.worker = Thread.run("refresh metadata", self.monitor)
@@ -87,6 +106,70 @@ class FromESMetadata(Schema):
             self.worker = Thread.run("refresh metadata", self.not_monitor)
         return
 
+    def _load_snapshot(self):
+        """
+        FILL meta.tables AND meta.columns FROM THE LAST SNAPSHOT SO WE START WARM
+        STALE COLUMNS ARE QUEUED FOR REFRESH IN THE BACKGROUND
+        """
+        try:
+            stale = []
+            with Timer("load metadata snapshot from {{file}}", {"file": self.snapshot.abspath}, debug=DEBUG):
+                for i, line in enumerate(self.snapshot):
+                    if not line:
+                        continue
+                    try:
+                        record = unwrap(convert.json2value(line))
+                        if "table" in record:
+                            # NULLS ARE NOT WRITTEN, SO MAKE THEM EXPLICIT
+                            t = Table(**{k: record["table"].get(k) for k in Table.__slots__})
+                            t.timestamp = _to_date(t.timestamp)
+                            t.last_updated = _to_date(t.last_updated)
+                            with self.meta.tables.locker:
+                                self.meta.tables.add(t)
+                        elif "column" in record:
+                            c = Column(**{k: record["column"].get(k) for k in Column.__slots__})
+                            c.last_updated = _to_date(c.last_updated)
+                            with self.meta.columns.locker:
+                                self.meta.columns.add(c)
+                            if c.last_updated == None or c.last_updated < Date.now() - TOO_OLD:
+                                stale.append(c)
+                    except Exception, e:
+                        Log.warning("Skipping line {{num}} of metadata snapshot {{file}}", num=i + 1, file=self.snapshot.abspath, cause=e)
+            self.todo.extend(stale)
+        except Exception, e:
+            Log.warning("Could not load metadata snapshot from {{file}}", file=self.snapshot.abspath, cause=e)
+
+    def _save_snapshot(self):
+        """
+        WRITE ALL NON-meta TABLES AND COLUMNS TO THE SNAPSHOT FILE
+        """
+        try:
+            with self.meta.tables.locker:
+                lines = [
+                    convert.value2json({"table": dict(t.items())}) + "\n"
+                    for t in self.meta.tables.data
+                    if not t.name.startswith("meta.")
+                ]
+            with self.meta.columns.locker:
+                lines.extend(
+                    convert.value2json({"column": dict(c.items())}) + "\n"
+                    for c in self.meta.columns
+                    if not c.table.startswith("meta.")
+                )
+
+            # WRITE THEN RENAME, SO OTHER PROCESSES NEVER SEE A PARTIAL FILE
+            # EACH PROCESS HAS ITS OWN TEMP FILE, SO WORKERS DO NOT WRITE OVER EACH OTHER
+            temp = File(self.snapshot.abspath + "." + unicode(os.getpid()) + ".tmp")
+            temp.write(lines)
+            os.rename(temp.abspath, self.snapshot.abspath)
+        except Exception, e:
+            Log.warning("Could not save metadata snapshot to {{file}}", file=self.snapshot.abspath, cause=e)
+
+    def _snapshot_worker(self, please_stop):
+        while not please_stop:
+            (Till(seconds=SNAPSHOT_PERIOD.seconds) | please_stop).wait()
+            self._save_snapshot()
+
     @property
     def query_path(self):
         return None
@@ -105,6 +188,7 @@ class FromESMetadata(Schema):
         if not existing_columns:
             self.meta.columns.add(c)
             self.todo.add(c)
+            self._mark_table_updated(c.table)
 
             if ENABLE_META_SCAN:
                 if DEBUG:
@@ -126,6 +210,17 @@ class FromESMetadata(Schema):
                 Log.note("todo: {{table}}::{{column}}", table=canonical.table, column=canonical.es_column)
             self.todo.add(canonical)
 
+    def _mark_table_updated(self, *table_names):
+        """
+        RECORD THAT THE SCHEMA, OR CONTENT, OF THE GIVEN TABLES HAS CHANGED
+        """
+        short_names = set(join_field(split_field(t)[0:1]) for t in table_names if t)
+        now = Date.now()
+        with self.meta.tables.locker:
+            for t in self.meta.tables.data:
+                if t.name in short_names:
+                    t.last_updated = now
+
     def _get_columns(self, table=None):
         # TODO: HANDLE MORE THEN ONE ES, MAP TABLE SHORT_NAME TO ES INSTANCE
         meta = self.es_metadata.indices[table]
@@ -242,10 +337,13 @@ class FromESMetadata(Schema):
                 table.timestamp = Date.now()
                 self._get_columns(table=short_name)
 
-            with self.meta.columns.locker:
-                columns = self.meta.columns.find(table_name, column_name)
+            columns = self.meta.columns.find(table_name, column_name)
             if columns:
                 columns = jx.sort(columns, "name")
+                # A LIVE QUERY IS WAITING, SO THESE GO TO THE FRONT OF THE QUEUE
+                for c in columns:
+                    if not c.last_updated:
+                        self.todo.push(c)
                 # AT LEAST WAIT FOR THE COLUMNS TO UPDATE
                 while len(self.todo) and not all(columns.get("last_updated")):
                     if DEBUG:
@@ -265,9 +363,17 @@ class FromESMetadata(Schema):
         """
         QUERY ES TO FIND CARDINALITY AND PARTITIONS FOR A SIMPLE COLUMN
         """
-        if c.type in STRUCT:
-            Log.error("not supported")
-        try:
+        self._update_cardinalities([c])
+
+    def _update_cardinalities(self, columns):
+        """
+        QUERY ES TO FIND CARDINALITY AND PARTITIONS FOR SIMPLE COLUMNS OF ONE TABLE
+        ONE REQUEST GETS ALL THE CARDINALITIES, ONE MORE GETS ALL THE PARTITIONS
+        """
+        es_columns = []
+        for c in columns:
+            if c.type in STRUCT:
+                Log.error("not supported")
             if c.table == "meta.columns":
                 with self.meta.columns.locker:
                     partitions = jx.sort([g[c.es_column] for g, _ in jx.groupby(self.meta.columns, c.es_column) if g[c.es_column] != None])
@@ -280,8 +386,7 @@ class FromESMetadata(Schema):
                         },
                         "where": {"eq": {"table": c.table, "es_column": c.es_column}}
                     })
-                return
-            if c.table == "meta.tables":
+            elif c.table == "meta.tables":
                 with self.meta.columns.locker:
                     partitions = jx.sort([g[c.es_column] for g, _ in jx.groupby(self.meta.tables, c.es_column) if g[c.es_column] != None])
                     self.meta.columns.update({
@@ -293,106 +398,141 @@ class FromESMetadata(Schema):
                         },
                         "where": {"eq": {"table": c.table, "name": c.name}}
                     })
-                return
+            else:
+                es_columns.append(c)
 
-            es_index = c.table.split(".")[0]
-            result = self.default_es.post("/" + es_index + "/_search", data={
-                "aggs": {c.name: _counting_query(c)},
-                "size": 0
-            })
-            r = result.aggregations.values()[0]
-            count = result.hits.total
-            cardinality = coalesce(r.value, r._nested.value, 0 if r.doc_count==0 else None)
-            if cardinality == None:
-                Log.error("logic error")
+        if not es_columns:
+            return
 
+        try:
+            es_index = es_columns[0].table.split(".")[0]
             query = Data(size=0)
-            if cardinality > 1000 or (count >= 30 and cardinality == count) or (count >= 1000 and cardinality / count > 0.99):
-                if DEBUG:
-                    Log.note("{{table}}.{{field}} has {{num}} parts", table=c.table, field=c.es_column, num=cardinality)
-                with self.meta.columns.locker:
-                    self.meta.columns.update({
-                        "set": {
-                            "count": count,
-                            "cardinality": cardinality,
-                            "last_updated": Date.now()
-                        },
-                        "clear": ["partitions"],
-                        "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
-                    })
-                return
-            elif c.type in _elasticsearch.ES_NUMERIC_TYPES and cardinality > 30:
+            for i, c in enumerate(es_columns):
+                query.aggs["_" + unicode(i)] = _counting_query(c)
+            result = self.default_es.get_multi_search().search("/" + es_index, query)
+            count = result.hits.total
+            if any(c.count != None and c.count != count for c in es_columns):
+                # THE DOCUMENT COUNT MOVED, SO ANY RESULTS ON THIS TABLE ARE STALE
+                self._mark_table_updated(*set(c.table for c in es_columns) | set(c.es_index for c in es_columns))
+        except Exception, e:
+            for c in es_columns:
+                self._cardinality_failure(c, e)
+            return
+
+        query = Data(size=0)
+        need_partitions = []
+        for i, c in enumerate(es_columns):
+            try:
+                r = result.aggregations["_" + unicode(i)]
+                cardinality = coalesce(r.value, r._nested.value, 0 if r.doc_count==0 else None)
+                if cardinality == None:
+                    Log.error("logic error")
+
+                if cardinality > 1000 or (count >= 30 and cardinality == count) or (count >= 1000 and cardinality / count > 0.99):
+                    if DEBUG:
+                        Log.note("{{table}}.{{field}} has {{num}} parts", table=c.table, field=c.es_column, num=cardinality)
+                    with self.meta.columns.locker:
+                        self.meta.columns.update({
+                            "set": {
+                                "count": count,
+                                "cardinality": cardinality,
+                                "last_updated": Date.now()
+                            },
+                            "clear": ["partitions"],
+                            "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
+                        })
+                elif c.type in _elasticsearch.ES_NUMERIC_TYPES and cardinality > 30:
+                    if DEBUG:
+                        Log.note("{{field}} has {{num}} parts", field=c.name, num=cardinality)
+                    with self.meta.columns.locker:
+                        self.meta.columns.update({
+                            "set": {
+                                "count": count,
+                                "cardinality": cardinality,
+                                "last_updated": Date.now()
+                            },
+                            "clear": ["partitions"],
+                            "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
+                        })
+                elif len(c.nested_path) != 1:
+                    query.aggs["_" + unicode(i)] = {
+                        "nested": {"path": c.nested_path[0]},
+                        "aggs": {"_nested": {"terms": {"field": c.es_column, "size": 0}}}
+                    }
+                    need_partitions.append((i, c, cardinality))
+                else:
+                    query.aggs["_" + unicode(i)] = {"terms": {"field": c.es_column, "size": 0}}
+                    need_partitions.append((i, c, cardinality))
+            except Exception, e:
+                self._cardinality_failure(c, e)
+
+        if not need_partitions:
+            return
+
+        try:
+            result = self.default_es.get_multi_search().search("/" + es_index, query)
+        except Exception, e:
+            for _, c, _ in need_partitions:
+                self._cardinality_failure(c, e)
+            return
+
+        for i, c, cardinality in need_partitions:
+            try:
+                aggs = result.aggregations["_" + unicode(i)]
+                if aggs._nested:
+                    parts = jx.sort(aggs._nested.buckets.key)
+                else:
+                    parts = jx.sort(aggs.buckets.key)
+
                 if DEBUG:
-                    Log.note("{{field}} has {{num}} parts", field=c.name, num=cardinality)
+                    Log.note("{{field}} has {{parts}}", field=c.name, parts=parts)
                 with self.meta.columns.locker:
                     self.meta.columns.update({
                         "set": {
                             "count": count,
                             "cardinality": cardinality,
+                            "partitions": parts,
                             "last_updated": Date.now()
                         },
-                        "clear": ["partitions"],
                         "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
                     })
-                return
-            elif len(c.nested_path) != 1:
-                query.aggs[literal_field(c.name)] = {
-                    "nested": {"path": c.nested_path[0]},
-                    "aggs": {"_nested": {"terms": {"field": c.es_column, "size": 0}}}
-                }
-            else:
-                query.aggs[literal_field(c.name)] = {"terms": {"field": c.es_column, "size": 0}}
-
-            result = self.default_es.post("/" + es_index + "/_search", data=query)
-
-            aggs = result.aggregations.values()[0]
-            if aggs._nested:
-                parts = jx.sort(aggs._nested.buckets.key)
-            else:
-                parts = jx.sort(aggs.buckets.key)
+            except Exception, e:
+                self._cardinality_failure(c, e)
 
-            if DEBUG:
-                Log.note("{{field}} has {{parts}}", field=c.name, parts=parts)
+    def _cardinality_failure(self, c, e):
+        e = Except.wrap(e)
+        if "IndexMissingException" in e and c.table.startswith(TEST_TABLE_PREFIX):
             with self.meta.columns.locker:
                 self.meta.columns.update({
                     "set": {
-                        "count": count,
-                        "cardinality": cardinality,
-                        "partitions": parts,
-                        "last_updated": Date.now()
-                    },
-                    "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
-                })
-        except Exception, e:
-            if "IndexMissingException" in e and c.table.startswith(TEST_TABLE_PREFIX):
-                with self.meta.columns.locker:
-                    self.meta.columns.update({
-                        "set": {
-                            "count": 0,
-                            "cardinality": 0,
-                            "last_updated": Date.now()
-                        },
-                        "clear":[
-                            "partitions"
-                        ],
-                        "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
-                    })
-            else:
-                self.meta.columns.update({
-                    "set": {
+                        "count": 0,
+                        "cardinality": 0,
                         "last_updated": Date.now()
                     },
-                    "clear": [
-                        "count",
-                        "cardinality",
-                        "partitions",
+                    "clear":[
+                        "partitions"
                     ],
-                    "where": {"eq": {"table": c.table, "es_column": c.es_column}}
+                    "where": {"eq": {"es_index": c.es_index, "es_column": c.es_column}}
                 })
-                Log.warning("Could not get {{col.table}}.{{col.es_column}} info", col=c, cause=e)
+        else:
+            self.meta.columns.update({
+                "set": {
+                    "last_updated": Date.now()
+                },
+                "clear": [
+                    "count",
+                    "cardinality",
+                    "partitions",
+                ],
+                "where": {"eq": {"table": c.table, "es_column": c.es_column}}
+            })
+            Log.warning("Could not get {{col.table}}.{{col.es_column}} info", col=c, cause=e)
 
     def monitor(self, please_stop):
         please_stop.on_go(lambda: self.todo.add(THREAD_STOP))
+        for i in range(self.scan_workers):
+            Thread.run("cardinality scan " + unicode(i), self._scan_worker, please_stop=please_stop)
+
         while not please_stop:
             try:
                 if not self.todo:
@@ -406,16 +546,25 @@ class FromESMetadata(Schema):
                             if DEBUG:
                                 Log.note("Old columns wth dates {{dates|json}}", dates=wrap(old_columns).last_updated)
                             self.todo.extend(old_columns)
-                            # TEST CONSISTENCY
-                            for c, d in product(list(self.todo.queue), list(self.todo.queue)):
-                                if c.es_column == d.es_column and c.table == d.table and c != d:
-                                    Log.error("")
                         else:
                             if DEBUG:
                                 Log.note("no more metatdata to update")
+            except Exception, e:
+                Log.warning("problem in cardinality monitor", cause=e)
+            (Till(seconds=SCAN_WAIT.seconds) | please_stop).wait()
 
-                column = self.todo.pop(Till(seconds=(10*MINUTE).seconds))
-                if column:
+    def _scan_worker(self, please_stop):
+        """
+        UPDATE CARDINALITY, A TABLE'S WORTH OF COLUMNS AT A TIME
+        """
+        while not please_stop:
+            try:
+                batch = self.todo.pop_batch(till=please_stop, max_size=MAX_SCAN_BATCH)
+                if batch is THREAD_STOP:
+                    break
+
+                columns = []
+                for column in batch:
                     if DEBUG:
                         Log.note("update {{table}}.{{column}}", table=column.table, column=column.es_column)
                     if column.type in STRUCT:
@@ -424,14 +573,18 @@ class FromESMetadata(Schema):
                         continue
                     elif column.last_updated >= Date.now()-TOO_OLD:
                         continue
-                    try:
-                        self._update_cardinality(column)
-                        if DEBUG and not column.table.startswith(TEST_TABLE_PREFIX):
-                            Log.note("updated {{column.name}}", column=column)
-                    except Exception, e:
-                        Log.warning("problem getting cardinality for {{column.name}}", column=column, cause=e)
+                    columns.append(column)
+                if not columns:
+                    continue
+
+                try:
+                    self._update_cardinalities(columns)
+                    if DEBUG:
+                        Log.note("updated {{columns}}", columns=[c.name for c in columns if not c.table.startswith(TEST_TABLE_PREFIX)])
+                except Exception, e:
+                    Log.warning("problem getting cardinality for {{columns}}", columns=[c.name for c in columns], cause=e)
             except Exception, e:
-                Log.warning("problem in cardinality monitor", cause=e)
+                Log.warning("problem in cardinality scan", cause=e)
 
     def not_monitor(self, please_stop):
         Log.alert("metadata scan has been disabled")
@@ -460,6 +613,114 @@ class FromESMetadata(Schema):
                 Log.note("Could not get {{col.es_index}}.{{col.es_column}} info", col=c)
 
 
+class ColumnQueue(object):
+    """
+    THE COLUMNS WAITING FOR A CARDINALITY SCAN, EACH COLUMN AT MOST ONCE
+    add() PUTS A COLUMN AT THE BACK, push() MOVES IT TO THE FRONT
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = Lock("lock for " + name)
+        self.please_stop = Signal("stop signal for " + name)
+        self.heap = []  # [priority, order, column] ENTRIES; column IS None WHEN REMOVED
+        self.entries = {}  # MAP FROM COLUMN KEY TO ITS LIVE ENTRY
+        self.order = itertools.count()
+
+    def add(self, column):
+        if column is THREAD_STOP:
+            self.please_stop.go()
+            return self
+        with self.lock:
+            if _column_key(column) not in self.entries:
+                self._put(column, _BACK, next(self.order))
+        return self
+
+    def extend(self, columns):
+        for c in columns:
+            self.add(c)
+        return self
+
+    def push(self, column):
+        """
+        SNEAK column TO FRONT OF THE QUEUE
+        """
+        with self.lock:
+            entry = self.entries.get(_column_key(column))
+            if entry:
+                if entry[0] == _FRONT:
+                    return self
+                entry[2] = None
+            self._put(column, _FRONT, -next(self.order))
+        return self
+
+    def _put(self, column, priority, order):
+        entry = [priority, order, column]
+        self.entries[_column_key(column)] = entry
+        heapq.heappush(self.heap, entry)
+
+    def pop(self, till=None):
+        """
+        :param till:  A `Signal` to stop waiting and return None
+        :return:  A COLUMN, OR THREAD_STOP IF CLOSED, OR None IF till IS REACHED
+        """
+        with self.lock:
+            while True:
+                while self.heap:
+                    _, _, column = heapq.heappop(self.heap)
+                    if column is not None:
+                        del self.entries[_column_key(column)]
+                        return column
+                if self.please_stop:
+                    return THREAD_STOP
+                if not self.lock.wait(till=till | self.please_stop):
+                    if self.please_stop:
+                        return THREAD_STOP
+                    return None
+
+    def pop_batch(self, till=None, max_size=MAX_SCAN_BATCH):
+        """
+        :return: LIST OF COLUMNS FROM THE SAME INDEX AS THE NEXT COLUMN, OR THREAD_STOP
+        """
+        first = self.pop(till=till)
+        if first is THREAD_STOP or first is None:
+            return THREAD_STOP
+
+        es_index = first.table.split(".")[0]
+        batch = [first]
+        with self.lock:
+            for entry in self.heap:
+                if len(batch) >= max_size:
+                    break
+                column = entry[2]
+                if column is not None and column.table.split(".")[0] == es_index:
+                    entry[2] = None
+                    del self.entries[_column_key(column)]
+                    batch.append(column)
+        return batch
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+
+_FRONT = 0
+_BACK = 1
+
+
+def _column_key(column):
+    return column.table, column.es_column
+
+
+def _to_date(value):
+    if value == None:
+        return None
+    return Date(value)
+
+
 def _counting_query(c):
     if len(c.nested_path) != 1:
         return {
@@ -560,6 +821,14 @@ def metadata_tables():
                 es_column="timestamp",
                 type="integer",
                 nested_path=ROOT_PATH
+            ),
+            Column(
+                table="meta.tables",
+                name="last_updated",
+                es_index=None,
+                es_column="last_updated",
+                type="time",
+                nested_path=ROOT_PATH
             )
         ]
     )
@@ -569,7 +838,8 @@ class Table(DataClass("Table", [
     "name",
     "url",
     "query_path",
-    "timestamp"
+    "timestamp",
+    {"name": "last_updated", "nulls": True}  # LAST TIME THE TABLE WAS SEEN TO CHANGE
 ])):
     @property
     def columns(self):
@@ -598,10 +868,13 @@ Column = DataClass(
 class ColumnList(Container):
     """
     OPTIMIZED FOR THE PARTICULAR ACCESS PATTERNS USED
+    COLUMNS ARE INDEXED BY (table), (table, name) AND (es_index, es_column)
+    READERS DO NOT TAKE THE locker; WRITERS ONLY APPEND, SO READERS SEE A CONSISTENT COPY
     """
 
     def __init__(self):
-        self.data = {}  # MAP FROM TABLE NAME TO COLUMNS
+        self.data = {}  # MAP FROM TABLE NAME TO COLUMN NAME TO COLUMNS
+        self.es_columns = {}  # MAP FROM (es_index, es_column) TO COLUMNS
         self.locker = Lock()
         self.count=0
 
@@ -609,7 +882,10 @@ class ColumnList(Container):
         if not column:
             return [c for cs in self.data.get(table, {}).values() for c in cs]
         else:
-            return self.data.get(table, {}).get(column, [])
+            return list(self.data.get(table, {}).get(column, []))
+
+    def find_es_column(self, es_index, es_column):
+        return list(self.es_columns.get((es_index, es_column), []))
 
     def insert(self, columns):
         for column in columns:
@@ -619,12 +895,13 @@ class ColumnList(Container):
         columns_for_table = self.data.setdefault(column.table, {})
         _columns = columns_for_table.setdefault(column.name, [])
         _columns.append(column)
+        self.es_columns.setdefault((column.es_index, column.es_column), []).append(column)
         self.count+=1
 
     def __iter__(self):
-        for t, cs in self.data.items():
-            for c, css in cs.items():
-                for column in css:
+        for cs in self.data.values():
+            for css in cs.values():
+                for column in list(css):
                     yield column
 
     def __len__(self):
@@ -634,7 +911,10 @@ class ColumnList(Container):
         try:
             command = wrap(command)
             eq = command.where.eq
-            if eq.table:
+            if eq.es_index and eq.es_column:
+                columns = self.find_es_column(eq.es_index, eq.es_column)
+                columns = [c for c in columns if all(c[k] == v for k, v in eq.items())]
+            elif eq.table:
                 columns = self.find(eq.table, eq.name)
                 columns = [c for c in columns if all(c[k] == v for k, v in eq.items())]
             else:
@@ -29,6 +29,7 @@ from pyLibrary.queries.expressions import jx_expression, TrueOp, Expression, Fal
 
 DEFAULT_LIMIT = 10
 MAX_LIMIT = 50000
+MAX_STREAM_LIMIT = 2 ** 31 - 1  # STREAMED RESULTS ARE NOT HELD IN MEMORY, SO THE LIMIT IS MUCH HIGHER
 
 _jx = None
 _Column = None
@@ -47,7 +48,7 @@ def _late_import():
 
 
 class QueryOp(Expression):
-    __slots__ = ["frum", "select", "edges", "groupby", "where", "window", "sort", "limit", "having", "format", "isLean"]
+    __slots__ = ["frum", "select", "edges", "groupby", "where", "window", "sort", "limit", "having", "format", "isLean", "stream"]
 
     def __new__(cls, op, frum, select=None, edges=None, groupby=None, window=None, where=None, sort=None, limit=None, format=None):
         output = object.__new__(cls)
@@ -229,11 +230,16 @@ class QueryOp(Expression):
         output.window = [_normalize_window(w) for w in listwrap(query.window)]
         output.having = None
         output.sort = _normalize_sort(query.sort)
-        output.limit = Math.min(MAX_LIMIT, coalesce(query.limit, DEFAULT_LIMIT))
+        if query.stream:
+            output.limit = Math.min(MAX_STREAM_LIMIT, coalesce(query.limit, MAX_STREAM_LIMIT))
+            output.format = coalesce(query.format, "list")  # A STREAM IS ROWS, THE DEFAULT cube IS NOT
+        else:
+            output.limit = Math.min(MAX_LIMIT, coalesce(query.limit, DEFAULT_LIMIT))
         if not Math.is_integer(output.limit) or output.limit < 0:
             Log.error("Expecting limit >= 0")
 
         output.isLean = query.isLean
+        output.stream = query.stream
 
         return output
 
@@ -561,6 +567,7 @@ def _normalize_window(window, schema=None):
         edges=[_normalize_edge(e, schema) for e in listwrap(window.edges)],
         sort=_normalize_sort(window.sort),
         aggregate=window.aggregate,
+        percentile=window.percentile,
         range=_normalize_range(window.range),
         where=_normalize_where(window.where, schema=schema)
     )
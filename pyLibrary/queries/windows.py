@@ -13,15 +13,19 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import functools
+import heapq
+from collections import deque, Mapping
 from copy import copy
 
 import mo_math
+from mo_json import value2json
 from mo_collections.multiset import Multiset
 from mo_dots.lists import FlatList
 from mo_logs import Log
 from mo_math import MIN
 from mo_math import Math
 from mo_math import stats
+from mo_math.sketches import TDigest, HyperLogLog, DEFAULT_COMPRESSION, DEFAULT_PRECISION
 from mo_math.stats import ZeroMoment, ZeroMoment2Stats
 
 
@@ -144,7 +148,7 @@ class _Stats(WindowFunction):
         self.samples.remove(value)
 
     def merge(self, agg):
-        Log.error("Do not know how to handle")
+        self.samples.extend(agg.samples)
 
     def end(self):
         ignore = Math.ceiling(len(self.samples) * (1 - self.middle) / 2)
@@ -198,6 +202,9 @@ class Min(WindowFunction):
             return
         self.total.remove(value)
 
+    def merge(self, agg):
+        self.total.extend(agg.total)
+
     def end(self):
         return MIN(self.total)
 
@@ -229,11 +236,14 @@ class Max(WindowFunction):
 
 
     def add(self, value):
-        self.max = mo_MAX(self.max, value)
+        self.max = mo_math.MAX([self.max, value])
 
     def sub(self, value):
         Log.error("Not implemented")
 
+    def merge(self, agg):
+        self.max = mo_math.MAX([self.max, agg.max])
+
     def end(self):
         return self.max
 
@@ -254,6 +264,9 @@ class Count(WindowFunction):
             return
         self.total -= 1
 
+    def merge(self, agg):
+        self.total += agg.total
+
     def end(self):
         return self.total
 
@@ -274,6 +287,9 @@ class Sum(WindowFunction):
             return
         self.total -= value
 
+    def merge(self, agg):
+        self.total += agg.total
+
     def end(self):
         return self.total
 
@@ -302,10 +318,227 @@ class Percentile(WindowFunction):
         except Exception, e:
             Log.error("Problem with window function", e)
 
+    def merge(self, agg):
+        self.total.extend(agg.total)
+
     def end(self):
         return stats.percentile(self.total, self.percentile)
 
 
+class ApproxPercentile(AggregationFunction):
+    """
+    percentile IN BOUNDED MEMORY, USING A t-digest
+    SEE mo_math.sketches.TDigest FOR THE ERROR BOUNDS
+    """
+
+    def __init__(self, percentile=0.5, compression=DEFAULT_COMPRESSION, **kwargs):
+        object.__init__(self)
+        self.percentile = percentile
+        self.digest = TDigest(compression)
+
+    def add(self, value):
+        if value == None:
+            return
+        self.digest.add(value)
+
+    def merge(self, agg):
+        self.digest.merge(agg.digest)
+
+    def end(self):
+        return self.digest.quantile(self.percentile)
+
+
+class Cardinality(AggregationFunction):
+    """
+    EXACT NUMBER OF DISTINCT VALUES
+    """
+
+    def __init__(self, **kwargs):
+        object.__init__(self)
+        self.total = set()
+
+    def add(self, value):
+        if value == None:
+            return
+        self.total.add(_hashable(value))
+
+    def merge(self, agg):
+        self.total |= agg.total
+
+    def end(self):
+        return len(self.total)
+
+
+class ApproxCardinality(AggregationFunction):
+    """
+    NUMBER OF DISTINCT VALUES IN BOUNDED MEMORY, USING HyperLogLog
+    SEE mo_math.sketches.HyperLogLog FOR THE ERROR BOUNDS
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, **kwargs):
+        object.__init__(self)
+        self.sketch = HyperLogLog(precision)
+
+    def add(self, value):
+        if value == None:
+            return
+        self.sketch.add(value)  # THE SKETCH HASHES THE JSON, SO ANY VALUE WILL DO
+
+    def merge(self, agg):
+        self.sketch.merge(agg.sketch)
+
+    def end(self):
+        return self.sketch.cardinality()
+
+
+def _hashable(value):
+    if isinstance(value, (Mapping, list)):
+        return value2json(value, sort_keys=True)
+    return value
+
+
+class _SlidingExtreme(WindowFunction):
+    """
+    FOR A WINDOW THAT ONLY SLIDES FORWARD: sub() ALWAYS REMOVES THE OLDEST
+    add()ED VALUE (NULLS INCLUDED), SO A MONOTONIC DEQUE GIVES O(1) AMORTIZED
+    add()/sub() AND O(1) end()
+    """
+
+    def __init__(self, **kwargs):
+        object.__init__(self)
+        self.added = 0  # POSITION OF NEXT add()
+        self.removed = 0  # POSITION OF NEXT sub()
+        self.window = deque()  # (position, value) PAIRS, BEST VALUE FIRST
+
+    def _dominates(self, a, b):
+        raise NotImplementedError
+
+    def add(self, value):
+        position = self.added
+        self.added += 1
+        if value == None:
+            return
+        window = self.window
+        while window and not self._dominates(window[-1][1], value):
+            window.pop()
+        window.append((position, value))
+
+    def sub(self, value):
+        position = self.removed
+        self.removed += 1
+        if self.window and self.window[0][0] == position:
+            self.window.popleft()
+
+    def end(self):
+        if self.window:
+            return self.window[0][1]
+        return None
+
+
+class SlidingMin(_SlidingExtreme):
+    def _dominates(self, a, b):
+        return a < b
+
+
+class SlidingMax(_SlidingExtreme):
+    def _dominates(self, a, b):
+        return a > b
+
+
+class SlidingPercentile(WindowFunction):
+    """
+    PERCENTILE (SAME INTERPOLATION AS stats.percentile()) IN O(log w) PER add()/sub()
+    THE WINDOW IS SPLIT INTO TWO HEAPS AT THE PERCENTILE: lower IS A MAX-HEAP
+    (NEGATED) OF THE SMALLEST VALUES, upper IS A MIN-HEAP OF THE REST.
+    REMOVED VALUES ARE ONLY POPPED ONCE THEY REACH THE TOP OF THEIR HEAP
+    """
+
+    def __init__(self, percentile=0.5, **kwargs):
+        object.__init__(self)
+        self.percentile = percentile
+        self.lower = _LazyHeap(-1)
+        self.upper = _LazyHeap(1)
+
+    def add(self, value):
+        if value == None:
+            return
+        if self.lower.size and value <= self.lower.top():
+            self.lower.push(value)
+        else:
+            self.upper.push(value)
+        self._balance()
+
+    def sub(self, value):
+        if value == None:
+            return
+        # EVERY LIVE VALUE IN lower IS <= EVERY LIVE VALUE IN upper
+        if self.lower.size and value <= self.lower.top():
+            self.lower.remove(value)
+        else:
+            self.upper.remove(value)
+        self._balance()
+
+    def end(self):
+        num = self.lower.size + self.upper.size
+        if not num:
+            return None
+        k = (num - 1) * self.percentile
+        f = int(Math.floor(k))
+        low = self.lower.top()
+        if f == k:
+            return low
+        high = self.upper.top()
+        return low * (f + 1 - k) + high * (k - f)
+
+    def _balance(self):
+        """
+        KEEP EXACTLY floor((num-1)*percentile)+1 LIVE VALUES IN lower
+        """
+        num = self.lower.size + self.upper.size
+        expected = int(Math.floor((num - 1) * self.percentile)) + 1 if num else 0
+        while self.lower.size > expected:
+            self.upper.push(self.lower.pop())
+        while self.lower.size < expected:
+            self.lower.push(self.upper.pop())
+
+
+class _LazyHeap(object):
+    """
+    HEAP WITH O(log n) AMORTIZED remove(): REMOVED VALUES ARE COUNTED, AND
+    ONLY DISCARDED WHEN THEY REACH THE TOP
+    """
+    __slots__ = ["sign", "heap", "size", "deleted"]
+
+    def __init__(self, sign):
+        self.sign = sign  # 1 FOR MIN-HEAP, -1 FOR MAX-HEAP
+        self.heap = []
+        self.size = 0  # NUMBER OF LIVE VALUES
+        self.deleted = {}  # MAP FROM VALUE TO NUMBER OF PENDING REMOVALS
+
+    def push(self, value):
+        heapq.heappush(self.heap, self.sign * value)
+        self.size += 1
+
+    def pop(self):
+        self._prune()
+        self.size -= 1
+        return self.sign * heapq.heappop(self.heap)
+
+    def top(self):
+        self._prune()
+        return self.sign * self.heap[0]
+
+    def remove(self, value):
+        self.deleted[value] = self.deleted.get(value, 0) + 1
+        self.size -= 1
+        self._prune()
+
+    def _prune(self):
+        heap, deleted, sign = self.heap, self.deleted, self.sign
+        while heap and deleted.get(sign * heap[0]):
+            deleted[sign * heapq.heappop(heap)] -= 1
+
+
 class List(WindowFunction):
     def __init__(self, **kwargs):
         object.__init__(self)
@@ -319,19 +552,53 @@ class List(WindowFunction):
             Log.error("Not a sliding window")
         self.agg = self.agg[1:]
 
+    def merge(self, agg):
+        self.agg.extend(agg.agg)
+
     def end(self):
         return copy(self.agg)
 
 
 name2accumulator = {
+    "cardinality": Cardinality,
     "count": Count,
     "sum": Sum,
     "exists": Exists,
     "max": Max,
     "maximum": Max,
     "list": List,
+    "median": functools.partial(Percentile, percentile=0.5),
     "min": Min,
     "minimum": Min,
     "percentile": Percentile,
     "one": One
 }
+
+# BOUNDED-MEMORY VERSIONS, FOR SELECT CLAUSES WITH approximate: true
+name2sketch = {
+    "cardinality": ApproxCardinality,
+    "median": functools.partial(ApproxPercentile, percentile=0.5),
+    "percentile": ApproxPercentile
+}
+
+# SLIDING VERSIONS, FOR USE BY jx.window()
+name2window = {
+    "max": SlidingMax,
+    "maximum": SlidingMax,
+    "median": functools.partial(SlidingPercentile, percentile=0.5),
+    "min": SlidingMin,
+    "minimum": SlidingMin,
+    "percentile": SlidingPercentile
+}
+
+
+def get_accumulator(select):
+    """
+    :param select: THE NORMALIZED select CLAUSE
+    :return: ACCUMULATOR CLASS FOR select, A SKETCH IF approximate IS REQUESTED AND AVAILABLE
+    """
+    if select.approximate:
+        sketch = name2sketch.get(select.aggregate)
+        if sketch:
+            return sketch
+    return name2accumulator.get(select.aggregate)
@@ -14,25 +14,32 @@ from __future__ import unicode_literals
 
 import re
 import sqlite3
-from collections import Mapping
+from collections import Mapping, deque
 
 import sys
+from time import time
 
 from mo_dots import Data, coalesce
 from mo_files import File
 from mo_logs import Log
 from mo_logs.exceptions import Except, extract_stack, ERROR, _extract_traceback
+from mo_math.sketches import TDigest
 from mo_math.stats import percentile
-from mo_threads import Queue, Signal, Thread
+from mo_threads import Lock, Queue, Signal, Thread
 from mo_times.timer import Timer
 from pyLibrary import convert
 from pyLibrary.sql import DB, SQL
 
 DEBUG = True
 DEBUG_INSERT = False
+STREAM_BATCH_SIZE = 1000  # ROWS FETCHED AT A TIME BY query_stream()
+STREAM_MAX_BATCHES = 4  # BATCHES WAITING FOR THE CONSUMER BEFORE THE worker WAITS
+STATEMENT_CACHE_SIZE = 200  # PREPARED STATEMENTS KEPT BY EACH CONNECTION (sqlite3 DEFAULT IS 100)
+MAX_PARAMETERS = 999  # SQLITE_MAX_VARIABLE_NUMBER OF OLDER SQLITE BUILDS
 
 _load_extension_warning_sent = False
 _upgraded = False
+_is_read = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE).match  # COMMANDS A READ-ONLY CONNECTION CAN RUN
 
 
 def _upgrade():
@@ -54,41 +61,101 @@ class Sqlite(DB):
     """
     Allows multi-threaded access
     Loads extension functions (like SQRT)
+
+    ALL WRITES GO THROUGH ONE WORKER THREAD, IN ORDER.  WITH readers>0 THE
+    FILE IS PUT IN WAL MODE, AND query() RUNS SELECTs ON A POOL OF UP TO
+    readers READ-ONLY CONNECTIONS, IN THE CALLING THREAD, SO A SLOW
+    QUERY DOES NOT BLOCK OTHER CALLERS.  A READ WAITS FOR THE WRITES SENT
+    BEFORE IT, SO A THREAD ALWAYS SEES ITS OWN CHANGES.
     """
 
     canonical = None
 
-    def __init__(self, filename=None, db=None):
+    def __init__(self, filename=None, db=None, readers=0):
         """
         :param db:  Optional, wrap a sqlite db in a thread
+        :param readers: MAXIMUM NUMBER OF CONCURRENT READ CONNECTIONS (REQUIRES filename)
         :return: Multithread save database
         """
         if not _upgraded:
             _upgrade()
+        if readers and (not filename or db is not None):
+            Log.error("Concurrent readers need a database file")
 
         self.filename = filename
         self.db = db
-        self.queue = Queue("sql commands")   # HOLD (command, result, signal) PAIRS
+        self.queue = Queue("sql commands")   # HOLD (command, params, result, signal, trace) TUPLES
+        self.locker = Lock("sqlite writes")
+        self.num_sent = 0  # NUMBER OF COMMANDS PUT ON THE queue
+        self.num_done = 0  # NUMBER OF COMMANDS THE worker HAS FINISHED
+        self.readers = readers
+        self.reader_locker = Lock("sqlite readers")
+        self.num_readers = 0
+        self.read_pool = Queue("sqlite readers")  # IDLE READ-ONLY CONNECTIONS
         self.worker = Thread.run("sqlite db thread", self._worker)
         self.get_trace = DEBUG
+        if readers:
+            self.execute("PRAGMA journal_mode=WAL")
 
-    def _enhancements(self):
+    def _setup(self, db):
+        """
+        EVERY CONNECTION, WRITER OR READER, GETS THE SAME FUNCTIONS
+        """
+        global _load_extension_warning_sent
+
+        library_loc = File.new_instance(sys.modules[__name__].__file__, "../..")
+        full_path = File.new_instance(library_loc, "vendor/sqlite/libsqlitefunctions.so").abspath
+        try:
+            trace = extract_stack(0)[0]
+            file = File.new_instance(trace["file"], "../../vendor/sqlite/libsqlitefunctions.so")
+            full_path = file.abspath
+            db.enable_load_extension(True)
+            db.execute("SELECT load_extension(" + self.quote_value(full_path) + ")")
+        except Exception, e:
+            if not _load_extension_warning_sent:
+                _load_extension_warning_sent = True
+                Log.warning("Could not load {{file}}}, doing without. (no SQRT for you!)", file=full_path, cause=e)
+        self._enhancements(db)
+
+    def _enhancements(self, db):
         def regex(pattern, value):
             return 1 if re.match(pattern+"$", value) else 0
-        con = self.db.create_function("regex", 2, regex)
+        db.create_function("regex", 2, regex)
 
         class Percentile(object):
-            def __init__(self, percentile):
-                self.percentile=percentile
-                self.acc=[]
+            """
+            EXACT, KEEPS ALL VALUES
+            """
+            def __init__(self):
+                self.percentile = None
+                self.acc = []
 
-            def step(self, value):
-                self.acc.append(value)
+            def step(self, value, percent):
+                self.percentile = percent
+                if value is not None:
+                    self.acc.append(value)
 
             def finalize(self):
                 return percentile(self.acc, self.percentile)
 
-        con.create_aggregate("percentile", 2, Percentile)
+        class ApproxPercentile(object):
+            """
+            BOUNDED MEMORY, SEE mo_math.sketches.TDigest FOR THE ERROR BOUNDS
+            """
+            def __init__(self):
+                self.percentile = None
+                self.digest = TDigest()
+
+            def step(self, value, percent):
+                self.percentile = percent
+                if value is not None:
+                    self.digest.add(value)
+
+            def finalize(self):
+                return self.digest.quantile(self.percentile)
+
+        db.create_aggregate("percentile", 2, Percentile)
+        db.create_aggregate("approx_percentile", 2, ApproxPercentile)
 
     def execute(self, command):
         """
@@ -101,88 +168,198 @@ class Sqlite(DB):
             trace = extract_stack(1)
         else:
             trace = None
-        self.queue.add((command, None, None, trace))
+        self._send((command, None, None, None, trace))
+
+    def execute_many(self, commands):
+        """
+        RUN ALL commands IN ONE TRANSACTION, WITH THE VALUES BOUND AS
+        PARAMETERS (executemany), SO NOTHING IS QUOTED OR PARSED PER ROW
+        WILL BLOCK CALLING THREAD UNTIL THE TRANSACTION IS COMMITTED
+        :param commands: LIST OF (command, rows) PAIRS, command HAS ONE ? FOR EACH VALUE IN A ROW (rows=None TO RUN command ONCE)
+        :return: Data WITH rows (NUMBER OF ROWS) AND duration (SECONDS)
+        """
+        if not self.worker:
+            self.worker = Thread.run("sqlite db thread", self._worker)
 
-    def query(self, command):
+        signal = Signal()
+        result = Data()
+        self._send((list(commands), None, result, signal, None))
+        signal.wait()
+        if result.exception:
+            Log.error("Problem with Sqlite call", cause=result.exception)
+        return result
+
+    def query(self, command, params=None):
         """
         WILL BLOCK CALLING THREAD UNTIL THE command IS COMPLETED
         :param command: COMMAND FOR SQLITE
+        :param params: OPTIONAL VALUES FOR THE ? IN command (SEE parameterize())
         :return: list OF RESULTS
         """
         if not self.worker:
             self.worker = Thread.run("sqlite db thread", self._worker)
 
+        if self.readers and _is_read(command):
+            return self._read(command, params)
+
         signal = Signal()
         result = Data()
-        self.queue.add((command, result, signal, None))
+        self._send((command, params, result, signal, None))
         signal.wait()
         if result.exception:
             Log.error("Problem with Sqlite call", cause=result.exception)
         return result
 
-    def _worker(self, please_stop):
-        global _load_extension_warning_sent
+    def query_stream(self, command, params=None):
+        """
+        LIKE query(), BUT THE ROWS ARE FETCHED IN BATCHES WHILE THEY ARE
+        CONSUMED, SO ONLY A FEW BATCHES ARE IN MEMORY AT ONCE
+
+        WITHOUT readers THE worker IS BUSY UNTIL THE ROWS ARE ALL READ (OR
+        THE ITERATOR IS CLOSED), SO DO NOT query() THIS db WHILE ITERATING
+        :param command: COMMAND FOR SQLITE
+        :param params: OPTIONAL VALUES FOR THE ? IN command
+        :return: ITERATOR OF ROW TUPLES, close() IT IF NOT ALL ROWS ARE READ
+        """
+        if not self.worker:
+            self.worker = Thread.run("sqlite db thread", self._worker)
+
+        if self.readers and _is_read(command):
+            return self._read_stream(command, params)
+
+        stream = Stream(STREAM_MAX_BATCHES)
+        self._send((command, params, stream, None, None))
+        return StreamRows(stream)
+
+    def transaction(self):
+        """
+        with db.transaction() as t:
+            t.execute(...)
+            t.execute_many(...)
+
+        THE COMMANDS ARE RUN WHEN THE with BLOCK ENDS, WITH ONE COMMIT, OR
+        ROLLED BACK TOGETHER.  NOTHING IS RUN IF THE BLOCK RAISES.  QUERIES
+        MADE INSIDE THE BLOCK DO NOT SEE ITS COMMANDS.
+        """
+        return Transaction(self)
+
+    def _send(self, item):
+        with self.locker:
+            self.num_sent += 1
+            self.queue.add(item)
+
+    def _read(self, command, params):
+        # WAIT FOR THE WRITES SENT BEFORE THIS READ
+        with self.locker:
+            target = self.num_sent
+            while self.num_done < target:
+                self.locker.wait()
+
+        db = self._get_reader()
+        try:
+            with Timer("Run read", debug=DEBUG):
+                curr = db.execute(command, params or ())
+                result = Data()
+                result.meta.format = "table"
+                result.header = [d[0] for d in curr.description] if curr.description else None
+                result.data = curr.fetchall()
+            return result
+        except Exception, e:
+            Log.error("Problem with\n{{command|indent}}", command=command, cause=e)
+        finally:
+            self.read_pool.add(db)
+
+    def _read_stream(self, command, params):
+        with self.locker:
+            target = self.num_sent
+            while self.num_done < target:
+                self.locker.wait()
+
+        db = self._get_reader()
+        try:
+            try:
+                curr = db.execute(command, params or ())
+            except Exception, e:
+                Log.error("Problem with\n{{command|indent}}", command=command, cause=e)
+            while True:
+                batch = curr.fetchmany(STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+            curr.close()
+        finally:
+            self.read_pool.add(db)
+
+    def _get_reader(self):
+        with self.reader_locker:
+            if not len(self.read_pool) and self.num_readers < self.readers:
+                self.num_readers += 1
+                db = sqlite3.connect(self.filename, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+                self._setup(db)
+                db.execute("PRAGMA query_only=1")
+                return db
+        return self.read_pool.pop()
 
+    def _worker(self, please_stop):
         if DEBUG:
             Log.note("Sqlite version {{version}}", version=sqlite3.sqlite_version)
         if Sqlite.canonical:
             self.db = Sqlite.canonical
+            self._enhancements(self.db)
         else:
-            self.db = sqlite3.connect(coalesce(self.filename, ':memory:'))
-
-            library_loc = File.new_instance(sys.modules[__name__].__file__, "../..")
-            full_path = File.new_instance(library_loc, "vendor/sqlite/libsqlitefunctions.so").abspath
-            try:
-                trace = extract_stack(0)[0]
-                file = File.new_instance(trace["file"], "../../vendor/sqlite/libsqlitefunctions.so")
-                full_path = file.abspath
-                self.db.enable_load_extension(True)
-                self.db.execute("SELECT load_extension(" + self.quote_value(full_path) + ")")
-            except Exception, e:
-                if not _load_extension_warning_sent:
-                    _load_extension_warning_sent = True
-                    Log.warning("Could not load {{file}}}, doing without. (no SQRT for you!)", file=full_path, cause=e)
+            self.db = sqlite3.connect(coalesce(self.filename, ':memory:'), cached_statements=STATEMENT_CACHE_SIZE)
+            self._setup(self.db)
 
         try:
             while not please_stop:
                 if DEBUG:
                     Log.note("begin pop")
-                command, result, signal, trace = self.queue.pop(till=please_stop)
+                command, params, result, signal, trace = self.queue.pop(till=please_stop)
                 if DEBUG:
                     Log.note("done pop")
 
-                if DEBUG_INSERT and command.strip().lower().startswith("insert"):
-                    Log.note("Running command\n{{command|indent}}", command=command)
-                if DEBUG and not command.strip().lower().startswith("insert"):
-                    Log.note("Running command\n{{command|indent}}", command=command)
-                with Timer("Run command", debug=DEBUG):
-                    if signal is not None:
-                        try:
-                            curr = self.db.execute(command)
-                            self.db.commit()
-                            result.meta.format = "table"
-                            result.header = [d[0] for d in curr.description] if curr.description else None
-                            result.data = curr.fetchall()
-                            if DEBUG and result.data:
-                                text = convert.table2csv(list(result.data))
-                                Log.note("Result:\n{{data}}", data=text)
-                        except Exception, e:
-                            e = Except.wrap(e)
-                            result.exception = Except(ERROR, "Problem with\n{{command|indent}}", command=command, cause=e)
-                        finally:
-                            signal.go()
+                try:
+                    if isinstance(command, list):
+                        self._execute_many(command, result, signal)
+                    elif isinstance(result, Stream):
+                        self._stream(command, params, result)
                     else:
-                        try:
-                            self.db.execute(command)
-                            self.db.commit()
-                        except Exception, e:
-                            e = Except.wrap(e)
-                            e.cause = Except(
-                                type=ERROR,
-                                template="Bad call to Sqlite",
-                                trace=trace
-                            )
-                            Log.warning("Failure to execute", cause=e)
+                        if DEBUG_INSERT and command.strip().lower().startswith("insert"):
+                            Log.note("Running command\n{{command|indent}}", command=command)
+                        if DEBUG and not command.strip().lower().startswith("insert"):
+                            Log.note("Running command\n{{command|indent}}", command=command)
+                        with Timer("Run command", debug=DEBUG):
+                            if signal is not None:
+                                try:
+                                    curr = self.db.execute(command, params or ())
+                                    self.db.commit()
+                                    result.meta.format = "table"
+                                    result.header = [d[0] for d in curr.description] if curr.description else None
+                                    result.data = curr.fetchall()
+                                    if DEBUG and result.data:
+                                        text = convert.table2csv(list(result.data))
+                                        Log.note("Result:\n{{data}}", data=text)
+                                except Exception, e:
+                                    e = Except.wrap(e)
+                                    result.exception = Except(ERROR, "Problem with\n{{command|indent}}", command=command, cause=e)
+                                finally:
+                                    signal.go()
+                            else:
+                                try:
+                                    self.db.execute(command)
+                                    self.db.commit()
+                                except Exception, e:
+                                    e = Except.wrap(e)
+                                    e.cause = Except(
+                                        type=ERROR,
+                                        template="Bad call to Sqlite",
+                                        trace=trace
+                                    )
+                                    Log.warning("Failure to execute", cause=e)
+                finally:
+                    with self.locker:
+                        self.num_done += 1
 
         except Exception, e:
             Log.error("Problem with sql thread", e)
@@ -192,6 +369,40 @@ class Sqlite(DB):
             self.db.commit()
             self.db.close()
 
+    def _stream(self, command, params, stream):
+        try:
+            curr = self.db.execute(command, params or ())
+            while True:
+                batch = curr.fetchmany(STREAM_BATCH_SIZE)
+                if not batch or not stream.add(batch):
+                    break
+            curr.close()
+            stream.finish()
+        except Exception, e:
+            stream.finish(Except(ERROR, "Problem with\n{{command|indent}}", command=command, cause=Except.wrap(e)))
+
+    def _execute_many(self, commands, result, signal):
+        sql = None
+        try:
+            start = time()
+            num_rows = 0
+            for sql, rows in commands:
+                if DEBUG_INSERT:
+                    Log.note("Running bulk command\n{{command|indent}}", command=sql)
+                if rows is None:
+                    curr = self.db.execute(sql)
+                else:
+                    curr = self.db.executemany(sql, rows)
+                num_rows += max(curr.rowcount, 0)
+            self.db.commit()
+            result.rows = num_rows
+            result.duration = time() - start
+        except Exception, e:
+            self.db.rollback()
+            result.exception = Except(ERROR, "Problem with\n{{command|indent}}", command=sql, cause=Except.wrap(e))
+        finally:
+            signal.go()
+
     def quote_column(self, column_name, table=None):
         if table != None:
             return SQL(convert.value2quote(table) + "." + convert.value2quote(column_name))
@@ -211,3 +422,159 @@ class Sqlite(DB):
             return "0"
         else:
             return unicode(value)
+
+
+_sql_tokens = re.compile(
+    r"(?P<string>'(?:[^']|'')*')|"
+    r"(?P<name>\"(?:[^\"]|\"\")*\"|[A-Za-z_]\w*)|"
+    r"(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)|"
+    r"(?P<other>\S)",
+    re.UNICODE
+)
+
+
+def parameterize(command):
+    """
+    REPLACE THE STRING AND NUMBER LITERALS IN GENERATED SQL WITH ?, SO
+    COMMANDS THAT DIFFER ONLY BY THEIR LITERALS ARE THE SAME STATEMENT
+    TO THE CONNECTION'S PREPARED STATEMENT CACHE
+
+    NUMBERS AFTER BY OR A COMMA ARE KEPT, THEY MAY BE COLUMN POSITIONS
+    (ORDER BY 1), AS ARE STRINGS AFTER AS (ALIASES)
+    :param command: SQL WITH LITERALS
+    :return: (command, params) PAIR
+    """
+    output = []
+    params = []
+    start = 0
+    previous = None
+    for m in _sql_tokens.finditer(command):
+        kind = m.lastgroup
+        token = m.group(kind)
+        if kind == "string" and previous != "AS":
+            output.append(command[start:m.start()])
+            output.append("?")
+            params.append(token[1:-1].replace("''", "'"))
+            start = m.end()
+        elif kind == "number" and previous not in ("BY", ",", "."):
+            if "." in token or "e" in token or "E" in token:
+                value = float(token)
+            else:
+                value = int(token)
+            if -2 ** 63 <= value < 2 ** 63:
+                output.append(command[start:m.start()])
+                output.append("?")
+                params.append(value)
+                start = m.end()
+        previous = token.upper() if kind == "name" else token
+
+    if not params or len(params) > MAX_PARAMETERS:
+        return command, []
+    output.append(command[start:])
+    return "".join(output), params
+
+
+class Transaction(object):
+    """
+    COLLECT COMMANDS TO BE RUN, AND COMMITTED, TOGETHER
+    SEE Sqlite.transaction()
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.commands = []
+
+    def execute(self, command):
+        self.commands.append((command, None))
+
+    def execute_many(self, command, rows):
+        self.commands.append((command, list(rows)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type or not self.commands:
+            return
+        commands, self.commands = self.commands, []
+        self.db.execute_many(commands)
+
+
+class Stream(object):
+    """
+    HAND BATCHES OF ROWS FROM THE worker TO THE CONSUMER
+    AT MOST max BATCHES WAIT IN MEMORY; THE worker WAITS FOR A SLOW CONSUMER
+    THE CONSUMER READS THROUGH A StreamRows
+    """
+
+    def __init__(self, max):
+        self.max = max
+        self.lock = Lock("sqlite stream")
+        self.batches = deque()
+        self.rows = iter(())  # THE BATCH BEING CONSUMED
+        self.done = False  # THE worker HAS NO MORE ROWS
+        self.closed = False  # THE CONSUMER WANTS NO MORE ROWS
+        self.exception = None
+
+    def add(self, batch):
+        """
+        :return: False IF THE CONSUMER HAS GONE AWAY
+        """
+        with self.lock:
+            while len(self.batches) >= self.max and not self.closed:
+                self.lock.wait()
+            if self.closed:
+                return False
+            self.batches.append(batch)
+            return True
+
+    def finish(self, exception=None):
+        with self.lock:
+            self.exception = exception
+            self.done = True
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.batches.clear()
+            self.rows = iter(())
+
+    def next(self):
+        row = next(self.rows, None)
+        while row is None:
+            with self.lock:
+                while not self.batches and not self.done and not self.closed:
+                    self.lock.wait()
+                if self.batches:
+                    self.rows = iter(self.batches.popleft())
+                    row = next(self.rows, None)
+                    continue
+                exception = None if self.closed else self.exception
+            self.close()
+            if exception:
+                Log.error("Problem with Sqlite call", cause=exception)
+            raise StopIteration
+        return row
+
+
+class StreamRows(object):
+    """
+    THE CONSUMER'S ITERATOR OVER A Stream
+    THE worker HOLDS THE Stream TOO, SO IT IS THIS OBJECT BEING close()ED,
+    OR DROPPED, THAT RELEASES THE worker BEFORE ALL ROWS ARE READ
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.stream.next()
+
+    def close(self):
+        self.stream.close()
+
+    def __del__(self):
+        self.stream.close()
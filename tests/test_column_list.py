@@ -0,0 +1,131 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Thread
+from pyLibrary.queries.meta import ColumnList
+
+
+def _column(table, name, es_index=None, es_column=None, type="string"):
+    return Data(
+        table=table,
+        name=name,
+        es_index=es_index or table,
+        es_column=es_column or name,
+        type=type
+    )
+
+
+def _columns():
+    columns = ColumnList()
+    columns.insert([
+        _column("unittest", "a"),
+        _column("unittest", "b", type="long"),
+        _column("unittest", "b", es_column="b.$object", type="object"),
+        _column("other", "a"),
+        _column("other", "c", es_index="other_20170101")
+    ])
+    return columns
+
+
+class TestColumnList(FuzzyTestCase):
+
+    def test_find(self):
+        columns = _columns()
+        self.assertEqual(len(columns), 5)
+        self.assertEqual(sorted(c.es_column for c in columns.find("unittest", None)), ["a", "b", "b.$object"])
+        self.assertEqual(sorted(c.es_column for c in columns.find("unittest", "b")), ["b", "b.$object"])
+        self.assertEqual([c.table for c in columns.find("other", "a")], ["other"])
+        self.assertEqual(columns.find("unittest", "c"), [])
+        self.assertEqual(columns.find("missing", None), [])
+
+    def test_find_es_column(self):
+        columns = _columns()
+        self.assertEqual([c.table for c in columns.find_es_column("unittest", "a")], ["unittest"])
+        self.assertEqual([c.name for c in columns.find_es_column("other_20170101", "c")], ["c"])
+        self.assertEqual(columns.find_es_column("other", "c"), [])
+
+        # THE RESULT IS A COPY
+        found = columns.find_es_column("unittest", "a")
+        found.append(None)
+        self.assertEqual(len(columns.find_es_column("unittest", "a")), 1)
+
+    def test_update_by_es_column(self):
+        columns = _columns()
+        columns.update({
+            "set": {"cardinality": 42},
+            "where": {"eq": {"es_index": "unittest", "es_column": "b"}}
+        })
+        self.assertEqual(
+            sorted((c.table, c.es_column) for c in columns if c.cardinality == 42),
+            [("unittest", "b")]
+        )
+
+    def test_update_by_name(self):
+        columns = _columns()
+        columns.update({
+            "set": {"cardinality": 7},
+            "where": {"eq": {"table": "unittest", "name": "b", "type": "object"}}
+        })
+        self.assertEqual(
+            sorted((c.table, c.es_column) for c in columns if c.cardinality == 7),
+            [("unittest", "b.$object")]
+        )
+
+    def test_update_clear(self):
+        columns = _columns()
+        for c in columns:
+            c.partitions = ["x"]
+        columns.update({
+            "clear": ["partitions"],
+            "where": {"eq": {"table": "unittest"}}
+        })
+        self.assertEqual(
+            sorted((c.table, c.es_column) for c in columns if c.partitions == None),
+            [("unittest", "a"), ("unittest", "b"), ("unittest", "b.$object")]
+        )
+
+    def test_update_by_filter(self):
+        columns = _columns()
+        columns.update({
+            "set": {"count": 3},
+            "where": {"eq": {"name": "a"}}
+        })
+        self.assertEqual(
+            sorted((c.table, c.es_column) for c in columns if c.count == 3),
+            [("other", "a"), ("unittest", "a")]
+        )
+
+    def test_readers_during_add(self):
+        columns = _columns()
+        num = 2000
+
+        def writer(please_stop):
+            for i in range(num):
+                columns.add(_column("unittest", "n" + unicode(i)))
+
+        # READERS DO NOT TAKE THE locker, SO HOLDING IT MUST NOT BLOCK THEM
+        with columns.locker:
+            thread = Thread.run("add columns", writer)
+            seen = 0
+            while not thread.stopped:
+                seen = max(seen, len(list(columns)))
+                columns.find("unittest", None)
+                columns.find("unittest", "a")
+                columns.find_es_column("unittest", "a")
+            thread.join()
+
+        self.assertTrue(seen <= num + 5)
+        self.assertEqual(len(list(columns)), num + 5)
+        self.assertEqual(len(columns.find("unittest", None)), num + 3)
@@ -0,0 +1,70 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import THREAD_STOP, Signal
+from pyLibrary.queries.meta import ColumnQueue
+
+
+def _column(table, name):
+    return Data(table=table, es_column=name)
+
+
+class TestColumnQueue(FuzzyTestCase):
+
+    def test_each_column_once(self):
+        todo = ColumnQueue("unittest")
+        a, b = _column("unittest", "a"), _column("unittest", "b")
+        todo.add(a).add(b).add(a)
+        # A LIVE QUERY PUSHES THE SAME COLUMN MANY TIMES
+        for i in range(10):
+            todo.push(b)
+        self.assertEqual(len(todo), 2)
+        self.assertTrue(todo.pop() is b)
+        self.assertTrue(todo.pop() is a)
+        self.assertEqual(len(todo), 0)
+        self.assertFalse(todo)
+
+    def test_push_goes_first(self):
+        todo = ColumnQueue("unittest")
+        columns = [_column("unittest", unicode(i)) for i in range(5)]
+        todo.extend(columns)
+        todo.push(columns[3])
+        todo.push(columns[4])
+        self.assertEqual([todo.pop().es_column for _ in range(5)], ["4", "3", "0", "1", "2"])
+
+    def test_pop_batch(self):
+        todo = ColumnQueue("unittest")
+        todo.extend([_column("other", "x"), _column("unittest.run", "a"), _column("unittest", "b"), _column("unittest", "c")])
+        todo.push(_column("unittest", "c"))
+
+        batch = todo.pop_batch(max_size=2)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch[0].es_column, "c")
+        self.assertEqual(batch[1].table.split(".")[0], "unittest")
+        self.assertEqual(len(todo), 2)
+
+        self.assertEqual([c.es_column for c in todo.pop_batch()], ["x"])
+        self.assertEqual(len(todo.pop_batch()), 1)
+
+    def test_stop(self):
+        todo = ColumnQueue("unittest")
+        till = Signal()
+        till.go()
+        self.assertEqual(todo.pop(till=till), None)
+        todo.add(_column("unittest", "a"))
+        todo.add(THREAD_STOP)
+        self.assertEqual(todo.pop().es_column, "a")
+        self.assertTrue(todo.pop() is THREAD_STOP)
+        self.assertTrue(todo.pop_batch() is THREAD_STOP)
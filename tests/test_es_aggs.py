@@ -0,0 +1,142 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from time import sleep
+
+from mo_dots import wrap, Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Lock
+from pyLibrary.queries.es09 import util as es09_util
+from pyLibrary.queries.es14 import aggs
+from pyLibrary.queries.es14.decoders import DefaultDecoder, PARTITION_SCRIPT
+from pyLibrary.queries.expressions import Variable
+
+
+def _decoder(var, limit):
+    d = object.__new__(DefaultDecoder)
+    d.edge = Data(value=Variable(var))
+    d.domain = Data(limit=limit)
+    return d
+
+
+PARTITIONED = {
+    "_match": {"terms": {"script": PARTITION_SCRIPT, "params": {"field": "a", "n": 2}}, "aggs": {"v": {"max": {"field": "v"}}}},
+    "_missing": {"missing": {"field": "a"}}
+}
+
+
+def _partitioned(aggregations):
+    return wrap({"aggs": aggregations, "size": 0})
+
+
+def _frum(**cardinalities):
+    return Data(schema=Data(columns=[{"es_column": k, "cardinality": v} for k, v in cardinalities.items()]))
+
+
+class TestESAggs(FuzzyTestCase):
+    """
+    THE PARTS OF es_aggsop() THAT DO NOT NEED AN ES CLUSTER
+    """
+
+    def test_partition_plan(self):
+        frum = _frum(small=10, big=5500, bigger=30000)
+        a, b = _decoder("small", 50000), _decoder("big", 50000)
+        self.assertEqual(aggs._partition_plan([[a, b]], frum), (b, 6))
+
+        # THE EDGE WITH THE MOST PARTS IS SPLIT, WITH NO MORE THAN MAX_PARTITIONS QUERIES
+        c = _decoder("bigger", 50000)
+        self.assertEqual(aggs._partition_plan([[a, b, c]], frum), (c, aggs.MAX_PARTITIONS))
+
+    def test_partition_plan_not_split(self):
+        frum = _frum(small=10, big=5500, unknown=None)
+        # FEW PARTS
+        self.assertEqual(aggs._partition_plan([[_decoder("small", 50000)]], frum), (None, 1))
+        # ONLY THE TOP limit PARTS ARE WANTED
+        self.assertEqual(aggs._partition_plan([[_decoder("big", 10)]], frum), (None, 1))
+        # NO METADATA
+        self.assertEqual(aggs._partition_plan([[_decoder("unknown", 50000)]], frum), (None, 1))
+        self.assertEqual(aggs._partition_plan([], frum), (None, 1))
+
+    def test_merge_aggs(self):
+        query = _partitioned({"_filter": {"filter": {"match_all": {}}, "aggs": PARTITIONED}})
+        acc = {}
+        aggs._merge_aggs(acc, {"_filter": {
+            "doc_count": 7,
+            "_match": {"sum_other_doc_count": 0, "buckets": [{"key": "a", "doc_count": 2, "v": {"value": 1}}, {"key": "b", "doc_count": 1}]},
+            "_missing": {"doc_count": 4}
+        }}, query)
+        aggs._merge_aggs(acc, {"_filter": {
+            "doc_count": 7,
+            "_match": {"sum_other_doc_count": 2, "buckets": [{"key": "c", "doc_count": 3}, {"key": "d", "doc_count": 1}]}
+        }}, query)
+        # EVERY PARTITION SEES ALL THE DOCUMENTS
+        self.assertEqual(acc["_filter"]["doc_count"], 7)
+        self.assertEqual(acc["_filter"]["_missing"]["doc_count"], 4)
+        self.assertEqual(acc["_filter"]["_match"]["sum_other_doc_count"], 2)
+        buckets = {b["key"]: b["doc_count"] for b in acc["_filter"]["_match"]["buckets"]}
+        self.assertEqual(buckets, {"a": 2, "b": 1, "c": 3, "d": 1})
+
+    def test_merge_aggs_outer_edge(self):
+        query = _partitioned({"_match": {"terms": {"field": "outer"}, "aggs": PARTITIONED}})
+        acc = {}
+        aggs._merge_aggs(acc, {"_match": {"buckets": [
+            {"key": "x", "doc_count": 10, "_match": {"buckets": [{"key": "a", "doc_count": 6}]}},
+            {"key": "y", "doc_count": 5, "_match": {"buckets": [{"key": "a", "doc_count": 5}]}}
+        ]}}, query)
+        aggs._merge_aggs(acc, {"_match": {"buckets": [
+            {"key": "x", "doc_count": 10, "_match": {"buckets": [{"key": "b", "doc_count": 4}]}},
+            {"key": "y", "doc_count": 5, "_match": {"buckets": []}}
+        ]}}, query)
+        outer = {b["key"]: b for b in acc["_match"]["buckets"]}
+        self.assertEqual(outer["x"]["doc_count"], 10)
+        self.assertEqual(outer["y"]["doc_count"], 5)
+        self.assertEqual({b["key"]: b["doc_count"] for b in outer["x"]["_match"]["buckets"]}, {"a": 6, "b": 4})
+        self.assertEqual({b["key"]: b["doc_count"] for b in outer["y"]["_match"]["buckets"]}, {"a": 5})
+
+    def test_merge_keyed_buckets(self):
+        query = _partitioned({"_range": {"range": {"ranges": []}, "aggs": PARTITIONED}})
+        acc = {}
+        aggs._merge_aggs(acc, {"_range": {"buckets": {
+            "low": {"doc_count": 3, "_match": {"buckets": [{"key": "a", "doc_count": 3}]}},
+            "high": {"doc_count": 2, "_match": {"buckets": []}}
+        }}}, query)
+        aggs._merge_aggs(acc, {"_range": {"buckets": {
+            "low": {"doc_count": 3, "_match": {"buckets": []}},
+            "high": {"doc_count": 2, "_match": {"buckets": [{"key": "b", "doc_count": 2}]}}
+        }}}, query)
+        self.assertEqual(acc["_range"]["buckets"], {
+            "low": {"doc_count": 3, "_match": {"buckets": [{"key": "a", "doc_count": 3}]}},
+            "high": {"doc_count": 2, "_match": {"buckets": [{"key": "b", "doc_count": 2}]}}
+        })
+
+    def test_post_all_is_bounded(self):
+        locker = Lock()
+        state = Data(running=0, most=0)
+
+        def post(es, es_query, limit):
+            with locker:
+                state.running += 1
+                state.most = max(state.most, state.running)
+            sleep(0.05)
+            with locker:
+                state.running -= 1
+            return wrap({"partition": es_query.p})
+
+        old_post, es09_util.post = es09_util.post, post
+        try:
+            results = aggs._post_all(None, [wrap({"p": p}) for p in range(10)], 10)
+        finally:
+            es09_util.post = old_post
+
+        self.assertEqual([r.partition for r in results], list(range(10)))
+        self.assertTrue(1 < state.most <= aggs.MAX_CONCURRENT_PARTITIONS)
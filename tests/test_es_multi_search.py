@@ -0,0 +1,99 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from time import sleep
+
+from mo_dots import wrap, Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Signal, Thread
+from pyLibrary import convert
+from pyLibrary.env.elasticsearch import MultiSearch
+
+
+class FakeCluster(object):
+    """
+    STAND-IN FOR Cluster, RECORDS EVERY _msearch BODY AND ANSWERS EACH SEARCH WITH ITS OWN QUERY
+    """
+
+    def __init__(self, fail=0):
+        self.path = "http://localhost:9200"
+        self.debug = False
+        self.fail = fail
+        self.bodies = []
+        self.posts = 0
+        self.release = Signal("release post")
+        self.release.go()
+
+    def post(self, path, data, timeout=None):
+        self.posts += 1
+        self.release.wait()
+        lines = convert.utf82unicode(data).strip().split("\n")
+        self.bodies.append(lines)
+        if self.fail:
+            self.fail -= 1
+            raise Exception("ES is not available")
+        return wrap({"responses": [
+            {"_shards": {"failed": 0}, "hits": {"total": convert.json2value(q).size}}
+            for q in lines[1::2]
+        ]})
+
+
+class TestMultiSearch(FuzzyTestCase):
+
+    def test_concurrent_searches_are_batched(self):
+        cluster = FakeCluster()
+        multi = MultiSearch(cluster)
+        try:
+            # HOLD THE WORKER ON A FIRST SEARCH WHILE THE OTHERS ARRIVE
+            cluster.release = Signal("release post")
+            Thread.run("first", lambda please_stop: multi.search("/unittest", {"size": 100}))
+            while not cluster.posts:
+                sleep(0.01)
+
+            num = 5
+            results = Data()
+
+            def search(i, please_stop):
+                results[unicode(i)] = multi.search("/unittest/test_result", {"size": i})
+
+            threads = [Thread.run("search " + unicode(i), search, i) for i in range(num)]
+            while len(multi.queue) < num:
+                sleep(0.01)
+            cluster.release.go()
+            for t in threads:
+                t.join()
+        finally:
+            multi.stop()
+
+        self.assertEqual(len(cluster.bodies), 2)
+        batch = cluster.bodies[1]
+        self.assertEqual(len(batch), num * 2)
+        self.assertEqual(convert.json2value(batch[0]), {"index": "unittest", "type": "test_result"})
+        self.assertEqual(
+            sorted(convert.json2value(q).size for q in batch[1::2]),
+            list(range(num))
+        )
+        for i in range(num):
+            self.assertEqual(results[unicode(i)].hits.total, i)
+
+    def test_retry(self):
+        cluster = FakeCluster(fail=1)
+        multi = MultiSearch(cluster)
+        try:
+            self.assertRaises(Exception, multi.search, "/unittest", {"size": 1})
+            cluster.fail = 1
+            result = multi.search("/unittest", {"size": 1}, retry={"times": 2})
+        finally:
+            multi.stop()
+        self.assertEqual(result.hits.total, 1)
+        self.assertEqual(len(cluster.bodies), 3)
@@ -0,0 +1,118 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap, Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from pyLibrary import convert
+from pyLibrary.env.elasticsearch import _scroll
+from pyLibrary.queries.es14 import setop
+from pyLibrary.queries.query import QueryOp
+
+
+class FakeCluster(object):
+    """
+    STAND-IN FOR Cluster, SERVES THE HITS size AT A TIME, AND RECORDS THE SCROLLS CLEARED
+    """
+
+    def __init__(self, num_hits, fail_at_page=None):
+        self.hits = [{"_source": {"a": i}} for i in range(num_hits)]
+        self.fail_at_page = fail_at_page
+        self.page = 0
+        self.size = None
+        self.cleared = []
+
+    def post(self, path, data, timeout=None):
+        if "?scroll=" in path and not path.startswith("/_search/scroll"):
+            self.size = data.size
+        else:
+            self._check_scroll_id(data)
+        if self.page == self.fail_at_page:
+            raise Exception("ES is not available")
+        start = self.page * self.size
+        self.page += 1
+        return wrap({
+            "_scroll_id": "scroll" + unicode(self.page),
+            "hits": {"hits": self.hits[start:start + self.size]}
+        })
+
+    def _check_scroll_id(self, data):
+        if convert.utf82unicode(data) != "scroll" + unicode(self.page):
+            raise Exception("wrong scroll id")
+
+    def delete(self, path, data):
+        self.cleared.append(convert.utf82unicode(data))
+
+
+class FakeIndex(object):
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.path = "/unittest/test_result"
+        self.debug = False
+
+    def scroll(self, query):
+        return _scroll(self, query, "5m", None)
+
+
+class FakeQuery(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+SELECT = wrap([{"name": "a", "pull": "_source.a", "put": {"name": "a", "index": 0, "child": "."}}])
+
+
+class TestScroll(FuzzyTestCase):
+
+    def test_all_pages(self):
+        cluster = FakeCluster(25)
+        pages = list(_scroll(FakeIndex(cluster), {"size": 10}, "5m", None))
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(cluster.cleared, ["scroll4"])
+
+    def test_cleared_when_abandoned(self):
+        cluster = FakeCluster(25)
+        pages = _scroll(FakeIndex(cluster), {"size": 10}, "5m", None)
+        self.assertEqual(len(next(pages)), 10)
+        pages.close()
+        self.assertEqual(cluster.cleared, ["scroll1"])
+        self.assertEqual(cluster.page, 1)
+
+    def test_cleared_on_error(self):
+        cluster = FakeCluster(25, fail_at_page=2)
+        pages = _scroll(FakeIndex(cluster), {"size": 10}, "5m", None)
+        self.assertRaises("Problem with scroll", list, pages)
+        self.assertEqual(cluster.cleared, ["scroll2"])
+
+    def test_stream_rows_limit(self):
+        cluster = FakeCluster(25)
+        query = FakeQuery(format="list", limit=12, select=[Data(name="a")])
+        result = setop.stream_rows(FakeIndex(cluster), wrap({"size": 5}), SELECT, query)
+        self.assertEqual([r.a for r in result.data], list(range(12)))
+        # ONLY THE PAGES NEEDED ARE READ, AND THE SCROLL IS CLEARED
+        self.assertEqual(cluster.page, 3)
+        self.assertEqual(cluster.cleared, ["scroll3"])
+
+    def test_stream_rows_table(self):
+        cluster = FakeCluster(7)
+        query = FakeQuery(format="table", limit=100, select=[Data(name="a")])
+        result = setop.stream_rows(FakeIndex(cluster), wrap({"size": 5}), SELECT, query)
+        self.assertEqual(result.header, ["a"])
+        self.assertEqual(list(result.data), [[i] for i in range(7)])
+
+    def test_stream_default_format(self):
+        query = QueryOp.wrap({"from": [{"a": 1}], "stream": True})
+        self.assertEqual(query.format, "list")
+        query = QueryOp.wrap({"from": [{"a": 1}], "stream": True, "format": "table"})
+        self.assertEqual(query.format, "table")
+        query = QueryOp.wrap({"from": [{"a": 1}]})
+        self.assertTrue(query.format == None)
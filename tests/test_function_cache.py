@@ -0,0 +1,94 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from pyLibrary.queries import expressions
+from pyLibrary.queries.expression_compiler import FunctionCache, canonical_key
+from pyLibrary.queries.expressions import jx_expression, jx_expression_to_function
+
+
+class TestFunctionCache(FuzzyTestCase):
+
+    def setUp(self):
+        self.sources = []
+
+    def source(self, code):
+        def output():
+            self.sources.append(code)
+            return code
+        return output
+
+    def test_hits_and_misses(self):
+        cache = FunctionCache()
+        self.assertEqual(cache.stats, {"size": 0, "hits": 0, "misses": 0})
+        self.assertTrue(cache.stats.hit_rate == None)
+
+        f = cache.get("a", self.source("row.a"))
+        self.assertTrue(cache.get("a", self.source("row.a")) is f)
+        self.assertTrue(cache.get("a", self.source("row.a")) is f)
+        cache.get("b", self.source("row.b"))
+
+        self.assertEqual(f(Data(a=3)), 3)
+        # THE SOURCE IS ONLY CONVERTED ON A MISS
+        self.assertEqual(self.sources, ["row.a", "row.b"])
+        self.assertEqual(cache.stats, {"size": 2, "hits": 2, "misses": 2, "hit_rate": 0.5})
+
+    def test_lru_eviction(self):
+        cache = FunctionCache(max_size=2)
+        cache.get("a", self.source("row.a"))
+        cache.get("b", self.source("row.b"))
+        cache.get("a", self.source("row.a"))  # b IS NOW THE LEAST RECENTLY USED
+        cache.get("c", self.source("row.c"))
+        self.assertEqual(cache.stats.size, 2)
+
+        cache.get("a", self.source("row.a"))
+        cache.get("c", self.source("row.c"))
+        self.assertEqual(self.sources, ["row.a", "row.b", "row.c"])
+        cache.get("b", self.source("row.b"))
+        self.assertEqual(self.sources, ["row.a", "row.b", "row.c", "row.b"])
+
+    def test_equal_expressions_share_an_entry(self):
+        # expressions HOLDS ITS OWN REFERENCE TO THE PROCESS-WIDE CACHE
+        old, expressions.compiled = expressions.compiled, FunctionCache()
+        try:
+            f = jx_expression_to_function({"eq": {"a": 1}})
+            g = jx_expression_to_function(jx_expression({"eq": ["a", {"literal": 1}]}))
+            h = jx_expression_to_function({"eq": {"a": 2}})
+            stats = expressions.compiled.stats
+        finally:
+            expressions.compiled = old
+
+        self.assertTrue(f is g)
+        self.assertFalse(f is h)
+        self.assertEqual(stats, {"size": 2, "hits": 1, "misses": 2})
+        self.assertTrue(f(Data(a=1)))
+        self.assertFalse(h(Data(a=1)))
+
+    def test_canonical_key(self):
+        for expr in [
+            {"eq": {"a": 1}},
+            {"gt": {"a": 1}},
+            {"not": {"eq": {"a": 1}}},
+            {"add": ["a", "b"]},
+            {"sub": ["a", 1]},
+            {"case": [{"when": {"eq": {"a": 1}}, "then": "b"}, "c"]},
+            {"literal": {"x": [1, 2]}},
+            {"concat": ["a", "b"], "separator": ","},
+            {"between": {"a": ["x", "y"]}}
+        ]:
+            key = canonical_key(jx_expression(expr))
+            self.assertTrue(key is not None, "expecting a key for " + unicode(expr))
+            self.assertEqual(canonical_key(jx_expression(expr)), key)
+
+        self.assertFalse(canonical_key(jx_expression({"gt": {"a": 1}})) == canonical_key(jx_expression({"gte": {"a": 1}})))
@@ -0,0 +1,108 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from time import sleep
+
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from pyLibrary.env import http
+from pyLibrary.env.http import SessionPool
+
+BODY = b"hello " * 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header(b"Content-Length", unicode(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessionPool(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer((b"localhost", 0), Handler)
+        cls.url = "http://localhost:" + unicode(cls.server.server_port) + "/"
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_reuse(self):
+        pool = SessionPool()
+        a = pool.checkout("http://localhost:9200/a")
+        pool.checkin("http://localhost:9200/a", a)
+        b = pool.checkout("http://localhost:9200/b")
+        self.assertTrue(a is b)
+        self.assertEqual(pool.stats, {"in_use": 1, "idle": 0, "created": 1, "reused": 1})
+
+    def test_hosts_are_separate(self):
+        pool = SessionPool()
+        a = pool.checkout("http://localhost:9200/")
+        pool.checkin("http://localhost:9200/", a)
+        b = pool.checkout("http://localhost:9201/")
+        self.assertFalse(a is b)
+        self.assertEqual(pool.stats, {"in_use": 1, "idle": 1, "created": 2, "reused": 0})
+
+    def test_size(self):
+        pool = SessionPool(size=2)
+        sessions = [pool.checkout("http://localhost:9200/") for _ in range(4)]
+        for s in sessions:
+            pool.checkin("http://localhost:9200/", s)
+        self.assertEqual(pool.stats, {"in_use": 0, "idle": 2, "created": 4, "reused": 0})
+
+    def test_idle_timeout(self):
+        pool = SessionPool(idle_timeout=0.05)
+        a = pool.checkout("http://localhost:9200/")
+        pool.checkin("http://localhost:9200/", a)
+        sleep(0.1)
+        b = pool.checkout("http://localhost:9200/")
+        self.assertFalse(a is b)
+        self.assertEqual(pool.stats, {"in_use": 1, "idle": 0, "created": 2, "reused": 0})
+
+    def test_streamed_response_is_in_use_until_read(self):
+        pool = SessionPool()
+        response = http.get(self.url, pool=pool)
+        self.assertEqual(pool.stats.in_use, 1)
+        self.assertEqual(response.all_content, BODY)
+        self.assertEqual(pool.stats, {"in_use": 0, "idle": 1})
+
+        response = http.get(self.url, pool=pool)
+        self.assertEqual(pool.stats, {"in_use": 1, "idle": 0, "reused": 1})
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(pool.stats, {"in_use": 0, "idle": 1})
+
+    def test_streamed_response_closed(self):
+        pool = SessionPool()
+        response = http.get(self.url, pool=pool)
+        response.close()
+        response.close()
+        self.assertEqual(pool.stats, {"in_use": 0, "idle": 1})
+
+    def test_unstreamed_response(self):
+        pool = SessionPool()
+        response = http.request(b"get", self.url, pool=pool)
+        self.assertEqual(pool.stats, {"in_use": 0, "idle": 1})
+        self.assertEqual(response.content, BODY)
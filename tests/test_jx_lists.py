@@ -0,0 +1,301 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_collections.matrix import Matrix
+from mo_dots import unwrap
+from mo_math import stats, sketches
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from pyLibrary import convert
+from pyLibrary.queries import jx, windows
+from pyLibrary.queries.containers.list_usingColumns import ColumnarContainer
+from pyLibrary.queries.containers.list_usingPythonList import ListContainer
+from pyLibrary.queries.expressions import jx_expression
+from pyLibrary.queries.lists import aggs
+
+DATA = [
+    {"a": 2, "b": 1},
+    {"a": 1},
+    {"a": 2, "b": 3},
+    {"b": 4}
+]
+
+ROWS = [
+    {"a": i % 3, "b": {"c": ["x", "y", None][i % 4 % 3]}, "f": i / 2, "n": [{"q": i}] if i % 2 else None}
+    for i in range(20)
+]
+
+
+class TestJxLists(FuzzyTestCase):
+    """
+    jx OPERATIONS ON PLAIN PYTHON LISTS, NO CONTAINER NEEDED
+    """
+
+    def test_groupby_first_seen_order(self):
+        result = [(unwrap(g), unwrap(list(v))) for g, v in jx.groupby(DATA, "a")]
+        self.assertEqual(result, [
+            ({"a": 2}, [{"a": 2, "b": 1}, {"a": 2, "b": 3}]),
+            ({"a": 1}, [{"a": 1}]),
+            ({}, [{"b": 4}])
+        ])
+
+    def test_groupby_ordered(self):
+        result = [g.a for g, _ in jx.groupby(DATA, "a", ordered=True)]
+        self.assertEqual(result, [1, 2, None])
+
+    def test_groupby_generator(self):
+        result = [len(v) for _, v in jx.groupby(iter(DATA), ["a", "b"])]
+        self.assertEqual(result, [1, 1, 1, 1])
+
+    def test_groupby_empty(self):
+        self.assertEqual(list(jx.groupby([], "a") or []), [])
+
+    def test_sort_nulls_last(self):
+        result = jx.sort([3, None, 1, "a", 2])
+        self.assertEqual(unwrap(result), [1, 2, 3, "a", None])
+
+    def test_sort_descending_strings(self):
+        data = [{"v": v} for v in ["ab", None, "b", "abc", "a"]]
+        result = [d["v"] for d in unwrap(jx.sort(data, {"field": "v", "sort": -1}))]
+        self.assertEqual(result, [None, "b", "abc", "ab", "a"])
+
+    def test_sort_multiple_fields(self):
+        data = [{"a": 1, "b": 2}, {"a": 2, "b": 1}, {"a": 1, "b": 3}, {"b": 0}]
+        result = unwrap(jx.sort(data, [{"field": "a", "sort": -1}, "b"]))
+        self.assertEqual(result, [{"b": 0}, {"a": 2, "b": 1}, {"a": 1, "b": 2}, {"a": 1, "b": 3}])
+
+    def test_sort_structures(self):
+        data = [{"v": [2]}, {"v": [1, 2]}, {"v": None}, {"v": [1]}]
+        result = [d["v"] for d in unwrap(jx.sort(data, "v"))]
+        self.assertEqual(result, [[1], [1, 2], [2], None])
+
+    def test_sort_limit_matches_full_sort(self):
+        data = [{"a": (i * 7) % 11 or None, "i": i} for i in range(200)]
+        sort = [{"field": "a", "sort": -1}, "i"]
+        full = unwrap(jx.sort(data, sort))
+        top = unwrap(jx.sort(data, sort, limit=5))
+        self.assertEqual(top, full[:5])
+
+    def test_run_explicit_limit(self):
+        data = [{"a": i % 3, "i": i} for i in range(100)]
+        result = jx.run({"from": data, "sort": ["a", {"field": "i", "sort": -1}], "limit": 3})
+        self.assertEqual([d["i"] for d in result.data], [99, 96, 93])
+        self.assertEqual(len(jx.run({"from": data, "sort": "a"}).data), 100)
+
+    def test_columnar_storage(self):
+        container = ColumnarContainer("test", ROWS)
+        self.assertEqual(
+            {k: v.__class__.__name__ for k, v in container.columns.items()},
+            {"a": "_NumberColumn", "b.c": "_StringColumn", "f": "_NumberColumn", "n": "_ObjectColumn"}
+        )
+        self.assertEqual(unwrap(list(container)), ROWS)
+
+    def test_columnar_setop(self):
+        query = {
+            "where": {"and": [{"in": {"b.c": ["x", "y"]}}, {"gte": {"f": 2}}]},
+            "sort": [{"field": "a", "sort": -1}, "f"],
+            "limit": 4
+        }
+        expected = jx.run(dict(query, **{"from": ListContainer("test", ROWS)})).format("list").data
+        result = jx.run(dict(query, **{"from": ColumnarContainer("test", ROWS)})).format("list").data
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result, expected)
+
+    def test_columnar_aggs(self):
+        query = {
+            "edges": [{"name": "c", "value": "b.c"}],
+            "select": [{"value": "f", "aggregate": "sum"}, {"aggregate": "count"}]
+        }
+        expected = jx.run(dict(query, **{"from": ROWS}))
+        result = jx.run(dict(query, **{"from": ColumnarContainer("test", ROWS)}))
+        self.assertEqual(result.edges[0].domain.partitions.value, expected.edges[0].domain.partitions.value)
+        for name in ["f", "count"]:
+            self.assertEqual(result.data[name].cube, expected.data[name].cube)
+
+    def test_columnar_groupby(self):
+        result = [(g.b.c, len(v)) for g, v in ColumnarContainer("test", ROWS).groupby(["b.c"])]
+        self.assertEqual(result, [("x", 10), ("y", 5), (None, 5)])
+
+    def test_vector_matches_python(self):
+        container = ColumnarContainer("test", ROWS)
+        for expr in [
+            {"add": ["a", "f"]},
+            {"sub": ["f", 1]},
+            {"mult": ["a", "f"]},
+            {"eq": {"b.c": "x"}},
+            {"in": {"a": [0, 2]}},
+            {"gt": {"f": 3}},
+            {"and": [{"exists": "b.c"}, {"lt": {"a": 2}}]},
+            {"or": [{"missing": "b.c"}, {"not": {"eq": {"a": 1}}}]},
+            {"coalesce": ["b.c", "a"]}
+        ]:
+            func = jx.get(expr)
+            expected = [func(r) for r in container]
+            result = jx_expression(expr).to_vector(container)
+            self.assertEqual(result, expected, "Problem with " + convert.value2json(expr))
+
+    def test_window_rownum(self):
+        data = [{"g": i % 2, "v": (i * 7) % 10} for i in range(10)]
+        result = jx.run({"from": data, "window": [{"name": "r", "value": "rownum", "edges": ["g"], "sort": "v"}]})
+        self.assertEqual([(d["v"], d["r"]) for d in unwrap(result.data) if d["g"] == 0], [(0, 0), (4, 2), (8, 4), (2, 1), (6, 3)])
+        self.assertTrue(all("__temp__" not in d for d in unwrap(result.data)))
+
+    def test_window_sliding_aggregates(self):
+        for aggregate, expected in [
+            ("sum", [0, 2, 6, 10, 14]),
+            ("min", [0, 0, 2, 4, 6]),
+            ("max", [0, 2, 4, 6, 8]),
+            ("median", [0, 1, 3, 5, 7])
+        ]:
+            data = [{"g": i % 2, "v": (i * 7) % 10} for i in range(10)]
+            result = jx.run({"from": data, "window": [{
+                "name": "s",
+                "value": "v",
+                "edges": ["g"],
+                "sort": "v",
+                "aggregate": aggregate,
+                "range": {"min": -1, "max": 1}
+            }]})
+            evens = jx.sort([d for d in unwrap(result.data) if d["g"] == 0], "v")
+            self.assertEqual([d["s"] for d in evens], expected, "Problem with " + aggregate)
+
+    def test_window_unknown_aggregate(self):
+        data = [{"g": i % 2, "v": i} for i in range(10)]
+        self.assertRaises("Do not know window aggregate", jx.run, {"from": data, "window": [{
+            "name": "s",
+            "value": "v",
+            "edges": ["g"],
+            "sort": "v",
+            "aggregate": "no_such_aggregate",
+            "range": {"min": -1, "max": 1}
+        }]})
+
+    def test_sliding_percentile(self):
+        values = [(i * 37) % 17 for i in range(100)]
+        total = windows.SlidingPercentile(percentile=0.9)
+        for i, v in enumerate(values):
+            total.add(v)
+            if i >= 10:
+                total.sub(values[i - 10])
+            self.assertAlmostEqual(total.end(), stats.percentile(values[max(0, i - 9):i + 1], 0.9))
+
+    def test_flat_matrix(self):
+        nested = Matrix(dims=(3, 2), zeros=0)
+        flat = Matrix(dims=(3, 2), zeros=0, flat=True)
+        for m in [nested, flat]:
+            m[(0, 1)] = 4
+            m[(2, 0)] = None
+            m[(1, 1)] = 2
+        self.assertEqual(list(flat.items()), list(nested.items()))
+        self.assertEqual(flat.aggregate("max"), 4)
+        self.assertEqual(flat.aggregate("min"), 0)
+        self.assertEqual([(g, unwrap(m.cube)) for g, m in flat.groupby([0, 1])], [((-1, 0), [0, 0, None]), ((-1, 1), [4, 2, 0])])
+        self.assertEqual(flat.cube, [[0, 4], [0, 2], [None, 0]])
+        flat[(1, 0)] = "a"
+        self.assertEqual(flat[(1, 0)], "a")
+
+    def test_flat_matrix_fallback(self):
+        m = Matrix(dims=(2, 2), zeros=0, flat=True)
+        m[(0, 0)] = 1.5
+        m[(1, 1)] = True
+        self.assertEqual(m.cube, [[1.5, 0], [0, True]])
+        self.assertTrue(m[(1, 1)] is True)
+
+    def test_parallel_aggs(self):
+        query = {
+            "from": ROWS,
+            "edges": [{"name": "c", "value": "b.c"}],
+            "select": [
+                {"name": "f", "value": "f", "aggregate": "sum"},
+                {"name": "m", "value": "f", "aggregate": "max"},
+                {"aggregate": "count"}
+            ]
+        }
+        expected = jx.run(dict(query))
+        min_rows, aggs.MIN_ROWS_PER_PROCESS = aggs.MIN_ROWS_PER_PROCESS, 5
+        processes, aggs.PROCESSES = aggs.PROCESSES, 3
+        try:
+            result = jx.run(dict(query))
+        finally:
+            aggs.MIN_ROWS_PER_PROCESS = min_rows
+            aggs.PROCESSES = processes
+        for name in ["f", "m", "count"]:
+            self.assertEqual(result.data[name].cube, expected.data[name].cube)
+
+    def test_generator_pipeline(self):
+        consumed = []
+
+        def rows():
+            for r in ROWS:
+                consumed.append(r)
+                yield r
+
+        result = jx.run({"from": rows(), "where": {"eq": {"b.c": "y"}}, "select": ["a", "f"], "limit": 2})
+        self.assertEqual(unwrap(result.data), [{"a": 1, "f": 0.5}, {"a": 2, "f": 2.5}])
+        self.assertEqual(len(consumed), 6)
+
+        result = jx.run({"from": (r for r in ROWS), "where": {"eq": {"b.c": "y"}}, "select": "f", "sort": {"field": "f", "sort": -1}})
+        self.assertEqual(unwrap(result.data), [8.5, 6.5, 4.5, 2.5, 0.5])
+
+    def test_select_leaves(self):
+        data = [{"a": 1, "b": {"c": 2, "d": {"e": 3}}}, {"a": 4}]
+        result = jx.run({"from": data, "select": "*"})
+        self.assertEqual(unwrap(result.data), data)
+
+        result = jx.run({"from": data, "select": ["a", {"name": "x", "value": "b.*"}]})
+        self.assertEqual(unwrap(result.data), [{"a": 1, "x": {"c": 2, "d": {"e": 3}}}, {"a": 4}])
+
+        result = jx.run({"from": (d for d in data), "select": "b.*"})
+        self.assertEqual(unwrap(result.data), [{"b": {"c": 2, "d": {"e": 3}}}, None])
+
+    def test_approximate_aggs(self):
+        data = [{"g": i % 2, "v": (i * 7919) % 1000, "k": i % 300} for i in range(4000)]
+        query = {
+            "from": data,
+            "edges": [{"name": "g", "value": "g"}],
+            "select": [
+                {"name": "p", "value": "v", "aggregate": "percentile", "percentile": 0.9},
+                {"name": "c", "value": "k", "aggregate": "cardinality"}
+            ]
+        }
+        exact = jx.run(query)
+        for s in query["select"]:
+            s["approximate"] = True
+        approx = jx.run(query)
+        for (_, e), (_, a) in zip(exact.data["p"].items(), approx.data["p"].items()):
+            if e is not None:
+                self.assertAlmostEqual(a, e, delta=10)
+        for (_, e), (_, a) in zip(exact.data["c"].items(), approx.data["c"].items()):
+            self.assertAlmostEqual(a, e, delta=6)
+
+    def test_sketch_merge(self):
+        whole = windows.ApproxPercentile(percentile=0.25)
+        parts = [windows.ApproxPercentile(percentile=0.25) for _ in range(3)]
+        for i in range(30):
+            whole.add(i)
+            parts[i % 3].add(i)
+        parts[0].merge(parts[1])
+        parts[0].merge(parts[2])
+        self.assertEqual(parts[0].end(), whole.end())
+        self.assertEqual(whole.end(), stats.percentile(range(30), 0.25))
+
+    def test_approx_cardinality_colliding_hash(self):
+        # hash(-1) == hash(-2) IN PYTHON
+        agg = windows.ApproxCardinality()
+        for v in [-1, -2, -1]:
+            agg.add(v)
+        self.assertEqual(agg.end(), 2)
+
+    def test_sketch_hash_is_stable(self):
+        # THE SAME IN EVERY PROCESS, NO MATTER THE PYTHONHASHSEED, SO SKETCHES CAN BE MERGED ACROSS PROCESSES
+        self.assertEqual(sketches._hash("abc"), 12299450088873581035)
+        self.assertEqual(sketches._hash({"a": [1, 2]}), sketches._hash({"a": [1, 2]}))
@@ -0,0 +1,67 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from tempfile import mkdtemp
+
+from mo_dots import Data, wrap
+from mo_files import File
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from pyLibrary.queries import meta
+from pyLibrary.queries.containers.list_usingPythonList import ListContainer
+
+
+def _metadata(snapshot):
+    """
+    FromESMetadata WITHOUT THE CLUSTER
+    """
+    m = object.__new__(meta.FromESMetadata)
+    m.meta = Data()
+    m.meta.tables = ListContainer("meta.tables", [], wrap({}))
+    m.meta.columns = meta.ColumnList()
+    m.todo = meta.ColumnQueue("unittest")
+    m.snapshot = snapshot
+    return m
+
+
+class TestMetaSnapshot(FuzzyTestCase):
+
+    def setUp(self):
+        self.directory = File(mkdtemp())
+        self.snapshot = File.new_instance(self.directory, "metadata_snapshot.json")
+
+    def tearDown(self):
+        self.directory.delete()
+
+    def test_bad_line_is_skipped(self):
+        self.snapshot.write([
+            '{"table": {"name": "unittest", "timestamp": 1000}}\n',
+            '{"table": {"name": \n',
+            '{"table": {"name": "unittest2", "timestamp": 2000}}\n'
+        ])
+        m = _metadata(self.snapshot)
+        m._load_snapshot()
+        self.assertEqual(sorted(t.name for t in m.meta.tables.data), ["unittest", "unittest2"])
+
+    def test_save_and_load(self):
+        m = _metadata(self.snapshot)
+        m.meta.tables.add(meta.Table(name="unittest", url=None, query_path=None, timestamp=1000))
+        m.meta.tables.add(meta.Table(name="meta.columns", url=None, query_path=None, timestamp=1000))
+        m._save_snapshot()
+
+        # NO TEMP FILE IS LEFT BEHIND
+        self.assertEqual([f.abspath for f in self.directory.children], [self.snapshot.abspath])
+
+        loaded = _metadata(self.snapshot)
+        loaded._load_snapshot()
+        self.assertEqual([t.name for t in loaded.meta.tables.data], ["unittest"])
+        self.assertEqual(loaded.meta.tables.data[0].timestamp.unix, 1000)
@@ -0,0 +1,90 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Data, wrap
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from active_data.actions.query_cache import QueryCache
+from pyLibrary.queries import meta
+from pyLibrary.queries.containers import Container
+from pyLibrary.queries.jx_usingES import FromES
+
+
+class FakeMeta(object):
+    """
+    STAND-IN FOR FromESMetadata, ONLY get_table() IS USED
+    """
+    def __init__(self):
+        self.table = Data(last_updated=None)
+
+    def get_table(self, table_name):
+        return [self.table]
+
+
+class TestQueryCache(FuzzyTestCase):
+
+    def setUp(self):
+        self.old_singlton = meta.singlton
+        meta.singlton = self.meta = FakeMeta()
+        self.cache = QueryCache(max_size=2, max_age=600)
+        self.frum = Container.__new__(FromES)
+        self.frum.name = "unittest.run"
+
+    def tearDown(self):
+        meta.singlton = self.old_singlton
+
+    def test_hit_and_miss(self):
+        key = self.cache.key(wrap({"from": "unittest", "limit": 10}), self.frum)
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.add(key, wrap({"data": [1, 2], "meta": {"format": "list"}}))
+        self.assertEqual(self.cache.get(key).data, [1, 2])
+        other = self.cache.key(wrap({"from": "unittest", "limit": 20}), self.frum)
+        self.assertEqual(self.cache.get(other), None)
+        self.assertEqual(self.cache.stats, {"size": 1, "hits": 1, "misses": 2})
+
+    def test_not_cacheable(self):
+        self.assertEqual(self.cache.key(wrap({"from": "unittest", "meta": {"testing": True}}), self.frum), None)
+        self.assertEqual(self.cache.key(wrap({"from": "unittest"}), [1, 2, 3]), None)
+
+    def test_lru_eviction(self):
+        keys = [self.cache.key(wrap({"from": "unittest", "limit": i}), self.frum) for i in range(3)]
+        self.cache.add(keys[0], wrap({"data": [0]}))
+        self.cache.add(keys[1], wrap({"data": [1]}))
+        self.cache.get(keys[0])  # keys[1] IS NOW THE LEAST RECENTLY USED
+        self.cache.add(keys[2], wrap({"data": [2]}))
+        self.assertEqual(self.cache.get(keys[1]), None)
+        self.assertEqual(self.cache.get(keys[0]).data, [0])
+        self.assertEqual(self.cache.get(keys[2]).data, [2])
+
+    def test_invalidate_on_last_updated(self):
+        key = self.cache.key(wrap({"from": "unittest"}), self.frum)
+        self.meta.table.last_updated = 1000
+        self.cache.add(key, wrap({"data": [1]}))
+        self.assertEqual(self.cache.get(key).data, [1])
+        self.meta.table.last_updated = 2000
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.stats.size, 0)
+
+    def test_results_are_not_shared(self):
+        key = self.cache.key(wrap({"from": "unittest"}), self.frum)
+        original = wrap({"data": [{"a": [1]}], "meta": {"timing": {"total": 1}}})
+        self.cache.add(key, original)
+        original.data[0].a.append(2)  # CHANGING THE ORIGINAL DOES NOT CHANGE THE CACHE
+
+        first = self.cache.get(key)
+        first.data[0].a.append(3)
+        first.meta.timing.cache = "hit"
+
+        second = self.cache.get(key)
+        self.assertEqual(second.data, [{"a": [1]}])
+        self.assertEqual(second.meta.timing, {"total": 1})
+
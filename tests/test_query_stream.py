@@ -0,0 +1,73 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_times.timer import Timer
+from active_data.actions import query
+from pyLibrary import convert
+
+
+def _result(data, format="list"):
+    return wrap({
+        "meta": {"format": format, "timing": {"preamble": 0.1}},
+        "header": ["a", "b"],
+        "data": data
+    })
+
+
+def _rows(num, fail_at=None):
+    for i in range(num):
+        if i == fail_at:
+            raise Exception("broken row source")
+        yield {"a": i, "b": "b" + unicode(i)}
+
+
+class TestQueryStream(FuzzyTestCase):
+
+    def test_streamable(self):
+        self.assertEqual(query._is_streamable(_result(list(_rows(10)))), False)
+        self.assertEqual(query._is_streamable(_result(list(_rows(query.STREAM_THRESHOLD + 1)))), True)
+        self.assertEqual(query._is_streamable(_result(_rows(10))), True)
+        self.assertEqual(query._is_streamable(_result(list(_rows(query.STREAM_THRESHOLD + 1)), format="cube")), False)
+
+    def test_stream_matches_buffered(self):
+        num = query.STREAM_BATCH * 2 + 7
+        buffered = convert.json2value(convert.value2json(_result(list(_rows(num)))))
+        with Timer("total") as timer:
+            streamed = convert.json2value(convert.utf82unicode(b"".join(query._stream(_result(_rows(num)), timer))))
+
+        self.assertEqual(streamed.data, buffered.data)
+        self.assertEqual(streamed.header, buffered.header)
+        self.assertEqual(streamed.meta.format, "list")
+        self.assertEqual(streamed.meta.error, None)
+        self.assertTrue(streamed.meta.timing.total >= 0)
+
+    def test_stream_empty(self):
+        with Timer("total") as timer:
+            streamed = convert.json2value(convert.utf82unicode(b"".join(query._stream(_result([]), timer))))
+        self.assertEqual(streamed.data, [])
+
+    def test_early_error_is_raised(self):
+        # NOTHING IS SENT YET, SO THE CALLER CAN STILL RESPOND WITH AN ERROR
+        with Timer("total") as timer:
+            self.assertRaises(Exception, query._stream, _result(_rows(10, fail_at=3)), timer)
+
+    def test_late_error_ends_body(self):
+        num = query.STREAM_BATCH * 3
+        with Timer("total") as timer:
+            chunks = query._stream(_result(_rows(num, fail_at=query.STREAM_BATCH + 5)), timer)
+            streamed = convert.json2value(convert.utf82unicode(b"".join(chunks)))
+
+        self.assertEqual(len(streamed.data), query.STREAM_BATCH)
+        self.assertTrue("broken row source" in convert.value2json(streamed.meta.error))
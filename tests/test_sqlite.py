@@ -0,0 +1,270 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from tempfile import mkdtemp
+
+from mo_files import File
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Thread
+from pyLibrary.queries.containers.list_usingSQLite import Table_usingSQLite, INDEX_THRESHOLD
+from pyLibrary.queries.meta import Column
+from pyLibrary.sql import sqlite
+from pyLibrary.sql.sqlite import Sqlite, parameterize, MAX_PARAMETERS
+
+
+def _rows(db, command):
+    return [tuple(r) for r in db.query(command).data]
+
+
+def _query_with_timeout(db, command, seconds=10):
+    """
+    :return: THE RESULT OF db.query(), OR None IF IT HANGS
+    """
+    result = []
+    t = threading.Thread(target=lambda: result.append(_rows(db, command)))
+    t.daemon = True
+    t.start()
+    t.join(seconds)
+    return result[0] if result else None
+
+
+class TestSqlite(FuzzyTestCase):
+    """
+    Sqlite AND Table_usingSQLite, ON A PRIVATE DATABASE
+    """
+
+    def setUp(self):
+        self.old_debug, sqlite.DEBUG = sqlite.DEBUG, False
+        self.directory = File(mkdtemp())
+
+    def tearDown(self):
+        sqlite.DEBUG = self.old_debug
+        self.directory.delete()
+
+    def _file_db(self, readers):
+        return Sqlite(filename=File.new_instance(self.directory, "unittest.sqlite").abspath, readers=readers)
+
+    def test_execute_many(self):
+        db = Sqlite()
+        db.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+        result = db.execute_many([
+            ("INSERT INTO t (a, b) VALUES (?, ?)", [(1, "x"), (2, "y")]),
+            ("INSERT INTO t (a) VALUES (3)", None)
+        ])
+        self.assertEqual(result.rows, 3)
+        self.assertEqual(_rows(db, "SELECT a, b FROM t ORDER BY a"), [(1, "x"), (2, "y"), (3, None)])
+
+    def test_execute_many_rollback(self):
+        db = Sqlite()
+        db.execute("CREATE TABLE t (a INTEGER PRIMARY KEY)")
+        db.execute("INSERT INTO t (a) VALUES (1)")
+        self.assertRaises(Exception, db.execute_many, [
+            ("INSERT INTO t (a) VALUES (?)", [(2,), (3,)]),
+            ("INSERT INTO t (a) VALUES (?)", [(4,), (1,)])  # DUPLICATE KEY
+        ])
+        self.assertEqual(_rows(db, "SELECT a FROM t"), [(1,)])
+
+    def test_insert_later_batches(self):
+        table = Table_usingSQLite("unittest_later", db=Sqlite())
+        table.insert([{"a": 1, "b": "x"}])
+        table.insert([{"a": 2, "b": "y"}, {"a": 3}])
+        rows = table.db.query("SELECT * FROM unittest_later ORDER BY __id__")
+        values = [dict(zip(rows.header, r)) for r in rows.data]
+        self.assertEqual([(v["a.$number"], v["b.$string"]) for v in values], [(1, "x"), (2, "y"), (3, None)])
+
+    def test_insert_large_batch(self):
+        # MORE ROWS THAN SQLITE ALLOWS IN ONE COMPOUND SELECT (500)
+        num = 1200
+        table = Table_usingSQLite("unittest_large", db=Sqlite())
+        result = table.insert([{"a": i} for i in range(num)])
+        self.assertEqual(result.rows, num)
+        self.assertEqual(_rows(table.db, "SELECT COUNT(1), SUM(\"a.$number\") FROM unittest_large"), [(num, num * (num - 1) / 2)])
+
+    def test_wal_mode(self):
+        db = self._file_db(readers=2)
+        self.assertEqual(_rows(db, "PRAGMA journal_mode"), [("wal",)])
+
+    def test_read_pool(self):
+        db = self._file_db(readers=2)
+        db.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+        db.execute("INSERT INTO t (a, b) VALUES (1, 'x')")
+        # A READ SEES THE WRITES SENT BEFORE IT
+        self.assertEqual(_rows(db, "SELECT a, b FROM t"), [(1, "x")])
+
+        # READERS HAVE THE SAME FUNCTIONS AS THE WRITER
+        self.assertEqual(_rows(db, "SELECT regex('x.*', b) FROM t"), [(1,)])
+
+        def read(please_stop):
+            for i in range(20):
+                self.assertEqual(_rows(db, "SELECT COUNT(1) FROM t"), [(1,)])
+
+        threads = [Thread.run("reader " + unicode(i), read) for i in range(5)]
+        for t in threads:
+            t.join()
+        self.assertTrue(1 <= db.num_readers <= 2)
+        self.assertEqual(len(db.read_pool), db.num_readers)
+
+        # READERS CAN NOT WRITE
+        self.assertRaises(Exception, db._read, "INSERT INTO t (a) VALUES (2)", None)
+
+    def test_transaction(self):
+        db = Sqlite()
+        db.execute("CREATE TABLE t (a INTEGER PRIMARY KEY)")
+        with db.transaction() as t:
+            t.execute("INSERT INTO t (a) VALUES (1)")
+            t.execute_many("INSERT INTO t (a) VALUES (?)", [(2,), (3,)])
+            # NOTHING IS RUN UNTIL THE BLOCK ENDS
+            self.assertEqual(_rows(db, "SELECT COUNT(1) FROM t"), [(0,)])
+        self.assertEqual(_rows(db, "SELECT a FROM t ORDER BY a"), [(1,), (2,), (3,)])
+
+        # NOTHING IS RUN IF THE BLOCK RAISES
+        try:
+            with db.transaction() as t:
+                t.execute("INSERT INTO t (a) VALUES (4)")
+                raise Exception("abandon")
+        except Exception:
+            pass
+        self.assertEqual(_rows(db, "SELECT COUNT(1) FROM t"), [(3,)])
+
+        # ALL, OR NOTHING, IS COMMITTED
+        def fail():
+            with db.transaction() as t:
+                t.execute("INSERT INTO t (a) VALUES (5)")
+                t.execute("INSERT INTO t (a) VALUES (1)")
+        self.assertRaises(Exception, fail)
+        self.assertEqual(_rows(db, "SELECT COUNT(1) FROM t"), [(3,)])
+
+    def test_usage_index(self):
+        table = Table_usingSQLite("unittest_usage", db=Sqlite())
+        table.insert([{"a": i % 3, "b": "x" + unicode(i)} for i in range(10)])
+        query = lambda: {"from": "unittest_usage", "where": {"eq": {"a": 1}}, "select": "b", "format": "list"}
+        for i in range(INDEX_THRESHOLD - 1):
+            table.query(query())
+        self.assertEqual(len(table.indexes), 0)
+
+        table.query(query())
+        self.assertEqual(
+            [(i.table, i.columns, i.reason) for i in table.indexes.values()],
+            [("unittest_usage", ["a.$number"], "usage")]
+        )
+        self.assertEqual(
+            _rows(table.db, "SELECT tbl_name FROM sqlite_master WHERE type='index' AND name NOT LIKE 'sqlite%'"),
+            [("unittest_usage",)]
+        )
+
+    def test_usage_from_many_threads(self):
+        table = Table_usingSQLite("unittest_threads", db=Sqlite())
+        table.insert([{"a": i % 3} for i in range(10)])
+        def run(please_stop):
+            for i in range(10):
+                table.query({"from": "unittest_threads", "where": {"eq": {"a": 1}}, "format": "list"})
+
+        threads = [Thread.run("query " + unicode(i), run) for i in range(5)]
+        for t in threads:
+            t.join()
+        self.assertEqual(table.column_usage, {("unittest_threads", "a.$number"): 50})
+        self.assertEqual(len(table.indexes), 1)
+
+    def test_join_index(self):
+        table = Table_usingSQLite("unittest_join", db=Sqlite())
+        column = Column(
+            names={"unittest_join": "n"},
+            type="nested",
+            es_column="n",
+            es_index="unittest_join",
+            nested_path=["."]
+        )
+        table._nest_column(column, "n")
+        self.assertEqual(
+            [(i.table, i.columns, i.reason) for i in table.indexes.values()],
+            [("unittest_join.n", ["__parent__", "__order__"], "join")]
+        )
+        self.assertEqual(
+            _rows(table.db, "SELECT tbl_name FROM sqlite_master WHERE type='index' AND name NOT LIKE 'sqlite%'"),
+            [("unittest_join.n",)]
+        )
+
+    def _big_table(self):
+        db = Sqlite()
+        db.execute("CREATE TABLE t (a INTEGER)")
+        db.execute_many([("INSERT INTO t (a) VALUES (?)", [(i,) for i in range(10000)])])
+        return db
+
+    def test_query_stream(self):
+        db = self._big_table()
+        self.assertEqual(sum(r[0] for r in db.query_stream("SELECT a FROM t")), 10000 * 9999 / 2)
+        self.assertEqual(_query_with_timeout(db, "SELECT COUNT(1) FROM t"), [(10000,)])
+
+    def test_query_stream_dropped(self):
+        # THE CALLER NEVER ASKS FOR A ROW
+        db = self._big_table()
+        it = db.query_stream("SELECT a FROM t")
+        del it
+        self.assertEqual(_query_with_timeout(db, "SELECT COUNT(1) FROM t"), [(10000,)])
+
+    def test_query_stream_closed(self):
+        db = self._big_table()
+        it = db.query_stream("SELECT a FROM t")
+        self.assertEqual(next(it), (0,))
+        it.close()
+        self.assertEqual(list(it), [])
+        self.assertEqual(_query_with_timeout(db, "SELECT COUNT(1) FROM t"), [(10000,)])
+
+    def test_query_stream_error(self):
+        db = Sqlite()
+        self.assertRaises("Problem with Sqlite call", list, db.query_stream("SELECT a FROM no_such_table"))
+
+    def test_parameterize(self):
+        self.assertEqual(
+            parameterize("SELECT a FROM t WHERE b = 'it''s' AND c > 3.5 AND d < 1e3 LIMIT 10"),
+            ("SELECT a FROM t WHERE b = ? AND c > ? AND d < ? LIMIT ?", ["it's", 3.5, 1000.0, 10])
+        )
+        # NO LITERALS
+        self.assertEqual(parameterize("SELECT a FROM t"), ("SELECT a FROM t", []))
+
+    def test_parameterize_keeps_positions_and_aliases(self):
+        # COLUMN POSITIONS AFTER BY, AND VALUES AFTER A COMMA, ARE KEPT
+        self.assertEqual(
+            parameterize("SELECT 1, 2 FROM t GROUP BY 1 ORDER BY 2"),
+            ("SELECT ?, 2 FROM t GROUP BY 1 ORDER BY 2", [1])
+        )
+        self.assertEqual(parameterize("SELECT a FROM t WHERE b IN (7, 8)"), ("SELECT a FROM t WHERE b IN (?, 8)", [7]))
+        # STRINGS AFTER AS ARE ALIASES
+        self.assertEqual(
+            parameterize("SELECT 'x' AS 'name', \"y\" as 'other' FROM t"),
+            ("SELECT ? AS 'name', \"y\" as 'other' FROM t", ["x"])
+        )
+
+    def test_parameterize_too_many(self):
+        command = "SELECT a FROM t WHERE " + " OR ".join("b = " + unicode(i) for i in range(MAX_PARAMETERS + 1))
+        self.assertEqual(parameterize(command), (command, []))
+
+        command = "SELECT a FROM t WHERE " + " OR ".join("b = " + unicode(i) for i in range(MAX_PARAMETERS))
+        sql, params = parameterize(command)
+        self.assertEqual(len(params), MAX_PARAMETERS)
+        self.assertFalse(any(c.isdigit() for c in sql))
+
+    def test_sql_cache(self):
+        table = Table_usingSQLite("unittest_cache", db=Sqlite())
+        table.insert([{"a": 1}])
+        query = lambda: {"from": "unittest_cache", "select": ["a", "b"], "format": "list"}
+
+        self.assertEqual(table.query(query()).data, [{"a": 1}])
+        self.assertEqual(table.query(query()).data, [{"a": 1}])
+        self.assertEqual(len(table.sql_cache), 1)
+
+        # THE SCHEMA GROWS, SO THE CACHED SQL (WITHOUT b) IS NOT USED
+        table.insert([{"a": 2, "b": "x"}])
+        self.assertEqual(table.query(query()).data, [{"a": 1}, {"a": 2, "b": "x"}])
+        self.assertEqual(len(table.sql_cache), 2)